@@ -93,6 +93,16 @@ class AskResponse(BaseModel):
     timestamp: datetime
 
 
+class Suggestion(BaseModel):
+    term: str
+    doc_frequency: int
+
+
+class SuggestResponse(BaseModel):
+    prefix: str
+    suggestions: List[Suggestion]
+
+
 # 解决循环引用
 Reference.model_rebuild()
 RetrievalResult.model_rebuild()
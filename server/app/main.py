@@ -1,5 +1,6 @@
 from fastapi import FastAPI, HTTPException, Request
 from typing import Optional
+import asyncio
 import json
 from pathlib import Path
 import uuid
@@ -10,7 +11,7 @@ import uvicorn
 import uuid
 
 from app.config import settings
-from app.api.schemas import HealthCheck, ChatRequest, ChatResponse, Reference, RetrievalResult, AskRequest, AskResponse
+from app.api.schemas import HealthCheck, ChatRequest, ChatResponse, Reference, RetrievalResult, AskRequest, AskResponse, Suggestion, SuggestResponse
 from app.utils.logging import get_logger
 from app.utils.exceptions import CodeRAGException, handle_exception
 
@@ -157,7 +158,7 @@ async def chat(request: Request, chat_request: ChatRequest):
         
         # 检索相关片段
         retriever = Retriever()
-        results = retriever.retrieve(
+        results = await retriever.aretrieve(
             query=user_message,
             embedding=embedding,
             top_k=chat_request.top_k
@@ -235,7 +236,7 @@ async def ask(request: Request, ask_request: AskRequest):
         
         # 检索相关片段
         retriever = Retriever()
-        results = retriever.retrieve(
+        results = await retriever.aretrieve(
             query=ask_request.query,
             embedding=embedding,
             top_k=ask_request.top_k
@@ -265,6 +266,20 @@ async def ask(request: Request, ask_request: AskRequest):
         raise
 
 
+@app.get("/suggest")
+async def suggest(prefix: str, limit: int = 10, field: str = "content"):
+    """基于全文索引词典的自动补全，按文档频率降序返回以 prefix 开头的词项"""
+    from coderag.rag.fulltext_search import get_fulltext_searcher
+
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    try:
+        suggestions = await asyncio.to_thread(get_fulltext_searcher().suggest, prefix, field, limit, True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return SuggestResponse(prefix=prefix, suggestions=[Suggestion(**s) for s in suggestions])
+
+
 @app.post("/eval/run")
 async def run_evaluation(request: Request):
     """运行评测"""
@@ -40,6 +40,29 @@ class Retriever:
             logger.error(f"Error in retrieve: {e}", exc_info=e)
             return []
 
+    async def aretrieve(self, query: str, embedding: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
+        """异步检索相关文档，不阻塞事件循环
+
+        Args:
+            query: 查询文本
+            embedding: 查询嵌入向量
+            top_k: 返回结果数量
+
+        Returns:
+            检索结果列表
+        """
+        try:
+            results = await self.core_retriever.aretrieve(
+                query=query,
+                embedding=embedding,
+                top_k=top_k
+            )
+            logger.info(f"Retrieved {len(results)} results")
+            return results
+        except Exception as e:
+            logger.error(f"Error in aretrieve: {e}", exc_info=e)
+            return []
+
     def hybrid_retrieve(self, query: str, embedding: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
         """混合检索
 
@@ -14,9 +14,20 @@ def cli():
 
 @cli.command()
 @click.argument('repo_path')
-def ingest(repo_path):
+@click.option('--batch-size', type=int, default=1000, help='Points written to the vector store per batch')
+@click.option('--shards', type=int, default=None, help='Number of FAISS shards (rebalances existing data if changed)')
+def ingest(repo_path, batch_size, shards):
     """入库代码库"""
     click.echo(f"Ingesting repository: {repo_path}")
+    if shards is not None:
+        settings.faiss_num_shards = shards
+        from coderag.rag.sharded_faiss_store import get_sharded_store, has_shard_layout
+        if settings.vector_store == "faiss" and (shards > 1 or has_shard_layout()):
+            # 检索器复用同一个分片存储，入库前先按新的分片数重新分布已有数据
+            store = get_sharded_store()
+            if store.num_shards != shards:
+                click.echo(f"Rebalancing FAISS store from {store.num_shards} to {shards} shards")
+                store.rebalance(shards)
 
     loader = RepoLoader(repo_path)
     files = loader.load()
@@ -40,11 +51,30 @@ def ingest(repo_path):
     click.echo(f"Generated embeddings for {len(embedded_chunks)} chunks")
 
     from coderag.rag.retriever import Retriever
-    retriever = Retriever()
-    retriever.add_points(embedded_chunks)
+    retriever = Retriever(enable_fulltext=settings.enable_fulltext)
+    with retriever.fulltext_bulk_load():
+        for start in range(0, len(embedded_chunks), batch_size):
+            retriever.add_points(embedded_chunks[start:start + batch_size])
+    retriever.flush()
     click.echo(f"Ingestion completed successfully using {settings.vector_store}")
 
 
+@cli.command(name='rebalance-shards')
+@click.option('--shards', type=int, required=True, help='Target number of FAISS shards')
+@click.option('--batch-size', type=int, default=10000, help='Chunks moved per batch')
+def rebalance_shards(shards, batch_size):
+    """重新分布 FAISS 分片"""
+    from coderag.rag.sharded_faiss_store import ShardedFaissStore
+
+    store = ShardedFaissStore(num_shards=shards)
+    if store.num_shards != shards:
+        store.rebalance(shards, batch_size=batch_size)
+    stats = store.get_stats()
+    for i, shard_stats in enumerate(stats['shards']):
+        click.echo(f"Shard {i}: {shard_stats['live_chunks']} chunks, {shard_stats['num_vectors']} vectors")
+    store.close()
+
+
 @cli.command(name='ingest-repo')
 @click.argument('repo_path')
 def ingest_repo(repo_path):
@@ -216,6 +246,123 @@ def benchmark(url, num_requests, concurrency, warmup):
     click.echo(f"\nBenchmark results saved to: {output_path}")
 
 
+@cli.command(name='faiss-bench')
+@click.option('--factory', 'factories', type=str, multiple=True, help='faiss.index_factory string, e.g. "IVF4096,PQ32" or "HNSW32" (repeatable)')
+@click.option('--synthetic', type=int, default=0, help='Use N synthetic vectors instead of the current FAISS store')
+@click.option('--dim', type=int, default=None, help='Dimension of synthetic vectors')
+@click.option('--num-queries', type=int, default=1000, help='Number of queries')
+@click.option('--top-k', type=int, default=10, help='Top-k for recall')
+@click.option('--nprobe', type=int, default=None, help='IVF nprobe')
+@click.option('--ef-search', type=int, default=None, help='HNSW efSearch')
+def faiss_bench(factories, synthetic, dim, num_queries, top_k, nprobe, ef_search):
+    """对比 FAISS 索引配置的召回率、延迟与每向量字节数"""
+    from coderag.eval.faiss_benchmark import FaissIndexBenchmark, synthetic_vectors, load_store_vectors
+
+    factories = list(factories) or [settings.faiss_index_factory]
+    nprobe = nprobe or settings.faiss_nprobe
+    ef_search = ef_search or settings.faiss_ef_search
+
+    if synthetic:
+        vectors = synthetic_vectors(synthetic, dim or settings.embedding_dim)
+    else:
+        vectors = load_store_vectors()
+        if vectors is None:
+            click.echo("FAISS store is empty or not reconstructible, use --synthetic N")
+            return
+
+    click.echo(f"Benchmarking {len(factories)} index configs on {len(vectors)} vectors")
+
+    bench = FaissIndexBenchmark(
+        vectors,
+        num_queries=num_queries,
+        top_k=top_k,
+        train_samples=settings.faiss_train_samples,
+    )
+    bench.run("Flat")
+    for factory in factories:
+        if factory.strip().lower() != "flat":
+            bench.run(factory, nprobe=nprobe, ef_search=ef_search)
+
+    output_path = bench.export_results()
+    click.echo(f"\nFAISS benchmark results saved to: {output_path}")
+
+
+@cli.command(name='pgvector-bench')
+@click.option('--synthetic', type=int, default=100000, help='Number of synthetic vectors')
+@click.option('--dim', type=int, default=None, help='Dimension of synthetic vectors')
+@click.option('--num-queries', type=int, default=200, help='Number of queries')
+@click.option('--top-k', type=int, default=10, help='Top-k for recall')
+@click.option('--ef-search', type=int, default=None, help='hnsw.ef_search')
+def pgvector_bench(synthetic, dim, num_queries, top_k, ef_search):
+    """对比 pgvector 的 vector / halfvec 存储与二值量化索引的体积、延迟与召回率"""
+    from coderag.eval.faiss_benchmark import synthetic_vectors
+    from coderag.eval.pgvector_benchmark import PgVectorBenchmark
+
+    vectors = synthetic_vectors(synthetic, dim or settings.embedding_dim)
+    click.echo(f"Benchmarking pgvector storage on {len(vectors)} synthetic vectors")
+
+    bench = PgVectorBenchmark(
+        vectors,
+        connection_string=settings.pgvector_connection_string,
+        num_queries=num_queries,
+        top_k=top_k,
+        ef_search=ef_search or settings.pgvector_ef_search,
+        binary_oversample=settings.pgvector_binary_oversample,
+    )
+    bench.run("vector")
+    bench.run("halfvec")
+    bench.run("halfvec", binary_index=True)
+
+    output_path = bench.export_results()
+    click.echo(f"\npgvector benchmark results saved to: {output_path}")
+
+
+@cli.command(name='fulltext-bench')
+@click.option('--synthetic', type=int, default=50000, help='Number of synthetic documents')
+@click.option('--batch-size', type=int, default=1000, help='Documents per add_documents call')
+@click.option('--procs', type=int, default=None, help='Writer processes for the bulk run')
+@click.option('--limitmb', type=int, default=None, help='Indexing buffer per writer process (MB)')
+def fulltext_bench(synthetic, batch_size, procs, limitmb):
+    """对比 Whoosh 写入方式（逐批提交 / 批量多进程写入）的吞吐与段合并开销"""
+    import multiprocessing
+    from coderag.eval.fulltext_benchmark import FulltextIngestBenchmark, synthetic_documents
+
+    documents = synthetic_documents(synthetic)
+    click.echo(f"Benchmarking Whoosh ingest on {len(documents)} synthetic documents")
+
+    procs = procs or min(4, multiprocessing.cpu_count())
+    limitmb = limitmb or settings.fulltext_writer_limitmb
+    bench = FulltextIngestBenchmark(documents, batch_size=batch_size)
+    bench.run("legacy")
+    bench.run("incremental", limitmb=limitmb)
+    bench.run("bulk", bulk=True, procs=1, limitmb=limitmb)
+    if procs > 1:
+        bench.run("bulk-mp", bulk=True, procs=procs, limitmb=limitmb)
+
+    output_path = bench.export_results()
+    click.echo(f"\nFulltext benchmark results saved to: {output_path}")
+
+
+@cli.command(name='fulltext-backend-bench')
+@click.option('--synthetic', type=int, default=50000, help='Number of synthetic documents')
+@click.option('--batch-size', type=int, default=1000, help='Documents per add_documents call')
+@click.option('--num-queries', type=int, default=200, help='Queries per latency measurement')
+@click.option('--top-k', type=int, default=10, help='Results per query')
+def fulltext_backend_bench(synthetic, batch_size, num_queries, top_k):
+    """对比 Whoosh 与 SQLite FTS5 全文检索后端的写入、查询延迟和结果重合率"""
+    from coderag.eval.fulltext_benchmark import FulltextBackendBenchmark, synthetic_documents
+
+    documents = synthetic_documents(synthetic)
+    click.echo(f"Benchmarking fulltext backends on {len(documents)} synthetic documents")
+
+    bench = FulltextBackendBenchmark(documents, batch_size=batch_size, num_queries=num_queries, top_k=top_k)
+    bench.run("whoosh")
+    bench.run("sqlite")
+
+    output_path = bench.export_results()
+    click.echo(f"\nFulltext backend benchmark results saved to: {output_path}")
+
+
 @lora_group.command(name='generate')
 @click.argument('model_path')
 @click.argument('prompt')
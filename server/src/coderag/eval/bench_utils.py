@@ -0,0 +1,78 @@
+import os
+import json
+import statistics
+from dataclasses import asdict
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+import faiss
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2 归一化，零向量保持为零"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+
+def sample_queries(vectors: np.ndarray, num_queries: int, noise: float = 0.05, seed: int = 42) -> np.ndarray:
+    """从已归一化的语料中抽样查询向量，加噪声避免查询与语料完全重合"""
+    rng = np.random.default_rng(seed)
+    num_queries = min(num_queries, len(vectors))
+    picked = vectors[rng.choice(len(vectors), num_queries, replace=False)]
+    return normalize(picked + rng.normal(scale=noise, size=picked.shape).astype(np.float32))
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, top_k: int) -> np.ndarray:
+    """Flat 内积索引精确检索，返回每个查询 top_k 的语料下标，作为召回率的基准"""
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+    _, indices = flat.search(queries, top_k)
+    return indices
+
+
+def percentile(values: List[float], q: float) -> float:
+    """取排序后第 int(q * n) 个值（不插值），q 取 0~1"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """平均与 P50/P95/P99 延迟（毫秒），键名与各评测结果的字段一致"""
+    return {
+        'avg_latency_ms': statistics.mean(latencies),
+        'p50_latency_ms': percentile(latencies, 0.50),
+        'p95_latency_ms': percentile(latencies, 0.95),
+        'p99_latency_ms': percentile(latencies, 0.99),
+    }
+
+
+def export_results(
+    results: List[Any],
+    name: str,
+    output_path: Optional[str] = None,
+    **extra: Any,
+) -> str:
+    """把评测结果（dataclass 列表）导出到 JSON
+
+    Args:
+        results: 评测结果列表
+        name: 评测名称，默认路径为 data/runs/{name}_{时间戳}.json
+        output_path: 输出路径，None 时使用默认路径
+        extra: 额外写入顶层的字段（维度、文档数等）
+    """
+    if output_path is None:
+        output_path = f"data/runs/{name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    data = {"timestamp": datetime.utcnow().isoformat()}
+    data.update(extra)
+    data["results"] = [asdict(r) for r in results]
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+    print(f"Benchmark results ({name}) exported to: {output_path}")
+    return output_path
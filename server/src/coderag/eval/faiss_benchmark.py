@@ -0,0 +1,158 @@
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+import faiss
+import numpy as np
+from coderag.eval.bench_utils import normalize, sample_queries, exact_top_k, latency_summary, export_results
+from coderag.rag.faiss_store import create_faiss_index, train_faiss_index, search_parameters
+
+
+@dataclass
+class IndexBenchmarkResult:
+    """FAISS 索引评测结果"""
+    index_factory: str
+    num_vectors: int
+    num_queries: int
+    top_k: int
+    nprobe: Optional[int]
+    ef_search: Optional[int]
+    recall_at_k: float
+    train_seconds: float
+    add_seconds: float
+    avg_latency_ms: float
+    p50_latency_ms: float
+    p95_latency_ms: float
+    p99_latency_ms: float
+    bytes_per_vector: float
+    index_bytes: int
+    timestamp: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+
+
+class FaissIndexBenchmark:
+    """对比不同 index_factory 配置与 Flat 精确检索的召回率、延迟和内存"""
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        num_queries: int = 1000,
+        top_k: int = 10,
+        train_samples: int = 100000,
+    ):
+        """初始化评测
+
+        Args:
+            vectors: 语料向量，形如 (n, d)，会被 L2 归一化
+            num_queries: 查询数量，从语料中抽样并加入少量噪声
+            top_k: 召回率计算使用的 k
+            train_samples: 训练索引使用的最大样本数
+        """
+        self.vectors = normalize(vectors)
+        self.dim = self.vectors.shape[1]
+        self.top_k = top_k
+        self.train_samples = train_samples
+        self.queries = sample_queries(self.vectors, num_queries)
+        self.ground_truth = exact_top_k(self.vectors, self.queries, top_k)
+        self.results: List[IndexBenchmarkResult] = []
+
+    def _recall(self, indices: np.ndarray) -> float:
+        hits = 0
+        for approx, exact in zip(indices, self.ground_truth):
+            hits += len(set(approx.tolist()) & set(exact.tolist()))
+        return hits / (len(self.ground_truth) * self.top_k)
+
+    def run(
+        self,
+        index_factory: str,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> IndexBenchmarkResult:
+        """评测单个索引配置"""
+        print(f"\nBenchmarking FAISS index: {index_factory} (nprobe={nprobe}, efSearch={ef_search})")
+
+        index = create_faiss_index(self.dim, index_factory)
+
+        start = time.time()
+        train_faiss_index(index, self.vectors, self.train_samples)
+        train_seconds = time.time() - start
+
+        start = time.time()
+        index.add(self.vectors)
+        add_seconds = time.time() - start
+
+        params = search_parameters(index, nprobe=nprobe, ef_search=ef_search)
+
+        latencies = []
+        all_indices = []
+        for query in self.queries:
+            query_start = time.time()
+            _, indices = index.search(query.reshape(1, -1), self.top_k, params=params)
+            latencies.append((time.time() - query_start) * 1000)
+            all_indices.append(indices[0])
+
+        index_bytes = faiss.serialize_index(index).nbytes
+
+        result = IndexBenchmarkResult(
+            index_factory=index_factory,
+            num_vectors=len(self.vectors),
+            num_queries=len(self.queries),
+            top_k=self.top_k,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            recall_at_k=self._recall(np.array(all_indices)),
+            train_seconds=train_seconds,
+            add_seconds=add_seconds,
+            **latency_summary(latencies),
+            bytes_per_vector=index_bytes / len(self.vectors),
+            index_bytes=index_bytes,
+        )
+
+        self.results.append(result)
+        self._print_result(result)
+        return result
+
+    def _print_result(self, result: IndexBenchmarkResult):
+        """打印评测结果"""
+        print(f"{'='*60}")
+        print(f"Index:                {result.index_factory}")
+        print(f"Recall@{result.top_k}:            {result.recall_at_k:.4f}")
+        print(f"Train / Add:          {result.train_seconds:.2f}s / {result.add_seconds:.2f}s")
+        print(f"Avg Latency:          {result.avg_latency_ms:.3f}ms")
+        print(f"P50/P95/P99:          {result.p50_latency_ms:.3f}ms / {result.p95_latency_ms:.3f}ms / {result.p99_latency_ms:.3f}ms")
+        print(f"Bytes/Vector:         {result.bytes_per_vector:.1f}")
+        print(f"Index Size:           {result.index_bytes / 1024 / 1024:.2f}MB")
+        print(f"{'='*60}")
+
+    def export_results(self, output_path: str = None) -> str:
+        """导出结果到 JSON"""
+        return export_results(self.results, "faiss_bench", output_path, dimension=self.dim)
+
+
+def synthetic_vectors(num_vectors: int, dim: int, num_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """生成带聚类结构的合成向量，比纯随机向量更接近真实嵌入分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim)).astype(np.float32)
+    assignments = rng.integers(0, num_clusters, size=num_vectors)
+    noise = rng.normal(scale=0.5, size=(num_vectors, dim)).astype(np.float32)
+    return centers[assignments] + noise
+
+
+def load_store_vectors(batch_size: int = 10000) -> Optional[np.ndarray]:
+    """导出当前 FAISS 存储中所有存活分块的向量（各层中的最新版本，已归一化/投影）"""
+    from coderag.rag.faiss_store import FaissStore
+
+    store = FaissStore()
+    batches = []
+    start = 0
+    try:
+        while start is not None:
+            exported = store.export_live(start, batch_size)
+            if len(exported['vectors']):
+                batches.append(exported['vectors'])
+            start = exported['next']
+    except RuntimeError as e:
+        print(f"Cannot reconstruct vectors from FAISS index: {e}")
+        return None
+    if not batches:
+        return None
+    return np.vstack(batches)
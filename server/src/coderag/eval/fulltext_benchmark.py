@@ -0,0 +1,351 @@
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable
+from coderag.eval.bench_utils import percentile, export_results
+from coderag.rag.fulltext_search import FullTextSearcher
+from coderag.rag.sqlite_fts import SQLiteFullTextSearcher
+
+
+@dataclass
+class IngestBenchmarkResult:
+    """全文索引写入评测结果"""
+    name: str
+    bulk: bool
+    procs: int
+    limitmb: int
+    num_documents: int
+    batch_size: int
+    ingest_seconds: float
+    docs_per_second: float
+    segments_after_ingest: int
+    merge_seconds: float
+    segments_after_merge: int
+    query_p50_before_merge_ms: float
+    query_p50_after_merge_ms: float
+    timestamp: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+
+
+@dataclass
+class BackendBenchmarkResult:
+    """全文检索后端对比评测结果"""
+    backend: str
+    num_documents: int
+    ingest_seconds: float
+    docs_per_second: float
+    optimize_seconds: float
+    disk_bytes: int
+    query_p50_ms: float
+    query_p95_ms: float
+    filtered_query_p50_ms: float
+    suggest_p50_ms: float
+    overlap_at_k: float
+    timestamp: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+
+
+def synthetic_documents(num_documents: int, lines_per_doc: int = 20, seed: int = 42) -> List[Dict[str, Any]]:
+    """生成类似代码分块的合成文档，标识符服从长尾分布"""
+    rng = random.Random(seed)
+    vocab = [f"name_{i}" for i in range(5000)]
+    weights = [1.0 / (i + 1) for i in range(len(vocab))]
+    keywords = ["def", "return", "class", "import", "self", "if", "for", "in", "None", "async"]
+
+    documents = []
+    for i in range(num_documents):
+        lines = []
+        for _ in range(lines_per_doc):
+            words = rng.choices(vocab, weights=weights, k=4)
+            lines.append(f"{rng.choice(keywords)} {words[0]}({words[1]}, {words[2]}) -> {words[3]}")
+        documents.append({
+            "id": f"doc_{i}",
+            "content": "\n".join(lines),
+            "file_path": f"pkg_{i % 100}/module_{i}.py",
+            "start_line": 1,
+            "end_line": lines_per_doc,
+        })
+    return documents
+
+
+class FulltextIngestBenchmark:
+    """对比 Whoosh 写入方式的吞吐、段数以及合并对查询延迟的影响
+
+    - legacy: 每批一个默认写入器，提交时同步合并段（改造前的写法）
+    - incremental: add_documents 逐批提交不合并，段多时后台合并
+    - bulk: bulk_load 模式，可多进程写入并按 commit_batch_size 分批提交
+    """
+
+    def __init__(
+        self,
+        documents: List[Dict[str, Any]],
+        batch_size: int = 1000,
+        num_queries: int = 100,
+    ):
+        """初始化评测
+
+        Args:
+            documents: 待写入的文档
+            batch_size: 每次 add_documents 的文档数
+            num_queries: 查询延迟评测使用的查询数量
+        """
+        self.documents = documents
+        self.batch_size = batch_size
+        rng = random.Random(0)
+        self.queries = [f"name_{rng.randint(0, 200)} name_{rng.randint(0, 2000)}" for _ in range(num_queries)]
+        self.results: List[IngestBenchmarkResult] = []
+
+    def _batches(self):
+        for start in range(0, len(self.documents), self.batch_size):
+            yield self.documents[start:start + self.batch_size]
+
+    def _query_p50(self, searcher: FullTextSearcher) -> float:
+        latencies = []
+        for query in self.queries:
+            start = time.time()
+            searcher.search(query, limit=10)
+            latencies.append((time.time() - start) * 1000)
+        return statistics.median(latencies)
+
+    def _legacy_ingest(self, searcher: FullTextSearcher):
+        """改造前的 add_documents：每批一个写入器，commit() 默认合并小段"""
+        for batch in self._batches():
+            writer = searcher.index.writer()
+            for i, doc in enumerate(batch):
+                writer.add_document(**searcher._document_fields(doc, f"doc_{i}"))
+            writer.commit()
+
+    def run(
+        self,
+        name: str,
+        bulk: bool = False,
+        procs: int = 1,
+        limitmb: int = 128,
+        commit_batch_size: int = 20000,
+    ) -> IngestBenchmarkResult:
+        """在临时目录中评测单个写入配置"""
+        print(f"\nBenchmarking fulltext ingest: {name} (bulk={bulk}, procs={procs}, limitmb={limitmb})")
+        index_dir = tempfile.mkdtemp(prefix="coderag_whoosh_bench_")
+        try:
+            searcher = FullTextSearcher(
+                index_dir=index_dir,
+                procs=procs,
+                limitmb=limitmb,
+                commit_batch_size=commit_batch_size,
+                # 写入期间不触发后台合并，合并单独计时
+                max_segments=10 ** 9,
+            )
+
+            start = time.time()
+            if name == "legacy":
+                self._legacy_ingest(searcher)
+            elif bulk:
+                with searcher.bulk_load(optimize=False):
+                    for batch in self._batches():
+                        searcher.add_documents(batch)
+            else:
+                for batch in self._batches():
+                    searcher.add_documents(batch)
+            ingest_seconds = time.time() - start
+
+            segments_after_ingest = searcher.segment_count()
+            query_before = self._query_p50(searcher)
+
+            start = time.time()
+            searcher.optimize()
+            merge_seconds = time.time() - start
+            query_after = self._query_p50(searcher)
+
+            result = IngestBenchmarkResult(
+                name=name,
+                bulk=bulk,
+                procs=procs,
+                limitmb=limitmb,
+                num_documents=len(self.documents),
+                batch_size=self.batch_size,
+                ingest_seconds=ingest_seconds,
+                docs_per_second=len(self.documents) / ingest_seconds if ingest_seconds > 0 else 0.0,
+                segments_after_ingest=segments_after_ingest,
+                merge_seconds=merge_seconds,
+                segments_after_merge=searcher.segment_count(),
+                query_p50_before_merge_ms=query_before,
+                query_p50_after_merge_ms=query_after,
+            )
+        finally:
+            shutil.rmtree(index_dir, ignore_errors=True)
+
+        self.results.append(result)
+        self._print_result(result)
+        return result
+
+    def _print_result(self, result: IngestBenchmarkResult):
+        """打印评测结果"""
+        print(f"{'='*60}")
+        print(f"Config:               {result.name} (procs={result.procs}, limitmb={result.limitmb})")
+        print(f"Ingest:               {result.ingest_seconds:.2f}s ({result.docs_per_second:.0f} docs/s)")
+        print(f"Segments:             {result.segments_after_ingest} -> {result.segments_after_merge}")
+        print(f"Optimize:             {result.merge_seconds:.2f}s")
+        print(f"Query P50:            {result.query_p50_before_merge_ms:.3f}ms -> {result.query_p50_after_merge_ms:.3f}ms")
+        print(f"{'='*60}")
+
+    def export_results(self, output_path: Optional[str] = None) -> str:
+        """导出结果到 JSON"""
+        return export_results(
+            self.results,
+            "fulltext_ingest_bench",
+            output_path,
+            num_documents=len(self.documents),
+            batch_size=self.batch_size,
+        )
+
+
+class FulltextBackendBenchmark:
+    """Whoosh 与 SQLite FTS5 后端的对比评测
+
+    两个后端用相同的文档和查询：批量导入耗时、合并耗时、磁盘占用、
+    查询 / 带过滤查询 / 自动补全的延迟，以及 top-k 结果与 Whoosh 的重合率。
+    """
+
+    def __init__(
+        self,
+        documents: List[Dict[str, Any]],
+        batch_size: int = 1000,
+        num_queries: int = 200,
+        top_k: int = 10,
+    ):
+        """初始化评测
+
+        Args:
+            documents: 待写入的文档
+            batch_size: 每次 add_documents 的文档数
+            num_queries: 每类查询的数量
+            top_k: 每个查询返回的结果数，也用于计算重合率
+        """
+        self.documents = documents
+        self.batch_size = batch_size
+        self.top_k = top_k
+        rng = random.Random(0)
+        self.queries = [f"name_{rng.randint(0, 200)} name_{rng.randint(0, 2000)}" for _ in range(num_queries)]
+        paths = sorted({doc["file_path"] for doc in documents})
+        self.filters = [{"file_path": rng.sample(paths, min(10, len(paths)))} for _ in range(num_queries)]
+        self.prefixes = [f"name_{rng.randint(1, 99)}" for _ in range(num_queries)]
+        self.results: List[BackendBenchmarkResult] = []
+        self._reference: Optional[List[List[str]]] = None
+
+    @staticmethod
+    def _timed(fn: Callable[[], Any]) -> float:
+        start = time.perf_counter()
+        fn()
+        return (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    def _dir_bytes(path: str) -> int:
+        total = 0
+        for root, _, files in os.walk(path):
+            total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return total
+
+    def run(self, backend: str) -> BackendBenchmarkResult:
+        """在临时目录中评测单个后端（whoosh / sqlite）"""
+        print(f"\nBenchmarking fulltext backend: {backend}")
+        work_dir = tempfile.mkdtemp(prefix=f"coderag_{backend}_bench_")
+        try:
+            if backend == "whoosh":
+                searcher = FullTextSearcher(index_dir=work_dir, max_segments=10 ** 9)
+            elif backend == "sqlite":
+                searcher = SQLiteFullTextSearcher(db_path=os.path.join(work_dir, "fulltext.sqlite"))
+            else:
+                raise ValueError(f"Unknown fulltext backend: {backend}")
+
+            start = time.time()
+            with searcher.bulk_load(optimize=False):
+                for begin in range(0, len(self.documents), self.batch_size):
+                    searcher.add_documents(self.documents[begin:begin + self.batch_size])
+            ingest_seconds = time.time() - start
+
+            start = time.time()
+            searcher.optimize()
+            optimize_seconds = time.time() - start
+
+            ranked: List[List[str]] = []
+            latencies = []
+            for query in self.queries:
+                start = time.perf_counter()
+                hits = searcher.search(query, limit=self.top_k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                ranked.append([hit["id"] for hit in hits])
+
+            filtered = [
+                self._timed(lambda: searcher.search_by_filter(query, filters, limit=self.top_k))
+                for query, filters in zip(self.queries, self.filters)
+            ]
+            # 第一次调用会构建前缀索引，不计入延迟
+            searcher.suggest(self.prefixes[0])
+            suggest = [self._timed(lambda: searcher.suggest(prefix)) for prefix in self.prefixes]
+
+            if backend == "whoosh":
+                disk_bytes = self._dir_bytes(work_dir)
+            else:
+                disk_bytes = searcher.disk_bytes()
+            searcher.close()
+
+            if self._reference is None and backend == "whoosh":
+                self._reference = ranked
+            overlap = self._overlap(ranked) if self._reference is not None else 1.0
+
+            result = BackendBenchmarkResult(
+                backend=backend,
+                num_documents=len(self.documents),
+                ingest_seconds=ingest_seconds,
+                docs_per_second=len(self.documents) / ingest_seconds if ingest_seconds > 0 else 0.0,
+                optimize_seconds=optimize_seconds,
+                disk_bytes=disk_bytes,
+                query_p50_ms=statistics.median(latencies),
+                query_p95_ms=percentile(latencies, 0.95),
+                filtered_query_p50_ms=statistics.median(filtered),
+                suggest_p50_ms=statistics.median(suggest),
+                overlap_at_k=overlap,
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        self.results.append(result)
+        self._print_result(result)
+        return result
+
+    def _overlap(self, ranked: List[List[str]]) -> float:
+        """与 Whoosh 结果的平均 top-k 重合率；两边都没有结果的查询记为 1"""
+        scores = []
+        for ours, reference in zip(ranked, self._reference):
+            if not ours and not reference:
+                scores.append(1.0)
+            else:
+                scores.append(len(set(ours) & set(reference)) / max(len(ours), len(reference)))
+        return statistics.mean(scores) if scores else 0.0
+
+    def _print_result(self, result: BackendBenchmarkResult):
+        """打印评测结果"""
+        print(f"{'='*60}")
+        print(f"Backend:              {result.backend}")
+        print(f"Ingest:               {result.ingest_seconds:.2f}s ({result.docs_per_second:.0f} docs/s)")
+        print(f"Optimize:             {result.optimize_seconds:.2f}s")
+        print(f"Disk:                 {result.disk_bytes / 1024 / 1024:.1f} MB")
+        print(f"Query P50/P95:        {result.query_p50_ms:.3f}ms / {result.query_p95_ms:.3f}ms")
+        print(f"Filtered query P50:   {result.filtered_query_p50_ms:.3f}ms")
+        print(f"Suggest P50:          {result.suggest_p50_ms:.3f}ms")
+        print(f"Overlap@{self.top_k} vs whoosh: {result.overlap_at_k:.3f}")
+        print(f"{'='*60}")
+
+    def export_results(self, output_path: Optional[str] = None) -> str:
+        """导出结果到 JSON"""
+        return export_results(
+            self.results,
+            "fulltext_backend_bench",
+            output_path,
+            num_documents=len(self.documents),
+            num_queries=len(self.queries),
+            top_k=self.top_k,
+        )
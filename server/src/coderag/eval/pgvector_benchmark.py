@@ -0,0 +1,169 @@
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+import numpy as np
+from coderag.eval.bench_utils import normalize, sample_queries, exact_top_k, latency_summary, export_results
+from coderag.rag.pgvector_store import PgVectorStore
+
+
+@dataclass
+class PgVectorBenchmarkResult:
+    """pgvector 存储配置评测结果"""
+    storage: str
+    binary_index: bool
+    num_vectors: int
+    num_queries: int
+    top_k: int
+    ef_search: int
+    recall_at_k: float
+    load_seconds: float
+    index_seconds: float
+    avg_latency_ms: float
+    p50_latency_ms: float
+    p95_latency_ms: float
+    p99_latency_ms: float
+    table_bytes: int
+    hnsw_index_bytes: int
+    binary_index_bytes: int
+    timestamp: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+
+
+class PgVectorBenchmark:
+    """在合成语料上对比 vector / halfvec 存储以及二值量化索引的体积、延迟与召回率
+
+    每个配置写入独立的表 coderag_bench_<storage>[_binary]，评测结束后删除。
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        connection_string: str,
+        num_queries: int = 200,
+        top_k: int = 10,
+        ef_search: int = 40,
+        binary_oversample: int = 10,
+        batch_size: int = 5000,
+    ):
+        """初始化评测
+
+        Args:
+            vectors: 语料向量，形如 (n, d)，会被 L2 归一化
+            connection_string: PostgreSQL 连接串
+            num_queries: 查询数量，从语料中抽样并加入少量噪声
+            top_k: 召回率计算使用的 k
+            ef_search: hnsw.ef_search
+            binary_oversample: 二值检索的候选倍数
+            batch_size: 每次 COPY 的行数
+        """
+        self.vectors = normalize(vectors)
+        self.dim = self.vectors.shape[1]
+        self.connection_string = connection_string
+        self.top_k = top_k
+        self.ef_search = ef_search
+        self.binary_oversample = binary_oversample
+        self.batch_size = batch_size
+        self.queries = sample_queries(self.vectors, num_queries)
+        # float32 精确检索作为召回率的基准，按写入时的 id 比较
+        self.ground_truth = [
+            set(f"bench_{i}" for i in row) for row in exact_top_k(self.vectors, self.queries, top_k)
+        ]
+        self.results: List[PgVectorBenchmarkResult] = []
+
+    def run(self, storage: str = "vector", binary_index: bool = False) -> PgVectorBenchmarkResult:
+        """评测单个存储配置"""
+        name = f"coderag_bench_{storage}" + ("_binary" if binary_index else "")
+        print(f"\nBenchmarking pgvector: storage={storage}, binary_index={binary_index}")
+
+        store = PgVectorStore(
+            connection_string=self.connection_string,
+            collection_name=name,
+            dimension=self.dim,
+            storage=storage,
+            binary_index=binary_index,
+            binary_oversample=self.binary_oversample,
+            ef_search=self.ef_search,
+        )
+        store.connect()
+        try:
+            with store.cursor() as cur:
+                cur.execute(f"TRUNCATE {name}")
+            store.drop_search_indexes()
+
+            start = time.time()
+            for offset in range(0, len(self.vectors), self.batch_size):
+                batch = self.vectors[offset:offset + self.batch_size]
+                store.add_texts(
+                    texts=[f"chunk {offset + i}" for i in range(len(batch))],
+                    embeddings=batch.tolist(),
+                    ids=[f"bench_{offset + i}" for i in range(len(batch))],
+                )
+            load_seconds = time.time() - start
+
+            start = time.time()
+            store.build_search_indexes()
+            with store.cursor() as cur:
+                cur.execute(f"ANALYZE {name}")
+            index_seconds = time.time() - start
+
+            latencies = []
+            hits = 0
+            # 检索时按 max(ef_search, 候选数) 设置 hnsw.ef_search，二值检索的候选数为 k * oversample
+            ef_search = max(self.ef_search, self.top_k * self.binary_oversample) if binary_index else self.ef_search
+            for query, exact in zip(self.queries, self.ground_truth):
+                query_start = time.time()
+                results = store.similarity_search(query.tolist(), k=self.top_k)
+                latencies.append((time.time() - query_start) * 1000)
+                hits += len(exact & {r["id"] for r in results})
+
+            with store.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT pg_total_relation_size(%s::regclass),
+                           pg_relation_size(%s::regclass),
+                           COALESCE(pg_relation_size(to_regclass(%s)), 0)
+                    """,
+                    [name, f"idx_{name}_embedding", f"idx_{name}_binary"]
+                )
+                table_bytes, hnsw_bytes, binary_bytes = cur.fetchone()
+        finally:
+            store.delete_collection()
+            store.close()
+
+        result = PgVectorBenchmarkResult(
+            storage=storage,
+            binary_index=binary_index,
+            num_vectors=len(self.vectors),
+            num_queries=len(self.queries),
+            top_k=self.top_k,
+            ef_search=ef_search,
+            recall_at_k=hits / (len(self.queries) * self.top_k),
+            load_seconds=load_seconds,
+            index_seconds=index_seconds,
+            **latency_summary(latencies),
+            table_bytes=table_bytes,
+            hnsw_index_bytes=hnsw_bytes,
+            binary_index_bytes=binary_bytes,
+        )
+
+        self.results.append(result)
+        self._print_result(result)
+        return result
+
+    def _print_result(self, result: PgVectorBenchmarkResult):
+        """打印评测结果"""
+        print(f"{'='*60}")
+        print(f"Storage:              {result.storage}{' + binary index' if result.binary_index else ''}")
+        print(f"Recall@{result.top_k}:            {result.recall_at_k:.4f}")
+        print(f"Load / Index:         {result.load_seconds:.2f}s / {result.index_seconds:.2f}s")
+        print(f"Avg Latency:          {result.avg_latency_ms:.3f}ms")
+        print(f"P50/P95/P99:          {result.p50_latency_ms:.3f}ms / {result.p95_latency_ms:.3f}ms / {result.p99_latency_ms:.3f}ms")
+        print(f"Table Size:           {result.table_bytes / 1024 / 1024:.2f}MB")
+        print(f"HNSW Index:           {result.hnsw_index_bytes / 1024 / 1024:.2f}MB")
+        if result.binary_index:
+            print(f"Binary Index:         {result.binary_index_bytes / 1024 / 1024:.2f}MB")
+        print(f"{'='*60}")
+
+    def export_results(self, output_path: Optional[str] = None) -> str:
+        """导出结果到 JSON"""
+        return export_results(self.results, "pgvector_bench", output_path, dimension=self.dim)
@@ -22,6 +22,12 @@ class EvaluationRunner:
         self.llm = LLMProviderFactory.get_provider(settings.llm_provider)
         self.retriever = Retriever()
 
+    def _retrieve_all(self) -> List[List[Dict[str, Any]]]:
+        """一次批量检索全部问题，结果与数据集顺序对齐"""
+        questions = [item.get('question', '') for item in self.dataset.data]
+        embeddings = [self.llm.embed(question) for question in questions]
+        return self.retriever.retrieve_batch(questions, embeddings, self.top_k)
+
     def run_evaluation(self) -> Dict[str, Any]:
         """运行完整评测"""
         print(f"\n{'='*60}")
@@ -45,7 +51,9 @@ class EvaluationRunner:
         question_results = []
         tags_map = {}
 
-        for item in self.dataset.data:
+        retrieved_batches = self._retrieve_all()
+
+        for item, retrieved_docs in zip(self.dataset.data, retrieved_batches):
             question_id = item.get('id', 'unknown')
             question = item.get('question', '')
             gold = item.get('gold', {})
@@ -57,9 +65,6 @@ class EvaluationRunner:
 
             print(f"Processing: {question_id} - {question[:50]}...")
 
-            embedding = self.llm.embed(question)
-            retrieved_docs = self.retriever.retrieve(question, embedding, self.top_k)
-
             if self.skip_llm:
                 answer = ""
             else:
@@ -104,13 +109,19 @@ class EvaluationRunner:
 
         tag_metrics = EvaluationMetrics.aggregate_by_tag(question_results, tags_map)
         results['tag_metrics'] = tag_metrics
+        results['index_stats'] = self.retriever.get_index_stats()
 
         self.save_results(results)
-        self.print_summary(aggregated, tag_metrics)
+        self.print_summary(aggregated, tag_metrics, results['index_stats'])
 
         return results
 
-    def print_summary(self, aggregated: Dict[str, Any], tag_metrics: Dict[str, Any]):
+    def print_summary(
+        self,
+        aggregated: Dict[str, Any],
+        tag_metrics: Dict[str, Any],
+        index_stats: Optional[Dict[str, Any]] = None,
+    ):
         """打印评测摘要"""
         print(f"\n{'='*60}")
         print("EVALUATION SUMMARY")
@@ -128,6 +139,14 @@ class EvaluationRunner:
             for tag, tag_metric in tag_metrics.items():
                 print(f"  [{tag}] hit_rate: {tag_metric.get('hit_rate_at_k', 0):.4f}, citation: {tag_metric.get('citation_rate', 0):.4f}")
         
+        if index_stats:
+            projection = index_stats.get('projection', {})
+            print(f"\nVector Index:")
+            print(f"  Vectors:           {index_stats.get('num_vectors', 0)}")
+            print(f"  Dimension:         {index_stats.get('embedding_dim')} -> {index_stats.get('index_dim')} ({projection.get('method', 'none')})")
+            print(f"  Vector Memory:     {index_stats.get('vector_bytes', 0) / 1024 / 1024:.2f}MB")
+            print(f"  Memory Saved:      {index_stats.get('memory_saved_bytes', 0) / 1024 / 1024:.2f}MB")
+        
         print(f"{'='*60}\n")
 
     def save_results(self, results: Dict[str, Any]):
@@ -241,7 +260,9 @@ class EvaluationRunner:
         question_results = []
         tags_map = {}
 
-        for item in self.dataset.data:
+        retrieved_batches = self._retrieve_all()
+
+        for item, retrieved_docs in zip(self.dataset.data, retrieved_batches):
             question_id = item.get('id', 'unknown')
             question = item.get('question', '')
             gold = item.get('gold', {})
@@ -251,9 +272,6 @@ class EvaluationRunner:
             
             tags_map[question_id] = tags
 
-            embedding = self.llm.embed(question)
-            retrieved_docs = self.retriever.retrieve(question, embedding, self.top_k)
-
             if self.skip_llm:
                 answer = ""
             else:
@@ -298,6 +316,7 @@ class EvaluationRunner:
 
         tag_metrics = EvaluationMetrics.aggregate_by_tag(question_results, tags_map)
         results['tag_metrics'] = tag_metrics
+        results['index_stats'] = self.retriever.get_index_stats()
 
         self.save_results(results)
         return results
@@ -1,8 +1,10 @@
 from .retriever import Retriever
 from .bm25_rerank import BM25Reranker, HybridRetriever
-from .fulltext_search import FullTextSearcher, create_searcher
+from .fulltext_search import FullTextSearcher, create_searcher, get_fulltext_searcher
+from .sqlite_fts import SQLiteFullTextSearcher
 from .hybrid_search import HybridSearcher, create_hybrid_searcher
 from .pgvector_store import PgVectorStore
+from .vector_store import VectorStore
 
 __all__ = [
     "Retriever",
@@ -10,7 +12,10 @@ __all__ = [
     "HybridRetriever",
     "FullTextSearcher",
     "create_searcher",
+    "get_fulltext_searcher",
+    "SQLiteFullTextSearcher",
     "HybridSearcher",
     "create_hybrid_searcher",
     "PgVectorStore",
+    "VectorStore",
 ]
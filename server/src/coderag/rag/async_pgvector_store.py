@@ -0,0 +1,398 @@
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import concurrent.futures
+import json
+import logging
+import threading
+
+from coderag.rag.pgvector_store import (
+    PgVectorStore,
+    table_sql,
+    search_index_sql,
+    binary_index_sql,
+    storage_migration_sql,
+    search_vector_migration_sql,
+    knn_sql,
+    knn_params,
+    filter_sql,
+    document_index_sql,
+    staging_sql,
+    upsert_from_staging_sql,
+)
+from coderag.rag.vector_store import VectorStore, chunk_key, detect_language, stable_chunk_id
+from coderag.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# hnsw.iterative_scan / hnsw.max_scan_tuples 从 pgvector 0.8 开始提供
+ITERATIVE_SCAN_MIN_VERSION = (0, 8)
+
+
+def parse_extversion(extversion: str) -> Tuple[int, ...]:
+    """把 pg_extension.extversion（如 "0.7.4"）解析为可比较的元组，无法解析的部分按 0 处理"""
+    parts = []
+    for part in extversion.split("."):
+        digits = "".join(ch for ch in part if ch.isdigit())
+        parts.append(int(digits) if digits else 0)
+    return tuple(parts)
+
+
+class AsyncPgVectorStore(VectorStore):
+    """基于 psycopg3 异步连接池的 pgvector 向量存储（settings.vector_store = "pgvector"）
+
+    所有数据库操作都在存储自己的事件循环线程上执行，连接池始终绑定这一个循环：
+    - async 接口（asearch 等）把协程投递到该循环并 await 结果，不阻塞调用方的事件循环
+    - 同步接口（search 等）供 Retriever 和 CLI 使用，阻塞等待结果
+    - 写入在 COPY + upsert 完成时已提交，flush 无需额外操作
+
+    每次检索在事务内用 set_config(..., true) 设置 hnsw.ef_search；带过滤条件时开启
+    hnsw.iterative_scan（需要 pgvector >= 0.8），索引扫描会持续到凑够满足过滤的结果，
+    而不是先取 ef_search 个候选再过滤导致结果不足。连接池初始化时检查一次扩展版本，
+    低于 0.8 时不设置这两个参数（旧版本不认识 hnsw.* 参数，set_config 会报错）。
+    """
+
+    def __init__(
+        self,
+        connection_string: Optional[str] = None,
+        collection_name: Optional[str] = None,
+        dimension: Optional[int] = None,
+    ):
+        self.connection_string = connection_string or settings.pgvector_connection_string
+        self.collection_name = collection_name or settings.pgvector_collection
+        self.dimension = dimension or settings.embedding_dim
+        self.pool_min_size = settings.pgvector_pool_min_size
+        self.pool_max_size = settings.pgvector_pool_max_size
+        self.ef_search = settings.pgvector_ef_search
+        self.iterative_scan = settings.pgvector_iterative_scan
+        self.max_scan_tuples = settings.pgvector_max_scan_tuples
+        self.storage = settings.pgvector_storage
+        self.binary_index = settings.pgvector_binary_index
+        self.binary_oversample = settings.pgvector_binary_oversample
+
+        self.extversion: Optional[str] = None
+
+        self._pool = None
+        self._pool_lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+
+    # ---- 事件循环 ----
+
+    def _submit(self, coro) -> concurrent.futures.Future:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name=f"pgvector-{self.collection_name}",
+                    daemon=True,
+                )
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _run(self, coro):
+        """同步等待协程在存储循环上执行完成"""
+        return self._submit(coro).result()
+
+    async def _call(self, coro):
+        """在调用方的事件循环中等待存储循环上的协程"""
+        return await asyncio.wrap_future(self._submit(coro))
+
+    # ---- 连接池与表结构 ----
+
+    async def _get_pool(self):
+        if self._pool is not None:
+            return self._pool
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self._pool is None:
+                try:
+                    import psycopg
+                    from psycopg_pool import AsyncConnectionPool
+                    from pgvector.psycopg import register_vector_async
+                except ImportError:
+                    logger.error("请安装 psycopg 和 pgvector: pip install 'psycopg[binary,pool]' pgvector")
+                    raise
+
+                # 注册 vector 类型前扩展必须已存在
+                async with await psycopg.AsyncConnection.connect(self.connection_string, autocommit=True) as conn:
+                    await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+                    cur = await conn.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+                    row = await cur.fetchone()
+                self.extversion = row[0] if row else None
+                if (
+                    self.iterative_scan != "off"
+                    and self.extversion is not None
+                    and parse_extversion(self.extversion) < ITERATIVE_SCAN_MIN_VERSION
+                ):
+                    logger.warning(
+                        f"pgvector {self.extversion} 不支持 hnsw.iterative_scan（需要 >= 0.8），"
+                        f"带过滤条件的检索不启用迭代扫描"
+                    )
+                    self.iterative_scan = "off"
+
+                async def configure(conn):
+                    await register_vector_async(conn)
+
+                pool = AsyncConnectionPool(
+                    self.connection_string,
+                    min_size=self.pool_min_size,
+                    max_size=self.pool_max_size,
+                    kwargs={"autocommit": True},
+                    configure=configure,
+                    check=AsyncConnectionPool.check_connection,
+                    open=False,
+                )
+                await pool.open()
+                try:
+                    await self._ensure_table(pool)
+                except Exception:
+                    await pool.close()
+                    raise
+                self._pool = pool
+                logger.info(f"已连接到 PostgreSQL (async): {self.collection_name}")
+        return self._pool
+
+    async def _ensure_table(self, pool) -> None:
+        async with pool.connection() as conn:
+            await conn.execute(table_sql(self.collection_name, self.dimension, self.storage))
+            await conn.execute(search_vector_migration_sql(self.collection_name))
+            await conn.execute(storage_migration_sql(self.collection_name, self.dimension, self.storage))
+            for statement in search_index_sql(self.collection_name, self.storage):
+                await conn.execute(statement)
+            if self.binary_index:
+                await conn.execute(binary_index_sql(self.collection_name, self.dimension))
+            await conn.execute(document_index_sql(self.collection_name))
+
+    # ---- 写入 ----
+
+    @staticmethod
+    def _point_to_row(point: Dict[str, Any]) -> Tuple[str, str, str, List[float], Dict[str, Any]]:
+        """Retriever 的分块格式映射到表结构：document_id 为文件路径，行号等放入 metadata"""
+        metadata = {
+            "start_line": point.get("start_line"),
+            "end_line": point.get("end_line"),
+            "chunk_size": point.get("chunk_size"),
+            "structure_type": point.get("structure_type"),
+            "structure_name": point.get("structure_name"),
+            "language": point.get("language") or detect_language(point["file_path"]),
+            "dataset": point.get("dataset") or point.get("dataset_id"),
+            "chunk_id": stable_chunk_id(point),
+        }
+        return chunk_key(point), point["file_path"], point["content"], point["embedding"], metadata
+
+    async def aupsert(self, points: List[Dict[str, Any]]) -> None:
+        """COPY 到临时表后一次 upsert"""
+        return await self._call(self._upsert(points))
+
+    async def _upsert(self, points: List[Dict[str, Any]]) -> None:
+        if not points:
+            return
+        pool = await self._get_pool()
+        staging = f"{self.collection_name}_staging"
+        # 临时表属于会话，整个过程必须使用同一个连接
+        async with pool.connection() as conn:
+            await conn.execute(staging_sql(self.collection_name, self.dimension, self.storage))
+            await conn.execute(f"TRUNCATE {staging}")
+            async with conn.cursor() as cur:
+                async with cur.copy(
+                    f"COPY {staging} (ord, chunk_id, document_id, content, embedding, metadata) FROM STDIN"
+                ) as copy:
+                    for position, point in enumerate(points):
+                        chunk_id, document_id, content, embedding, metadata = self._point_to_row(point)
+                        await copy.write_row([
+                            position,
+                            chunk_id,
+                            document_id,
+                            content.replace("\x00", ""),
+                            PgVectorStore._vector_literal(embedding),
+                            json.dumps(metadata),
+                        ])
+            await conn.execute(upsert_from_staging_sql(self.collection_name))
+            await conn.execute(f"TRUNCATE {staging}")
+
+    async def adelete_by_file(self, file_path: str) -> int:
+        return await self._call(self._delete_by_file(file_path))
+
+    async def _delete_by_file(self, file_path: str) -> int:
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute(
+                f"DELETE FROM {self.collection_name} WHERE document_id = %s",
+                [file_path]
+            )
+            return cur.rowcount
+
+    # ---- 检索 ----
+
+    async def _configure_search(self, conn, top_k: int, filtered: bool) -> None:
+        """事务级检索参数，只影响本次查询"""
+        candidates = top_k * self.binary_oversample if self.binary_index else top_k
+        await conn.execute(
+            "SELECT set_config('hnsw.ef_search', %s, true)",
+            [str(max(self.ef_search, candidates))]
+        )
+        if filtered and self.iterative_scan != "off":
+            await conn.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", [self.iterative_scan])
+            await conn.execute(
+                "SELECT set_config('hnsw.max_scan_tuples', %s, true)",
+                [str(self.max_scan_tuples)]
+            )
+
+    async def asearch(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """异步向量检索"""
+        return await self._call(self._search(query_vector, top_k, filter))
+
+    async def _search(
+        self,
+        query_vector: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        pool = await self._get_pool()
+        where, filter_params = filter_sql(filter)
+        sql = knn_sql(self.collection_name, self.dimension, self.storage, where, self.binary_index)
+        params = knn_params(
+            PgVectorStore._vector_literal(query_vector), filter_params, top_k,
+            self.binary_index, self.binary_oversample,
+        )
+
+        async with pool.connection() as conn:
+            async with conn.transaction():
+                await self._configure_search(conn, top_k, bool(where))
+                cur = await conn.execute(sql, params)
+                rows = await cur.fetchall()
+
+        return [self._row_to_result(row, i) for i, row in enumerate(rows)]
+
+    async def asearch_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """异步批量检索，各查询在连接池上并发执行"""
+        return await self._call(self._search_batch(query_vectors, top_k, filter))
+
+    async def _search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int,
+        filter: Optional[Dict[str, Any]],
+    ) -> List[List[Dict[str, Any]]]:
+        return list(await asyncio.gather(*[
+            self._search(vector, top_k, filter) for vector in query_vectors
+        ]))
+
+    @staticmethod
+    def _row_to_result(row, rank: int) -> Dict[str, Any]:
+        metadata = row[3]
+        if isinstance(metadata, str):
+            metadata = json.loads(metadata)
+        metadata = metadata or {}
+        return {
+            # 主键是 chunk_key 字符串，对外统一返回 stable_chunk_id；旧数据的 metadata 中没有时由路径和行范围算出
+            "chunk_id": stable_chunk_id(dict(metadata, file_path=row[1])),
+            "file_path": row[1],
+            "start_line": metadata.get("start_line"),
+            "end_line": metadata.get("end_line"),
+            "content": row[2],
+            "structure_type": metadata.get("structure_type"),
+            "score": float(row[4]),
+            "rank": rank + 1,
+        }
+
+    # ---- 同步接口（Retriever / CLI） ----
+
+    def upsert(self, points: List[Dict[str, Any]]) -> None:
+        self._run(self._upsert(points))
+
+    def delete_by_file(self, file_path: str) -> int:
+        return self._run(self._delete_by_file(file_path))
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        return self._run(self._search(query_vector, top_k, filter))
+
+    def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        if len(query_vectors) == 0:
+            return []
+        return self._run(self._search_batch(query_vectors, top_k, filter))
+
+    def clear_index(self) -> None:
+        """清空表中的全部分块"""
+        async def _clear():
+            pool = await self._get_pool()
+            async with pool.connection() as conn:
+                await conn.execute(f"TRUNCATE {self.collection_name}")
+        self._run(_clear())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """行数、表和索引大小以及连接池指标"""
+        async def _stats():
+            pool = await self._get_pool()
+            async with pool.connection() as conn:
+                cur = await conn.execute(
+                    f"""
+                    SELECT count(*),
+                           pg_total_relation_size('{self.collection_name}'),
+                           pg_relation_size('idx_{self.collection_name}_embedding')
+                    FROM {self.collection_name}
+                    """
+                )
+                count, total_bytes, hnsw_bytes = await cur.fetchone()
+            return {
+                "backend": "pgvector",
+                "num_vectors": count,
+                "dimension": self.dimension,
+                "table_bytes": total_bytes,
+                "hnsw_index_bytes": hnsw_bytes,
+                "ef_search": self.ef_search,
+                "iterative_scan": self.iterative_scan,
+                "pgvector_version": self.extversion,
+                "storage": self.storage,
+                "binary_index": self.binary_index,
+                "pool": pool.get_stats(),
+            }
+        return self._run(_stats())
+
+    def close(self) -> None:
+        """关闭连接池并停止事件循环线程"""
+        if self._loop is None:
+            return
+        if self._pool is not None:
+            self._run(self._pool.close())
+            self._pool = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+
+_store: Optional[AsyncPgVectorStore] = None
+_store_lock = threading.Lock()
+
+
+def get_pgvector_store() -> AsyncPgVectorStore:
+    """进程内共享的 pgvector 存储，连接池在请求之间复用"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AsyncPgVectorStore()
+        return _store
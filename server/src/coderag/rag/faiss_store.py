@@ -1,145 +1,1252 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from contextlib import contextmanager
 import faiss
 import os
 import pickle
+import threading
+import numpy as np
+from coderag.rag.metadata_store import ColumnarMetadataStore
+from coderag.rag.projection import PendingFitBuffer, load_projector
+from coderag.rag.vector_store import VectorStore, path_predicate, stable_chunk_id
+from coderag.rag.vector_wal import VectorWriteAheadLog, WriterLock
 from coderag.settings import settings
 
 
-class FaissStore:
-    """FAISS向量存储"""
+def create_faiss_index(dim: int, factory: str = "Flat") -> faiss.Index:
+    """根据 index_factory 描述串创建内积索引
 
-    def __init__(self):
+    Args:
+        dim: 向量维度
+        factory: faiss.index_factory 描述串，例如 "Flat"、"HNSW32"、"IVF4096,PQ32"
+    """
+    if factory.strip().lower() == "flat":
+        return faiss.IndexFlatIP(dim)
+    return faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+
+
+def train_faiss_index(index: faiss.Index, vectors: np.ndarray, max_samples: int = 100000):
+    """在语料样本上训练索引（IVF 聚类中心 / PQ 码本）
+
+    Args:
+        index: 待训练索引
+        vectors: 已归一化的训练向量
+        max_samples: 参与训练的最大样本数，超出时随机抽样
+    """
+    if index.is_trained:
+        return
+    if len(vectors) > max_samples:
+        rng = np.random.default_rng(0)
+        vectors = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def min_train_points(index: faiss.Index, train_samples: int) -> int:
+    """训练索引前至少需要积累的向量数
+
+    IVF 的 k-means 每个聚类中心至少需要 39 个样本，PQ 码本同理（每个子量化器 ksub 个中心），
+    样本不足时 FAISS 会报错或训练出很差的中心。
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    nlist = ivf.nlist if ivf is not None else 0
+    pq = getattr(faiss.downcast_index(ivf) if ivf is not None else _base_index(index), 'pq', None)
+    ksub = pq.ksub if pq is not None else 0
+    return max(train_samples, nlist * 39, ksub * 39)
+
+
+def mmap_read_flags() -> int:
+    """只读内存映射加载使用的 IO 标志
+
+    IO_FLAG_MMAP 映射 IVF 倒排表，IO_FLAG_MMAP_IFC（较新的 faiss 提供）映射
+    Flat / PQ / HNSW 存储的编码，页缓存因此可以在多个 worker 进程间共享。
+    """
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    if hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+        flags |= faiss.IO_FLAG_MMAP_IFC
+    return flags
+
+
+def prewarm_files(paths: List[str], chunk_bytes: int = 16 * 1024 * 1024) -> int:
+    """顺序读取文件把内容加载进操作系统页缓存，避免首批查询触发大量缺页
+
+    Returns:
+        预热的字节数
+    """
+    total = 0
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            while True:
+                chunk = f.read(chunk_bytes)
+                if not chunk:
+                    break
+                total += len(chunk)
+    return total
+
+
+def create_binary_index(dim: int, kind: str = "flat") -> faiss.IndexBinary:
+    """创建以 vector_id 为 label 的二值索引，位数为 dim 向上取整到 8 的倍数
+
+    Args:
+        dim: 浮点向量维度
+        kind: "flat"（精确汉明距离，支持删除）或 "hnsw"
+    """
+    nbits = (dim + 7) // 8 * 8
+    if kind.strip().lower() == "hnsw":
+        return faiss.IndexBinaryIDMap2(faiss.IndexBinaryHNSW(nbits, 32))
+    return faiss.IndexBinaryIDMap2(faiss.IndexBinaryFlat(nbits))
+
+
+def binary_codes(vectors: np.ndarray) -> np.ndarray:
+    """取每一维的符号位打包成二值编码"""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """索引是否支持 remove_ids
+
+    HNSW 等图索引不支持删除；IVF 删除后不会重排内部编号，
+    被 IndexIDMap2 包装时连续删除会使 id 映射错位，同样按不支持处理。
+    """
+    if isinstance(index, faiss.IndexIDMap2) and faiss.try_extract_index_ivf(index.index) is not None:
+        return False
+    try:
+        index.remove_ids(np.zeros(0, dtype=np.int64))
+        return True
+    except RuntimeError:
+        return False
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    """剥掉 IndexIDMap / IndexPreTransform 包装，取实际执行检索的索引"""
+    index = faiss.downcast_index(index)
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexPreTransform)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def search_parameters(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> Optional[faiss.SearchParameters]:
+    """构造单次查询的参数，作为 index.search(..., params=) 传入，不修改共享的索引对象
+
+    索引类型不支持的参数会被忽略，没有可设置的参数时返回 None。
+
+    Args:
+        index: FAISS 索引
+        nprobe: IVF 类索引每次查询探测的倒排列表数
+        ef_search: HNSW 查询时的候选队列长度（IVF 的量化器为 HNSW 时作用于量化器）
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        kwargs = {'nprobe': nprobe if nprobe is not None else ivf.nprobe}
+        if ef_search is not None and isinstance(faiss.downcast_index(ivf.quantizer), faiss.IndexHNSW):
+            kwargs['quantizer_params'] = faiss.SearchParametersHNSW(efSearch=ef_search)
+        return faiss.SearchParametersIVF(**kwargs)
+    if ef_search is not None and isinstance(_base_index(index), faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+
+class FaissStore(VectorStore):
+    """FAISS向量存储
+
+    索引以 IndexIDMap2 包装，label 为元数据中每一行独有的 vector_id，支持按文件删除与覆盖写入。
+    同一分块重新写入时新版本得到新的 vector_id，旧版本记为墓碑：支持删除的索引直接移除旧向量，
+    HNSW 等不支持删除的索引中旧向量仍在，检索时与墓碑一样被过滤，compact() 时清理。
+
+    持久化采用 检查点 + 预写日志：
+    - add_points / upsert / delete_by_file 只追加写预写日志和列式元数据，不重写整个索引
+    - checkpoint() 原子替换索引文件并清空预写日志
+    - 启动时加载检查点并回放预写日志
+    - 被删除或替换的分块记为墓碑，compact() 压缩元数据并在需要时重建索引
+
+    API 每个请求都会新建存储实例，因此加载过程只读：回放时忽略未提交的日志尾部（可能属于其他进程
+    正在进行的写入），不写磁盘。写操作持有跨进程的写入锁（WriterLock），拿到锁后先做只有写入方
+    能做的事：磁盘状态被其他进程改变时重新加载、截掉崩溃留下的日志尾部、迁移旧版 pickle 元数据、
+    为旧版索引写检查点、写入投影拟合后仍暂存的向量点。
+
+    mmap 模式下检查点以只读内存映射方式打开，多个 uvicorn worker 共享同一份页缓存，
+    启动耗时也不再随索引大小增长；首次写入时会重新读取一份可写的私有副本。
+    其他进程写入的新检查点需要重启 worker 才能看到。
+
+    需要训练的索引（IVF / HNSW / PQ 等）采用两层结构：
+    - 新写入的向量进入小的 Flat 增量索引，写入后立即可查
+    - 训练好的主索引保存其余向量，检索时同时查询两层并合并结果
+    - 增量索引超过 faiss_delta_max_rows 后在后台线程合并进主索引
+    - 主索引尚未训练时，向量留在增量索引中，直到积累够训练样本（min_train_points），
+      在第一次合并时训练主索引；未开启分层（faiss_delta_max_rows = 0）时增量索引只在训练前充当缓冲
+
+    开启二值预筛选后，另存一份符号位二值编码（内存为浮点向量的 1/32）：
+    先按汉明距离取 top_k * faiss_binary_oversample 个候选，再用浮点向量精确重打分。
+    浮点向量从所在层的索引中重建，配合 mmap 模式时只有候选所在的页会被读入内存。
+
+    元数据只保存路径和行号，过滤条件仅支持 file_path / path_prefix / language，
+    检索时多取 top_k * faiss_filter_oversample 个候选后过滤。
+    """
+
+    def __init__(self, mmap: Optional[bool] = None):
+        """初始化存储
+
+        Args:
+            mmap: 是否以只读内存映射方式加载索引，None 时使用配置值
+        """
         self.index_path = settings.faiss_index_path
+        # 元数据为列式存储目录，旧版配置中的 .pkl 后缀用于定位待迁移文件
         self.metadata_path = settings.faiss_metadata_path
+        if self.metadata_path.endswith('.pkl'):
+            self.metadata_path = self.metadata_path[:-len('.pkl')]
         self.embedding_dim = settings.embedding_dim
+        self.projection_path = settings.projection_path
+        self.projector = load_projector(
+            self.projection_path,
+            settings.projection_method,
+            self.embedding_dim,
+            settings.projection_dim,
+        )
+        self.index_dim = self.projector.output_dim
+        # PCA 拟合前入库的向量点
+        self.pending_fit = PendingFitBuffer(self.projection_path + '.pending')
+        self.index_factory = settings.faiss_index_factory
+        self.nprobe = settings.faiss_nprobe
+        self.ef_search = settings.faiss_ef_search
+        self.checkpoint_rows = settings.faiss_checkpoint_rows
+        self.compact_ratio = settings.faiss_compact_ratio
+        self.wal = VectorWriteAheadLog(self.index_path + '.wal')
+        self.delta_path = self.index_path + '.delta'
+        self.delta_max_rows = settings.faiss_delta_max_rows
+        # Flat 主索引本身就支持即时写入，不需要增量层
+        self.use_delta = self.delta_max_rows > 0 and self.index_factory.strip().lower() != "flat"
+        self.delta = None
+        # 合并进行中被冻结、仍可查询的旧增量索引
+        self._frozen = None
+        self.binary_path = self.index_path + '.bin'
+        self.binary_kind = settings.faiss_binary_index
+        self.binary_oversample = settings.faiss_binary_oversample
+        self.use_binary = settings.faiss_binary_prefilter
+        self.filter_oversample = settings.faiss_filter_oversample
+        self.binary = None
+        self._lock = threading.RLock()
+        self.writer_lock = WriterLock(self.index_path + '.lock')
+        self._writer_depth = 0
+        # 回放到的已提交日志末尾，首次写入时截掉其后的尾部
+        self._wal_end: Optional[int] = None
+        # 加载时读到的检查点文件修改时间，用于发现其他进程写的检查点
+        self._checkpoint_stamp: Optional[int] = None
+        # 加载失败时只在内存中新建空索引，磁盘上的数据由写入方清空
+        self._reset_pending = False
+        self._merge_thread: Optional[threading.Thread] = None
+        self._pending_ops = 0
+        self._supports_remove = True
+        self.mmap = settings.faiss_mmap if mmap is None else mmap
+        self._mmap_loaded = False
         self.index = None
-        self.metadata = []
+        self.metadata = ColumnarMetadataStore(self.metadata_path)
         self._load_index()
+        if settings.faiss_prewarm:
+            self.prewarm()
+
+    @contextmanager
+    def _writing(self):
+        """写操作的上下文：持有进程内的锁和跨进程的写入锁，可重入
+
+        最外层拿到写入锁后先调用 _prepare_write()，结束时释放写入锁。
+        """
+        with self._lock:
+            self._writer_depth += 1
+            try:
+                if self._writer_depth == 1:
+                    self.writer_lock.acquire()
+                    self._prepare_write()
+                yield
+            finally:
+                self._writer_depth -= 1
+                if self._writer_depth == 0:
+                    self.writer_lock.release()
+
+    def _checkpoint_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _prepare_write(self):
+        """持有写入锁后、写入前执行只有写入方能做的事"""
+        migrated = self._migrate_legacy_metadata()
+        if migrated or self.metadata.is_stale() or self._checkpoint_mtime() != self._checkpoint_stamp:
+            # 加载之后其他进程提交过写入或写过检查点，内存中的状态已过期；
+            # 进行中的后台合并在替换主索引时发现冻结层已变，会放弃结果
+            self.metadata.reopen()
+            self._load_index()
+        self._reset_storage()
+        if self._wal_end is not None:
+            # 没有其他写入方在进行中，已提交部分之后的日志尾部是崩溃留下的
+            self.wal.truncate(self._wal_end)
+            self._wal_end = None
+        if self.metadata.legacy_labels:
+            # 先让检查点里的 label 换成 vector_id，再清掉元数据中的升级标记
+            self.checkpoint()
+            self.metadata.clear_legacy_labels()
+        if len(self.pending_fit) and not self.projector.needs_fit:
+            # 投影已拟合但暂存的向量点没来得及清空（写入中途退出），按 chunk_id 覆盖写入可重复执行
+            self._upsert_pending()
+
+    def _migrate_legacy_metadata(self) -> bool:
+        """将旧版 pickle 元数据迁移到列式存储
+
+        Returns:
+            是否迁移了数据（需要重新加载索引）
+        """
+        legacy_path = self.metadata_path + '.pkl'
+        if not os.path.isfile(legacy_path) or len(self.metadata) > 0:
+            return False
+        try:
+            with open(legacy_path, 'rb') as f:
+                records = pickle.load(f)
+            self.metadata.extend(records)
+            os.remove(legacy_path)
+            print(f"Migrated {len(records)} metadata records from {legacy_path}")
+            return True
+        except Exception as e:
+            print(f"Error migrating legacy FAISS metadata: {e}")
+            return False
+
+    def _new_index(self) -> faiss.Index:
+        """按配置创建以 vector_id 为 label 的空索引"""
+        return faiss.IndexIDMap2(create_faiss_index(self.index_dim, self.index_factory))
+
+    def _new_delta(self) -> faiss.Index:
+        """增量层使用精确检索的 Flat 索引，无需训练，支持删除"""
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self.index_dim))
+
+    def _needs_delta(self) -> bool:
+        """是否需要增量层：开启了分层，或主索引还没训练（增量层充当训练前的缓冲）"""
+        return self.use_delta or not self.index.is_trained
 
     def _load_index(self):
-        """加载FAISS索引"""
+        """加载FAISS索引（检查点 + 预写日志回放），只读磁盘"""
+        # 先记下检查点的时间戳：加载期间其他进程写的检查点会在写入前被发现
+        self._checkpoint_stamp = self._checkpoint_mtime()
         try:
-            if os.path.exists(self.index_path) and os.path.exists(self.metadata_path):
-                # 加载索引
-                self.index = faiss.read_index(self.index_path)
-                # 加载元数据
-                with open(self.metadata_path, 'rb') as f:
-                    self.metadata = pickle.load(f)
-                print(f"FAISS index loaded successfully with {len(self.metadata)} points")
+            legacy_labels = self.metadata.legacy_labels
+            wrapped = False
+            if os.path.exists(self.index_path):
+                # 加载检查点，元数据按需从内存映射中读取
+                self.index = self._read_checkpoint()
+                if self.index.d != self.index_dim:
+                    print(f"FAISS index dimension {self.index.d} does not match {self.index_dim}, recreating")
+                    self._create_index()
+                    return
+                if not isinstance(self.index, faiss.IndexIDMap2):
+                    self._ensure_writable()
+                    self._wrap_id_map()
+                    wrapped = True
             else:
-                # 创建新索引
-                self._create_index()
+                # 还没有检查点，从空索引开始回放
+                self.index = self._new_index()
+            if self._mmap_loaded:
+                # 只读映射的索引不能调用 remove_ids 探测，用同类型的空索引代替
+                self._supports_remove = supports_remove(self._new_index())
+            else:
+                self._supports_remove = supports_remove(self.index)
+            self._load_delta()
+            rebuild_binary = self._load_binary()
+            if legacy_labels:
+                # 只在内存中换 label，检查点由写入方在首次写入前保存
+                self._relabel_legacy(include_main=not wrapped)
+            self._replay_wal()
+            if rebuild_binary:
+                self._rebuild_binary()
+            print(f"FAISS index loaded successfully with {self.metadata.num_live} points")
         except Exception as e:
             print(f"Error loading FAISS index: {e}")
             self._create_index()
 
+    def _read_checkpoint(self) -> faiss.Index:
+        """读取检查点文件
+
+        mmap 模式且没有待回放的预写日志时只读映射，否则读入私有副本。
+        索引类型不支持映射时退回普通读取。
+        """
+        self._mmap_loaded = False
+        if self.mmap and self.wal.size_bytes() == 0:
+            try:
+                index = faiss.read_index(self.index_path, mmap_read_flags())
+                self._mmap_loaded = True
+                return index
+            except RuntimeError as e:
+                print(f"FAISS index cannot be memory-mapped, loading a private copy: {e}")
+        return faiss.read_index(self.index_path)
+
+    def _load_delta(self):
+        """加载增量层检查点"""
+        self.delta = None
+        self._frozen = None
+        if os.path.exists(self.delta_path):
+            delta = faiss.read_index(self.delta_path)
+            if not self._needs_delta():
+                # 关闭了分层，把遗留的增量向量并入主索引
+                ids = faiss.vector_to_array(delta.id_map).astype(np.int64)
+                if len(ids):
+                    self._ensure_writable()
+                    self.index.add_with_ids(delta.index.reconstruct_n(0, delta.ntotal), ids)
+                    self._pending_ops += len(ids)
+                return
+            self.delta = delta
+        elif self._needs_delta():
+            self.delta = self._new_delta()
+
+    def _load_binary(self) -> bool:
+        """加载二值预筛选索引
+
+        Returns:
+            是否需要从浮点向量重建（已有检查点但缺少二值索引文件）
+        """
+        self.binary = None
+        if not self.use_binary:
+            return False
+        if os.path.exists(self.binary_path):
+            self.binary = faiss.read_index_binary(self.binary_path)
+            return False
+        self.binary = create_binary_index(self.index_dim, self.binary_kind)
+        # 没有检查点时全部数据都在预写日志中，回放即可补齐二值编码
+        return len(self.metadata) > 0 and os.path.exists(self.index_path)
+
+    def _rebuild_binary(self, batch_size: int = 10000):
+        """用存活分块的浮点向量重建二值索引"""
+        self.binary = create_binary_index(self.index_dim, self.binary_kind)
+        live = self.metadata.live_rows()
+        for start in range(0, len(live), batch_size):
+            rows = live[start:start + batch_size]
+            ids = np.asarray(self.metadata.vector_ids[rows], dtype=np.int64)
+            self.binary.add_with_ids(binary_codes(self._vectors_for(ids)), ids)
+        self._pending_ops += len(live)
+        print(f"Built binary prefilter index for {len(live)} points")
+
+    def _ensure_writable(self):
+        """只读映射的索引在写入前换成可写的私有副本（直接修改映射会导致进程中止）"""
+        if not self._mmap_loaded:
+            return
+        self.index = faiss.read_index(self.index_path)
+        self._mmap_loaded = False
+        self._supports_remove = supports_remove(self.index)
+        print("Reopened memory-mapped FAISS index as writable")
+
+    def prewarm(self) -> int:
+        """预热索引与元数据文件的页缓存
+
+        Returns:
+            预热的字节数
+        """
+        try:
+            paths = [self.index_path] + self.metadata.data_files()
+            warmed = prewarm_files(paths)
+            print(f"Prewarmed {warmed / 1024 / 1024:.1f}MB of FAISS index and metadata")
+            return warmed
+        except Exception as e:
+            print(f"Error prewarming FAISS index: {e}")
+            return 0
+
+    def _wrap_id_map(self):
+        """旧版按位置编号的索引：取回向量后以 vector_id 重建"""
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        ids = np.asarray(self.metadata.vector_ids[:len(vectors)], dtype=np.int64)
+        index = self._new_index()
+        train_faiss_index(index, vectors, settings.faiss_train_samples)
+        index.add_with_ids(vectors, ids)
+        self.index = index
+        self._pending_ops += len(ids)
+        print(f"Rebuilt FAISS index with vector ids for {len(ids)} points")
+
+    def _relabel_legacy(self, include_main: bool = True):
+        """旧版索引以 chunk_id 为 label：换成该分块最新一行的 vector_id
+
+        只改写 IndexIDMap2 的 id 映射，不需要重建索引。同一 chunk_id 的重复向量
+        （不支持删除的索引中残留的旧版本）映射到同一行，检索时去重，compact() 时清理。
+        """
+        layers = [self.delta, self.binary]
+        if include_main:
+            self._ensure_writable()
+            layers.append(self.index)
+        relabeled = 0
+        for layer in layers:
+            if layer is None or layer.ntotal == 0:
+                continue
+            chunk_ids = faiss.vector_to_array(layer.id_map).astype(np.int64)
+            rows = self.metadata.latest_rows(chunk_ids)
+            vector_ids = np.where(
+                rows >= 0,
+                np.asarray(self.metadata.vector_ids)[np.maximum(rows, 0)],
+                -1,
+            ).astype(np.int64)
+            faiss.copy_array_to_vector(vector_ids, layer.id_map)
+            layer.construct_rev_map()
+            relabeled += len(vector_ids)
+        self._pending_ops += relabeled
+        print(f"Relabeled {relabeled} FAISS vectors from chunk ids to vector ids")
+
     def _create_index(self):
-        """创建FAISS索引"""
+        """在内存中创建空的FAISS索引；磁盘上的元数据和预写日志由 _reset_storage() 清空"""
         try:
-            # 创建Flat索引（余弦相似度）
-            self.index = faiss.IndexFlatIP(self.embedding_dim)
-            # 归一化向量以使用点积作为余弦相似度
-            self.metadata = []
-            print(f"FAISS index created successfully with dimension {self.embedding_dim}")
+            # 按配置创建索引，向量归一化后用内积作为余弦相似度
+            self.index = self._new_index()
+            self._mmap_loaded = False
+            self._supports_remove = supports_remove(self.index)
+            self.delta = self._new_delta() if self._needs_delta() else None
+            self.binary = create_binary_index(self.index_dim, self.binary_kind) if self.use_binary else None
+            self._frozen = None
+            self._reset_pending = True
+            self._wal_end = None
+            self._pending_ops = 0
+            print(f"FAISS index ({self.index_factory}) created successfully with dimension {self.index_dim}")
         except Exception as e:
             print(f"Error creating FAISS index: {e}")
 
-    def _save_index(self):
-        """保存FAISS索引"""
+    def _reset_storage(self):
+        """清空磁盘上与新建的空索引不再对应的元数据和预写日志，只在持有写入锁时调用"""
+        if not self._reset_pending:
+            return
+        self.metadata.clear()
+        self.wal.reset()
+        self._reset_pending = False
+
+    def _index_add(self, ids: np.ndarray, vectors: np.ndarray):
+        """按 vector_id 写入索引（分层时写入增量层）
+
+        vector_id 每个版本独有，这里只追加；同一分块的旧版本已由 _delete_rows 记为墓碑并移除或过滤。
+        """
+        if self.binary is not None:
+            self.binary.add_with_ids(binary_codes(vectors), ids)
+        if self.delta is not None:
+            self.delta.add_with_ids(vectors, ids)
+            return
+        self._ensure_writable()
+        self.index.add_with_ids(vectors, ids)
+
+    def _index_remove(self, ids: np.ndarray):
+        """按 vector_id 从索引移除；不支持删除的索引只依赖墓碑过滤
+
+        分层时只从增量层移除，主索引保持只读（便于共享内存映射），
+        其中的旧向量由墓碑过滤，compact() 时再清理。
+        """
+        if not len(ids):
+            return
+        if self.binary is not None and self.binary_kind.strip().lower() != "hnsw":
+            self.binary.remove_ids(ids)
+        if self.delta is not None:
+            self.delta.remove_ids(ids)
+        elif self._supports_remove:
+            self._ensure_writable()
+            self.index.remove_ids(ids)
+
+    def _replay_wal(self):
+        """回放检查点之后的预写日志
+
+        元数据 manifest 是提交点：只回放已提交的追加与删除。未提交的尾部记录可能是崩溃留下的，
+        也可能属于其他进程正在进行的写入，这里只忽略，由写入方持有写入锁时截掉。
+        """
+        committed = len(self.metadata)
+        deleted = self.metadata.deleted_mask()
+        valid_end = 0
+        replayed = 0
+        for op, start_row, end_offset, data in self.wal.records():
+            if op == VectorWriteAheadLog.OP_ADD:
+                if start_row + len(data) > committed:
+                    break
+                ids = np.asarray(self.metadata.vector_ids[start_row:start_row + len(data)], dtype=np.int64)
+                self._index_add(ids, np.ascontiguousarray(data))
+            else:
+                if len(data) and (data.max() >= committed or not deleted[data].all()):
+                    break
+                self._index_remove(np.asarray(self.metadata.vector_ids[data], dtype=np.int64))
+            valid_end = end_offset
+            replayed += len(data)
+        self._wal_end = valid_end
+        self._pending_ops += replayed
+        if replayed:
+            print(f"Replayed {replayed} operations from FAISS write-ahead log")
+
+    @property
+    def pending_rows(self) -> int:
+        """检查点之后仅记录在预写日志中的操作行数"""
+        return self._pending_ops
+
+    @staticmethod
+    def _write_atomic(index: faiss.Index, path: str):
+        """先写临时文件并落盘，再原子替换"""
+        tmp_path = path + '.tmp'
+        faiss.write_index(index, tmp_path)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _live_mask(self, ids: np.ndarray) -> np.ndarray:
+        """vector_id 对应的行是否仍然存活（未被删除或被新版本替换）"""
+        rows = self.metadata.rows_for_vector_ids(ids)
+        live = rows >= 0
+        live[live] = ~self.metadata.deleted_mask()[rows[live]]
+        return live
+
+    def _delta_snapshot(self) -> faiss.Index:
+        """增量层检查点内容：合并进行中时包含冻结层中仍然存活的向量"""
+        if self._frozen is None:
+            return self.delta
+        snapshot = self._new_delta()
+        for layer in (self._frozen, self.delta):
+            ids = faiss.vector_to_array(layer.id_map).astype(np.int64)
+            keep = self._live_mask(ids)
+            if keep.any():
+                vectors = layer.index.reconstruct_n(0, layer.ntotal)
+                snapshot.add_with_ids(vectors[keep], ids[keep])
+        return snapshot
+
+    def checkpoint(self):
+        """写检查点：原子替换索引文件，然后清空预写日志"""
+        with self._writing():
+            try:
+                # 确保目录存在
+                os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+                # 元数据已在追加时写入列式存储；先写主索引，崩溃时旧增量层中的分块仍会覆盖主索引
+                self._write_atomic(self.index, self.index_path)
+                if self.delta is not None:
+                    self._write_atomic(self._delta_snapshot(), self.delta_path)
+                elif os.path.exists(self.delta_path):
+                    os.remove(self.delta_path)
+                if self.binary is not None:
+                    tmp_path = self.binary_path + '.tmp'
+                    faiss.write_index_binary(self.binary, tmp_path)
+                    os.replace(tmp_path, self.binary_path)
+                elif os.path.exists(self.binary_path):
+                    os.remove(self.binary_path)
+                self.wal.reset()
+                self._pending_ops = 0
+                self._checkpoint_stamp = self._checkpoint_mtime()
+                print(f"FAISS index checkpoint saved with {self.get_index_size()} points")
+            except Exception as e:
+                print(f"Error saving FAISS index: {e}")
+
+    def merge_delta(self, background: bool = False):
+        """把增量层合并进主索引
+
+        增量层先被冻结（合并期间仍参与检索），新的写入进入新的增量层；
+        合并在主索引的副本上进行，完成后替换主索引并写检查点。
+
+        Args:
+            background: 是否在后台线程中合并
+        """
+        if self.delta is None:
+            return
+        thread = self._merge_thread
+        if thread is not None and thread.is_alive():
+            if background:
+                return
+            thread.join()
+        with self._lock:
+            # 上一次合并失败时冻结层仍在，直接重试
+            if self._frozen is None:
+                if self.delta.ntotal == 0:
+                    return
+                if not self.index.is_trained and self.delta.ntotal < self._train_threshold():
+                    # 样本不够训练主索引，向量继续留在增量层
+                    return
+                self._frozen = self.delta
+                self.delta = self._new_delta()
+            if background:
+                self._merge_thread = threading.Thread(target=self._merge_frozen, daemon=True)
+                self._merge_thread.start()
+                return
+        self._merge_frozen()
+
+    def wait_for_merge(self):
+        """等待后台合并结束"""
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join()
+
+    def _merge_frozen(self):
+        """把冻结层的向量写入主索引副本，再替换主索引
+
+        冻结后才被删除或被新版本替换的向量不再写入主索引；合并期间发生的删除在替换前
+        从副本中移除，不支持删除的索引中由墓碑过滤，compact() 时清理。
+        """
         try:
-            # 确保目录存在
-            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
-            # 保存索引
-            faiss.write_index(self.index, self.index_path)
+            frozen = self._frozen
+            ids = faiss.vector_to_array(frozen.id_map).astype(np.int64)
+            vectors = frozen.index.reconstruct_n(0, frozen.ntotal)
+            with self._lock:
+                live = self._live_mask(ids)
+                # 只读映射的索引不能克隆后修改，读一份私有副本
+                if self._mmap_loaded:
+                    main = faiss.read_index(self.index_path)
+                else:
+                    main = faiss.clone_index(self.index)
+            if not main.is_trained:
+                # 训练只需要向量分布，已被替换的旧版本同样可以作为样本
+                train_faiss_index(main, vectors, self._train_threshold())
+                print(f"Trained FAISS index ({self.index_factory}) on {min(len(vectors), self._train_threshold())} vectors")
+            can_remove = supports_remove(main)
+            # vector_id 每个版本独有，主索引中不会已有同一 label，直接追加
+            ids, vectors = ids[live], vectors[live]
+            main.add_with_ids(vectors, ids)
+            with self._writing():
+                if self._frozen is not frozen:
+                    # 拿写入锁时发现其他进程写过，已重新加载，这次合并的结果作废
+                    print("FAISS store was reloaded during the merge, discarding merged index")
+                    return
+                dead = ids[~self._live_mask(ids)]
+                if can_remove and len(dead):
+                    main.remove_ids(dead)
+                self.index = main
+                self._mmap_loaded = False
+                self._supports_remove = can_remove
+                self._frozen = None
+                if not self.use_delta and self.delta is not None and self.delta.ntotal == 0:
+                    # 未开启分层时，主索引训练好后不再需要缓冲
+                    self.delta = None
+                self.checkpoint()
+            print(f"Merged {len(ids)} delta vectors into FAISS main index")
+        except Exception as e:
+            print(f"Error merging FAISS delta index: {e}")
+
+    def flush(self):
+        """把预写日志中的增量合并进索引文件，墓碑比例超过阈值时顺带压缩
+
+        仍在等待 PCA 拟合的向量点只要样本数够拟合就立即拟合并入库。
+        """
+        if self.projector.needs_fit and len(self.pending_fit):
+            if len(self.pending_fit) >= self.index_dim:
+                with self._writing():
+                    self._fit_projection([p['embedding'] for p in self.pending_fit.points])
+                    self._upsert_pending()
+            else:
+                print(
+                    f"{len(self.pending_fit)} points are waiting for the PCA projection, "
+                    f"which needs at least {self.index_dim} samples"
+                )
+        self.wait_for_merge()
+        if self.pending_rows > 0:
+            self.checkpoint()
+        if len(self.metadata) and self.metadata.num_tombstones / len(self.metadata) > self.compact_ratio:
+            self.compact()
+
+    def _prepare_vectors(self, vectors: List[List[float]]) -> np.ndarray:
+        """归一化并投影向量，入库和查询共用"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.projector.enabled:
+            return self.projector.transform(vectors)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+    def _fit_projection(self, vectors: List[List[float]]):
+        """首次入库时在语料样本上拟合投影并持久化"""
+        self.projector.fit(
+            np.asarray(vectors, dtype=np.float32),
+            max_samples=settings.projection_fit_samples,
+        )
+        self.projector.save(self.projection_path)
+        print(
+            f"Fitted {self.projector}, "
+            f"explained variance {self.projector.explained_variance_ratio:.4f}"
+        )
+
+    def _upsert_pending(self):
+        """投影拟合后把暂存的向量点写入索引，再清空暂存"""
+        self.upsert(self.pending_fit.points)
+        self.pending_fit.clear()
+
+    def _delete_rows(self, rows: np.ndarray):
+        """删除指定元数据行：写日志、记墓碑、从索引移除"""
+        self.wal.append_delete(rows)
+        self.metadata.add_tombstones(rows)
+        self._index_remove(np.asarray(self.metadata.vector_ids[rows], dtype=np.int64))
+        self._pending_ops += len(rows)
+
+    def _train_threshold(self) -> int:
+        """主索引训练所需的向量数"""
+        return min_train_points(self.index, settings.faiss_train_samples)
+
+    def _delta_limit(self) -> int:
+        """触发合并的增量层大小；主索引未训练时要等到够训练样本"""
+        if self.index.is_trained:
+            return self.delta_max_rows
+        return max(self.delta_max_rows, self._train_threshold())
+
+    def _maybe_checkpoint(self):
+        """增量累计到阈值时写检查点，增量层超过上限时触发后台合并"""
+        if self.pending_rows >= self.checkpoint_rows:
+            self.checkpoint()
+        if self.delta is not None and self.delta.ntotal >= self._delta_limit():
+            # 未开启分层时是训练前的缓冲，同步合并后即可直接写主索引
+            self.merge_delta(background=self.use_delta)
+
+    def upsert(self, points: List[Dict[str, Any]]):
+        """按稳定 chunk_id 写入向量点，已存在的分块被替换
+
+        PCA 投影尚未拟合时，向量点先暂存，累计到 projection_fit_samples 个后拟合并一起写入；
+        暂存期间的检索在原始维度上对暂存的向量点精确检索，flush() 时样本数够 output_dim 即提前拟合。
+
+        Args:
+            points: 向量点列表，需包含 embedding、file_path、content
+        写入失败时抛出异常，调用方据此知道这一批没有入库。
+        """
+        if self.projector.needs_fit:
+            with self._writing():
+                self.pending_fit.append(points)
+                needed = max(settings.projection_fit_samples, self.index_dim)
+                if len(self.pending_fit) < needed:
+                    print(f"Buffered {len(points)} points for PCA fitting ({len(self.pending_fit)}/{needed})")
+                    return
+                self._fit_projection([p['embedding'] for p in self.pending_fit.points])
+                self._upsert_pending()
+            return
+
+        # 同一批内重复的 chunk_id 只保留最后一个
+        latest = {}
+        for point in points:
+            latest[stable_chunk_id(point)] = point
+        
+        # 提取向量和元数据
+        vectors = []
+        new_metadata = []
+        
+        for chunk_id, point in latest.items():
+            vectors.append(point['embedding'])
+            
             # 保存元数据
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump(self.metadata, f)
-            print(f"FAISS index saved successfully")
+            metadata = {
+                'chunk_id': chunk_id,
+                'file_path': point['file_path'],
+                'start_line': point.get('start_line'),
+                'end_line': point.get('end_line'),
+                'content': point['content'],
+                'chunk_size': point.get('chunk_size'),
+            }
+            new_metadata.append(metadata)
+        
+        if not new_metadata:
+            return
+        
+        # 归一化并投影
+        vectors = self._prepare_vectors(vectors)
+        ids = np.array(list(latest.keys()), dtype=np.int64)
+        
+        with self._writing():
+            replaced = self._upsert_locked(ids, vectors, new_metadata)
+        
+        print(f"Upserted {len(ids)} points to FAISS index ({replaced} replaced)")
+
+    def _upsert_locked(self, ids: np.ndarray, vectors: np.ndarray, new_metadata: List[Dict[str, Any]]) -> int:
+        """持有锁时执行写入：旧版本记墓碑、写日志、提交元数据、更新索引
+
+        主索引未训练时向量写入增量层，积累够训练样本后在合并时训练。
+
+        Returns:
+            被替换的旧分块数量
+        """
+        # 旧版本分块记为墓碑
+        old_rows = self.metadata.latest_rows(ids)
+        old_rows = old_rows[old_rows >= 0]
+        old_rows = old_rows[~self.metadata.deleted_mask()[old_rows]]
+        if len(old_rows):
+            self._delete_rows(old_rows)
+
+        # 先写预写日志，再提交元数据，最后以新分配的 vector_id 写入内存索引
+        start_row = len(self.metadata)
+        self.wal.append(start_row, vectors)
+        self.metadata.extend(new_metadata)
+        vector_ids = np.asarray(self.metadata.vector_ids[start_row:], dtype=np.int64)
+        self._index_add(vector_ids, vectors)
+        self._pending_ops += len(ids)
+
+        self._maybe_checkpoint()
+        return len(old_rows)
+
+    def delete_by_file(self, file_path: str) -> int:
+        """删除某个文件的全部分块
+
+        文件内容变化时先调用本方法，再 upsert 新的分块。
+
+        Returns:
+            删除的分块数量
+        """
+        try:
+            with self._writing():
+                # 还在等待 PCA 拟合的向量点一并删除，否则拟合后会重新入库
+                removed = self.pending_fit.remove_file(file_path)
+                rows = self.metadata.live_rows_for_path(file_path)
+                if len(rows):
+                    self._delete_rows(rows)
+                    self._maybe_checkpoint()
+            print(f"Deleted {len(rows) + removed} points of {file_path} from FAISS index")
+            return len(rows) + removed
         except Exception as e:
-            print(f"Error saving FAISS index: {e}")
+            print(f"Error deleting points from FAISS index: {e}")
+            return 0
 
-    def add_points(self, points: List[Dict[str, Any]]):
-        """添加向量点"""
+    def _reconstruct(self, ids: np.ndarray, index: Optional[faiss.Index] = None) -> np.ndarray:
+        """按 vector_id 取回索引中的向量，默认从主索引取"""
+        index = self.index if index is None else index
+        ivf = faiss.try_extract_index_ivf(index.index)
+        if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+            # IVF 需要先建立直接映射才能按位置重建向量
+            ivf.make_direct_map()
         try:
-            # 提取向量和元数据
-            vectors = []
-            new_metadata = []
-            
-            for point in points:
-                vector = point['embedding']
-                # 归一化向量
-                norm = sum(v*v for v in vector)**0.5
-                normalized_vector = [v/norm for v in vector]
-                vectors.append(normalized_vector)
-                
-                # 保存元数据
-                metadata = {
-                    'file_path': point['file_path'],
-                    'start_line': point.get('start_line'),
-                    'end_line': point.get('end_line'),
-                    'content': point['content'],
-                    'chunk_size': point.get('chunk_size'),
-                }
-                new_metadata.append(metadata)
-            
-            # 转换为numpy数组
-            import numpy as np
-            vectors = np.array(vectors, dtype=np.float32)
-            
-            # 添加到索引
-            self.index.add(vectors)
-            self.metadata.extend(new_metadata)
-            
-            # 保存索引
-            self._save_index()
-            
-            print(f"Added {len(points)} points to FAISS index")
+            return index.reconstruct_batch(ids)
+        except (RuntimeError, AttributeError):
+            return np.vstack([index.reconstruct(int(i)) for i in ids])
+
+    def _vectors_for(self, ids: np.ndarray) -> np.ndarray:
+        """按 vector_id 所在的层取回浮点向量，不在增量层和冻结层中的从主索引取"""
+        vectors = np.empty((len(ids), self.index_dim), dtype=np.float32)
+        remaining = np.ones(len(ids), dtype=bool)
+        for layer in (self.delta, self._frozen):
+            if layer is None or layer.ntotal == 0:
+                continue
+            mask = remaining & np.isin(ids, faiss.vector_to_array(layer.id_map))
+            if mask.any():
+                vectors[mask] = self._reconstruct(ids[mask], layer)
+                remaining &= ~mask
+        if remaining.any():
+            vectors[remaining] = self._reconstruct(ids[remaining])
+        return vectors
+
+    def export_live(self, start: int = 0, batch_size: int = 10000) -> Dict[str, Any]:
+        """按批导出存活分块的元数据和索引中的向量（已归一化/投影），用于分片重平衡
+
+        Args:
+            start: 在存活分块中的起始位置
+            batch_size: 本批数量
+
+        Returns:
+            {'records': 元数据列表, 'vectors': 向量矩阵, 'next': 下一批起点，导出完毕时为 None}
+        """
+        with self._lock:
+            live = self.metadata.live_rows()
+            rows = live[start:start + batch_size]
+            records = [self.metadata[int(row)] for row in rows]
+            ids = np.asarray(self.metadata.vector_ids[rows], dtype=np.int64)
+            if len(ids):
+                # 向量可能在主索引、冻结层或增量层中
+                vectors = self._vectors_for(ids)
+            else:
+                vectors = np.zeros((0, self.index_dim), dtype=np.float32)
+        end = start + len(rows)
+        return {
+            'records': records,
+            'vectors': vectors,
+            'next': end if end < len(live) else None,
+        }
+
+    def compact(self):
+        """墓碑压缩：先合并增量层，再重写元数据；索引不支持删除时用存活向量重建索引"""
+        try:
+            self.merge_delta()
+            with self._writing():
+                if self.pending_rows > 0:
+                    self.checkpoint()
+                self._ensure_writable()
+                live = self.metadata.live_rows()
+                removed = len(self.metadata) - len(live)
+                if not self.index.is_trained:
+                    # 主索引还没训练，所有向量都在增量层中，增量层在删除时已经移除了旧向量
+                    pass
+                elif not self._supports_remove:
+                    # 复用已训练的主索引（聚类中心 / 码本），只重新写入主索引中仍然存活的向量；
+                    # 删除后剩下的向量可能不够重新训练
+                    main_ids = faiss.vector_to_array(self.index.id_map).astype(np.int64)
+                    # 从旧版（chunk_id 为 label）升级来的索引中可能有重复 label，只保留一份
+                    keep_ids = np.unique(main_ids[self._live_mask(main_ids)])
+                    vectors = self._reconstruct(keep_ids) if len(keep_ids) else None
+                    index = faiss.clone_index(self.index)
+                    index.reset()
+                    if vectors is not None:
+                        index.add_with_ids(vectors, keep_ids)
+                    self.index = index
+                else:
+                    # 分层时主索引中残留的已删除或被替换的向量
+                    dead_ids = np.asarray(self.metadata.vector_ids[self.metadata.deleted_mask()], dtype=np.int64)
+                    if len(dead_ids):
+                        # 检索在锁外读取分层时的主索引，在副本上删除后整体替换
+                        index = faiss.clone_index(self.index)
+                        index.remove_ids(dead_ids)
+                        self.index = index
+                # vector_id 在重写后保持不变，索引中的 label 无需改动
+                self.metadata.rewrite(live)
+                if self.binary is not None:
+                    self._rebuild_binary()
+                self.checkpoint()
+            print(f"Compacted FAISS store, removed {removed} tombstoned rows")
         except Exception as e:
-            print(f"Error adding points to FAISS index: {e}")
+            print(f"Error compacting FAISS store: {e}")
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ):
+        """搜索相似向量
+
+        Args:
+            query_vector: 查询向量
+            top_k: 返回结果数量
+            filter: 过滤条件，支持 file_path / path_prefix / language
+            nprobe: IVF 探测列表数，None 时使用配置值
+            ef_search: HNSW efSearch，None 时使用配置值
+        """
+        results = self.search_batch(
+            [query_vector], top_k=top_k, filter=filter, nprobe=nprobe, ef_search=ef_search
+        )
+        return results[0] if results else []
+
+    def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """批量搜索，整个查询矩阵一次交给 FAISS（内部按查询并行）
+
+        只在取各层引用、检索原地修改的层和收集结果时持有锁，主索引和冻结层的检索在锁外进行，
+        并发的检索之间、检索与写入之间不会互相阻塞在耗时的 FAISS 检索上。
 
-    def search(self, query_vector: List[float], top_k: int = 5):
-        """搜索相似向量"""
+        Args:
+            query_vectors: 查询向量列表或形如 (n, d) 的矩阵
+            top_k: 每个查询返回的结果数量
+            filter: 所有查询共用的过滤条件，支持 file_path / path_prefix / language
+            nprobe: IVF 探测列表数，None 时使用配置值
+            ef_search: HNSW efSearch，None 时使用配置值
+
+        Returns:
+            与输入顺序对齐的结果列表
+        """
+        if len(query_vectors) == 0:
+            return []
+        # 不支持的过滤键直接报错，而不是静默返回空结果
+        predicate = path_predicate(filter)
         try:
-            # 归一化查询向量
-            norm = sum(v*v for v in query_vector)**0.5
-            normalized_query = [v/norm for v in query_vector]
+            if self.projector.needs_fit:
+                # PCA 拟合前入库的向量点都在暂存中，在原始维度上精确检索
+                with self._lock:
+                    return self.pending_fit.search(query_vectors, top_k, predicate)
             
-            # 转换为numpy数组
-            import numpy as np
-            query = np.array([normalized_query], dtype=np.float32)
+            # 归一化并投影查询向量
+            queries = self._prepare_vectors(query_vectors)
             
-            # 搜索
-            distances, indices = self.index.search(query, top_k)
+            with self._lock:
+                oversample = self.filter_oversample if predicate is not None else 1
+                if self.binary is not None and self.binary.ntotal > 0:
+                    # 二值索引随写入原地修改，整个预筛选和重打分都在锁内完成
+                    return self._search_binary(
+                        queries, top_k, ef_search or self.ef_search,
+                        self._excluded_rows(predicate), oversample
+                    )
+                
+                # 查询参数随本次调用传入，不修改共享的索引
+                params = search_parameters(
+                    self.index,
+                    nprobe=nprobe or self.nprobe,
+                    ef_search=ef_search or self.ef_search,
+                )
+                
+                # 各层返回 (距离, vector_id)；被替换的旧版本与墓碑一样在收集结果时跳过
+                layers = [layer for layer in (self.index, self._frozen, self.delta) if layer is not None]
+                
+                # 墓碑和被替换的旧向量可能仍在主索引中，需要多取一些
+                fetch_k = top_k
+                if self.metadata.num_tombstones or len(layers) > 1:
+                    fetch_k = top_k * 2
+                fetch_k *= oversample
+                
+                # 冻结层和分层时的主索引只会被整体替换、不会原地修改，锁内只取引用，在锁外检索；
+                # 增量层和未分层时的主索引随写入原地修改，在锁内检索
+                main = self.index
+                unlocked = [self._frozen, main] if self.delta is not None else [self._frozen]
+                hits = [None] * len(layers)
+                deferred = []
+                for i, index in enumerate(layers):
+                    if index.ntotal == 0:
+                        continue
+                    if any(index is layer for layer in unlocked):
+                        deferred.append(i)
+                    else:
+                        hits[i] = index.search(queries, fetch_k, params=params if index is main else None)
+            
+            for i in deferred:
+                hits[i] = layers[i].search(queries, fetch_k, params=params if layers[i] is main else None)
             
-            search_results = []
-            for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-                if idx < len(self.metadata):
-                    metadata = self.metadata[idx]
-                    search_results.append({
-                        'file_path': metadata['file_path'],
-                        'start_line': metadata.get('start_line'),
-                        'end_line': metadata.get('end_line'),
-                        'content': metadata['content'],
-                        'score': float(dist),  # 点积结果
-                        'rank': i + 1,
-                    })
+            # 按主索引、冻结层、增量层的顺序拼接
+            hits = [h for h in hits if h is not None]
+            if not hits:
+                return [[] for _ in range(len(queries))]
+            distances = np.hstack([h[0] for h in hits])
+            labels = np.hstack([h[1] for h in hits])
             
-            return search_results
+            with self._lock:
+                # 检索期间发生的删除和覆盖写入在这里一并过滤；vector_id 不会复用，旧的 label 仍然有效
+                excluded = self._excluded_rows(predicate)
+                results = []
+                for i in range(len(queries)):
+                    order = np.argsort(-distances[i], kind='stable')
+                    results.append(self._collect_results(
+                        distances[i][order], labels[i][order], excluded, top_k
+                    ))
+                return results
         except Exception as e:
             print(f"Error searching FAISS index: {e}")
-            return []
+            return [[] for _ in range(len(query_vectors))]
+
+    def _excluded_rows(self, predicate) -> np.ndarray:
+        """收集结果时跳过的行：墓碑、被替换的旧版本和不满足过滤条件的行"""
+        excluded = self.metadata.deleted_mask()
+        if predicate is not None:
+            excluded = excluded | ~self.metadata.path_mask(predicate)
+        return excluded
+
+    def _search_binary(
+        self,
+        queries: np.ndarray,
+        top_k: int,
+        ef_search: int,
+        excluded: np.ndarray,
+        oversample: int = 1,
+    ) -> List[List[Dict[str, Any]]]:
+        """二值预筛选 + 浮点重打分
+
+        先按汉明距离取过采样的候选，过滤墓碑和不满足过滤条件的行后用各层中的浮点向量计算内积重新排序。
+        """
+        fetch_k = top_k * self.binary_oversample * oversample
+        params = None
+        if self.binary_kind.strip().lower() == "hnsw":
+            params = faiss.SearchParametersHNSW(efSearch=max(ef_search, fetch_k))
+        _, labels = self.binary.search(binary_codes(queries), fetch_k, params=params)
+        
+        # 所有查询的候选一起重建浮点向量
+        candidates = np.unique(labels[labels >= 0])
+        rows = self.metadata.rows_for_vector_ids(candidates)
+        keep = rows >= 0
+        keep[keep] = ~excluded[rows[keep]]
+        candidates = candidates[keep]
+        vectors = self._vectors_for(candidates)
+        
+        results = []
+        for query, query_labels in zip(queries, labels):
+            positions = np.searchsorted(candidates, query_labels)
+            positions = np.clip(positions, 0, max(len(candidates) - 1, 0))
+            found = (query_labels >= 0) & (len(candidates) > 0)
+            if len(candidates):
+                found &= candidates[positions] == query_labels
+            positions = np.unique(positions[found])
+            scores = vectors[positions] @ query
+            order = np.argsort(-scores, kind='stable')
+            chosen = positions[order]
+            results.append(self._collect_results(scores[order], candidates[chosen], excluded, top_k))
+        return results
+
+    def _collect_results(
+        self,
+        distances: np.ndarray,
+        labels: np.ndarray,
+        excluded: np.ndarray,
+        top_k: int,
+    ) -> List[Dict[str, Any]]:
+        """把单个查询按分数排序的 vector_id 映射回元数据行，跳过 excluded 中的行
+        （墓碑、被替换的旧版本、不满足过滤条件）和重复项"""
+        rows = self.metadata.rows_for_vector_ids(labels)
+        search_results = []
+        seen = set()
+        for dist, label, row in zip(distances, labels, rows):
+            if label < 0 or row < 0 or excluded[row] or row in seen:
+                continue
+            seen.add(row)
+            metadata = self.metadata[int(row)]
+            search_results.append({
+                'chunk_id': metadata['chunk_id'],
+                'file_path': metadata['file_path'],
+                'start_line': metadata.get('start_line'),
+                'end_line': metadata.get('end_line'),
+                'content': metadata['content'],
+                'score': float(dist),  # 点积结果
+                'rank': len(search_results) + 1,
+            })
+            if len(search_results) >= top_k:
+                break
+        return search_results
 
     def clear_index(self):
         """清空索引"""
         try:
-            self._create_index()
-            self._save_index()
+            self.wait_for_merge()
+            with self._writing():
+                # PCA 需要在新语料上重新拟合
+                if self.projector.method == "pca":
+                    if os.path.exists(self.projection_path):
+                        os.remove(self.projection_path)
+                    self.projector = load_projector(
+                        self.projection_path,
+                        self.projector.method,
+                        self.embedding_dim,
+                        self.index_dim,
+                    )
+                self.pending_fit.clear()
+                self._create_index()
+                self._reset_storage()
+                self.checkpoint()
             print("FAISS index cleared successfully")
         except Exception as e:
             print(f"Error clearing FAISS index: {e}")
 
     def get_index_size(self):
-        """获取索引大小"""
-        if self.index:
-            return self.index.ntotal
-        return 0
+        """获取索引大小（主索引 + 增量层）"""
+        if not self.index:
+            return 0
+        return self.index.ntotal + self.delta_size
+
+    @property
+    def delta_size(self) -> int:
+        """增量层（含合并中的冻结层）的向量数"""
+        size = self.delta.ntotal if self.delta is not None else 0
+        if self._frozen is not None:
+            size += self._frozen.ntotal
+        return size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """索引统计信息，包括降维节省的向量内存"""
+        num_vectors = self.get_index_size()
+        try:
+            code_size = self.index.index.sa_code_size()
+        except (RuntimeError, AttributeError):
+            code_size = self.projector.bytes_per_vector()
+        return {
+            'backend': 'faiss',
+            'index_factory': self.index_factory,
+            'is_trained': bool(self.index.is_trained),
+            'num_vectors': num_vectors,
+            'embedding_dim': self.embedding_dim,
+            'index_dim': self.index_dim,
+            'projection': self.projector.get_stats(),
+            'pending_fit_points': len(self.pending_fit),
+            'bytes_per_vector': code_size,
+            'vector_bytes': num_vectors * code_size,
+            'memory_saved_bytes': self.projector.memory_saved_bytes(num_vectors),
+            'live_chunks': self.metadata.num_live,
+            'num_tombstones': self.metadata.num_tombstones,
+            'supports_remove': self._supports_remove,
+            'mmap': self._mmap_loaded,
+            'delta_vectors': self.delta_size,
+            'binary_prefilter': self.binary is not None,
+            'binary_bytes': self.binary.ntotal * self.binary.code_size if self.binary is not None else 0,
+            'merging': self._frozen is not None,
+            'metadata_bytes': self.metadata.disk_bytes(),
+            'pending_rows': self.pending_rows,
+            'wal_bytes': self.wal.size_bytes(),
+        }
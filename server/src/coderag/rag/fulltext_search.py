@@ -1,10 +1,34 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
 import os
+import threading
+import time
 from whoosh import index
 from whoosh.fields import Schema, TEXT, ID, NUMERIC
 from whoosh.qparser import QueryParser, MultifieldParser
 from whoosh.query import Term, And, Or
+from whoosh.reading import SegmentReader
 import shutil
+from coderag.rag.prefix_index import TermPrefixIndex
+from coderag.settings import settings
+
+
+def merge_small_segments(writer, segments):
+    """Whoosh 合并策略：除最大的段外全部合并为一个新段
+
+    大段只在 optimize 时重写，后台合并的开销与新写入的数据量成正比。
+    """
+    if len(segments) <= 1:
+        return segments
+    largest = max(segments, key=lambda seg: seg.doc_count_all())
+    for seg in segments:
+        if seg is largest:
+            continue
+        reader = SegmentReader(writer.storage, writer.schema, seg)
+        writer.add_reader(reader)
+        reader.close()
+    return [largest]
 
 
 class FullTextSearcher:
@@ -15,22 +39,66 @@ class FullTextSearcher:
     - 短语搜索
     - 模糊搜索
     - 权重配置
+
+    写入时提交不合并段，段数超过 fulltext_merge_segments 后在后台线程合并小段；
+    大批量导入使用 bulk_load()，整个导入过程复用一个（可多进程的）写入器并分批提交。
+    Whoosh 同一时刻只允许一个写入器，合并期间本实例的写入阻塞到合并提交为止，
+    其他进程的写入最多等待 fulltext_lock_timeout 秒；检索读取已提交的段，不受合并影响。
+
+    检索复用长期存在的 searcher（每个线程一个，Whoosh 的 searcher 不保证线程安全）：
+    本实例提交后立即刷新，其他进程的写入最多 fulltext_refresh_interval 秒后可见；
+    刷新时未变化的段读取器被复用。查询解析器和解析后的查询按查询串缓存。
     """
     
     def __init__(
         self,
         index_dir: str = "data/whoosh_index",
-        schema_fields: Optional[Dict[str, str]] = None
+        schema_fields: Optional[Dict[str, str]] = None,
+        procs: Optional[int] = None,
+        limitmb: Optional[int] = None,
+        commit_batch_size: Optional[int] = None,
+        max_segments: Optional[int] = None,
     ):
         """初始化全文搜索引擎
         
         Args:
             index_dir: 索引存储目录
             schema_fields: 自定义 schema 字段定义
+            procs: bulk_load 使用的写入进程数，None 时使用配置值
+            limitmb: 每个写入进程的索引缓冲（MB），None 时使用配置值
+            commit_batch_size: bulk_load 期间每多少文档提交一次，None 时使用配置值
+            max_segments: 段数超过该值时触发后台合并，None 时使用配置值
         """
         self.index_dir = index_dir
         self.index = None
         self.schema = self._build_schema(schema_fields)
+        self.procs = procs or settings.fulltext_writer_procs
+        self.limitmb = limitmb or settings.fulltext_writer_limitmb
+        self.commit_batch_size = commit_batch_size or settings.fulltext_commit_batch
+        self.max_segments = max_segments or settings.fulltext_merge_segments
+        self.lock_timeout = settings.fulltext_lock_timeout
+        self._write_lock = threading.RLock()
+        self._bulk_writer = None
+        self._bulk_pending = 0
+        self._merge_thread: Optional[threading.Thread] = None
+        self.ingest_stats: Dict[str, Any] = {}
+        self.refresh_interval = settings.fulltext_refresh_interval
+        self.query_cache_size = settings.fulltext_query_cache_size
+        self._local = threading.local()
+        # 线程 -> 该线程当前的 searcher，close() 时统一关闭；已结束线程的 searcher 在其他线程打开 searcher 时关闭
+        self._thread_searchers: Dict[threading.Thread, Any] = {}
+        self._thread_searchers_lock = threading.Lock()
+        # clear_index 重建索引时递增，各线程据此丢弃旧 searcher
+        self._epoch = 0
+        # 本实例每次提交后递增，各线程据此立即刷新
+        self._write_version = 0
+        self._parsers: Dict[Tuple, Any] = {}
+        self._queries: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 字段名 -> (索引代数, 前缀索引)
+        self._prefix_indexes: Dict[str, Tuple[int, TermPrefixIndex]] = {}
+        self._prefix_lock = threading.Lock()
+        self.cache_stats = {'searcher_opens': 0, 'searcher_refreshes': 0, 'query_hits': 0, 'query_misses': 0}
         self._init_index()
     
     def _build_schema(self, custom_fields: Optional[Dict[str, str]] = None) -> Schema:
@@ -64,6 +132,254 @@ class FullTextSearcher:
             self.index = index.open_dir(self.index_dir)
         else:
             self.index = index.create_in(self.index_dir, self.schema)
+
+    @staticmethod
+    def _document_fields(doc: Dict[str, Any], default_id: str) -> Dict[str, Any]:
+        return {
+            "id": doc.get('id', doc.get('file_path', default_id)),
+            "content": doc.get('content', ''),
+            "file_path": doc.get('file_path', ''),
+            "start_line": doc.get('start_line', 0),
+            "end_line": doc.get('end_line', 0),
+        }
+
+    def _new_writer(self, bulk: bool = False):
+        """创建写入器；bulk 且 procs > 1 时使用多进程写入器，各子进程各写一个段"""
+        if bulk and self.procs > 1:
+            return self.index.writer(
+                procs=self.procs,
+                limitmb=self.limitmb,
+                multisegment=True,
+                timeout=self.lock_timeout,
+            )
+        return self.index.writer(limitmb=self.limitmb, timeout=self.lock_timeout)
+
+    @contextmanager
+    def _writer(self):
+        """bulk_load 期间复用批量写入器；否则新建写入器，结束时提交（不合并段）"""
+        with self._write_lock:
+            if self._bulk_writer is not None:
+                yield self._bulk_writer
+                return
+            writer = self._new_writer()
+            try:
+                yield writer
+            except Exception:
+                writer.cancel()
+                raise
+            writer.commit(merge=False)
+            self._write_version += 1
+        self._maybe_merge()
+
+    def _commit_bulk(self):
+        """提交当前批次并换一个新的批量写入器（调用方持有写锁）"""
+        self._bulk_writer.commit(merge=False)
+        self._write_version += 1
+        self.ingest_stats['commits'] = self.ingest_stats.get('commits', 0) + 1
+        self._bulk_writer = self._new_writer(bulk=True)
+        self._bulk_pending = 0
+
+    @contextmanager
+    def bulk_load(self, optimize: bool = True):
+        """批量导入模式
+
+        期间的 add_documents / update_document / delete_document 共用一个写入器
+        （procs > 1 时为多进程写入器），每 commit_batch_size 个文档提交一次；
+        退出时提交剩余文档，optimize=True 时在后台把所有段合并为一个。
+        发生异常时最后一批未提交的文档被丢弃。
+        """
+        if self._bulk_writer is not None:
+            yield self
+            return
+
+        # 合并线程需要写锁，先等它结束
+        self.wait_for_merge()
+        with self._write_lock:
+            self._bulk_writer = self._new_writer(bulk=True)
+            self._bulk_pending = 0
+        start = time.time()
+        documents_before = self.ingest_stats.get('documents', 0)
+        try:
+            yield self
+        except Exception:
+            with self._write_lock:
+                self._bulk_writer.cancel()
+                self._bulk_writer = None
+            raise
+
+        with self._write_lock:
+            self._bulk_writer.commit(merge=False)
+            self._bulk_writer = None
+            self._write_version += 1
+        self.ingest_stats['commits'] = self.ingest_stats.get('commits', 0) + 1
+        print(
+            f"Bulk loaded {self.ingest_stats.get('documents', 0) - documents_before} documents into Whoosh index "
+            f"in {time.time() - start:.2f}s ({self.segment_count()} segments)"
+        )
+        if optimize:
+            self.optimize(background=True)
+        else:
+            self._maybe_merge()
+
+    def segment_count(self) -> int:
+        """当前已提交的索引段数"""
+        return len(self.index._segments())
+
+    def _maybe_merge(self):
+        if self.segment_count() > self.max_segments:
+            self.merge(background=True)
+
+    def merge(self, background: bool = False):
+        """合并除最大段以外的所有段，耗时与小段的数据量成正比，期间写入阻塞"""
+        self._start_merge(optimize=False, background=background)
+
+    def optimize(self, background: bool = False):
+        """把所有段合并为一个
+
+        会重写整个索引，期间写入一直阻塞；适合在 bulk_load 结束或空闲时调用。
+        """
+        self._start_merge(optimize=True, background=background)
+
+    def _start_merge(self, optimize: bool, background: bool):
+        if not background:
+            self._merge(optimize)
+            return
+        with self._write_lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            self._merge_thread = threading.Thread(
+                target=self._merge,
+                args=(optimize,),
+                name="whoosh-merge",
+                daemon=True,
+            )
+            self._merge_thread.start()
+
+    def _merge(self, optimize: bool):
+        """合并写入器占用 Whoosh 的写锁直到提交，因此整个合并都持有 _write_lock：
+        本实例的写入在 _write_lock 上排队等待，而不是在 Whoosh 写锁上等到 lock_timeout 后失败
+        """
+        try:
+            start = time.time()
+            with self._write_lock:
+                before = self.segment_count()
+                writer = self.index.writer(timeout=self.lock_timeout)
+                if optimize:
+                    writer.commit(optimize=True)
+                else:
+                    writer.commit(mergetype=merge_small_segments)
+                self._write_version += 1
+                after = self.segment_count()
+            print(f"Merged Whoosh segments {before} -> {after} in {time.time() - start:.2f}s")
+        except Exception as e:
+            print(f"Error merging Whoosh segments: {e}")
+
+    def wait_for_merge(self):
+        """等待后台合并完成"""
+        thread = self._merge_thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join()
+
+    def _searcher(self):
+        """当前线程的长期 searcher，索引代数变化时刷新
+
+        本实例有新提交时立即检查，否则最多每 refresh_interval 秒检查一次磁盘上的最新代数。
+        """
+        state = self._local
+        now = time.monotonic()
+        searcher = getattr(state, 'searcher', None)
+        if searcher is not None and state.epoch != self._epoch:
+            searcher.close()
+            searcher = None
+
+        if searcher is None:
+            searcher = self.index.searcher()
+            self.cache_stats['searcher_opens'] += 1
+        elif state.version != self._write_version or now - state.checked_at >= self.refresh_interval:
+            # refresh() 复用未变化的段读取器并关闭其余的，旧 searcher 不能再关闭（会关掉复用的读取器）
+            refreshed = searcher.refresh()
+            if refreshed is not searcher:
+                self.cache_stats['searcher_refreshes'] += 1
+            searcher = refreshed
+        else:
+            return searcher
+
+        state.searcher = searcher
+        state.epoch = self._epoch
+        state.version = self._write_version
+        state.checked_at = now
+        self._track_searcher(searcher)
+        return searcher
+
+    def _track_searcher(self, searcher):
+        """登记当前线程的 searcher，并关闭已结束线程留下的 searcher"""
+        with self._thread_searchers_lock:
+            self._thread_searchers[threading.current_thread()] = searcher
+            finished = [thread for thread in self._thread_searchers if not thread.is_alive()]
+            stale = [self._thread_searchers.pop(thread) for thread in finished]
+        for searcher in stale:
+            searcher.close()
+
+    def _parser(self, fields: Tuple[str, ...], boost: Optional[Dict[str, float]] = None):
+        """按字段和权重缓存查询解析器"""
+        boost_key = tuple(sorted(boost.items())) if boost else ()
+        key = (fields, boost_key)
+        parser = self._parsers.get(key)
+        if parser is None:
+            if len(fields) == 1 and not boost:
+                parser = QueryParser(fields[0], schema=self.schema)
+            else:
+                parser = MultifieldParser(list(fields), schema=self.schema, fieldboosts=boost)
+            self._parsers[key] = parser
+        return parser
+
+    def _parse(self, query_str: str, fields: Tuple[str, ...], boost: Optional[Dict[str, float]] = None):
+        """解析查询串，解析结果按 (查询串, 字段, 权重) 做 LRU 缓存"""
+        key = (query_str, fields, tuple(sorted(boost.items())) if boost else ())
+        with self._cache_lock:
+            query = self._queries.get(key)
+            if query is not None:
+                self._queries.move_to_end(key)
+                self.cache_stats['query_hits'] += 1
+                return query
+            self.cache_stats['query_misses'] += 1
+
+        query = self._parser(fields, boost).parse(query_str)
+        with self._cache_lock:
+            self._queries[key] = query
+            if len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return query
+
+    @staticmethod
+    def _hit_to_result(hit) -> Dict[str, Any]:
+        return {
+            "id": hit["id"],
+            "content": hit["content"],
+            "file_path": hit["file_path"],
+            "start_line": hit.get("start_line", 0),
+            "end_line": hit.get("end_line", 0),
+            "score": hit.score,
+        }
+
+    def close(self):
+        """等待后台合并结束并关闭所有线程的 searcher（调用方保证没有进行中的检索）
+
+        之后的检索在各线程中重新打开 searcher。
+        """
+        self.wait_for_merge()
+        with self._thread_searchers_lock:
+            searchers = list(self._thread_searchers.values())
+            self._thread_searchers = {}
+            self._local = threading.local()
+        for searcher in searchers:
+            searcher.close()
+
+    def _record_ingest(self, documents: int, seconds: float):
+        stats = self.ingest_stats
+        stats['documents'] = stats.get('documents', 0) + documents
+        stats['seconds'] = stats.get('seconds', 0.0) + seconds
+        stats['docs_per_second'] = stats['documents'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
     
     def add_documents(self, documents: List[Dict[str, Any]]) -> int:
         """批量添加文档到索引
@@ -77,23 +393,19 @@ class FullTextSearcher:
         if not documents:
             return 0
         
-        writer = self.index.writer()
-        doc_count = 0
-        
-        for doc in documents:
-            doc_id = doc.get('id', doc.get('file_path', f"doc_{doc_count}"))
-            
-            writer.add_document(
-                id=doc_id,
-                content=doc.get('content', ''),
-                file_path=doc.get('file_path', ''),
-                start_line=doc.get('start_line', 0),
-                end_line=doc.get('end_line', 0),
-            )
-            doc_count += 1
+        start = time.time()
+        with self._writer() as writer:
+            for doc_count, doc in enumerate(documents):
+                writer.add_document(**self._document_fields(doc, f"doc_{doc_count}"))
+            if self._bulk_writer is not None:
+                self._bulk_pending += len(documents)
+                if self._bulk_pending >= self.commit_batch_size:
+                    self._commit_bulk()
+            else:
+                self.ingest_stats['commits'] = self.ingest_stats.get('commits', 0) + 1
         
-        writer.commit()
-        return doc_count
+        self._record_ingest(len(documents), time.time() - start)
+        return len(documents)
     
     def update_document(self, doc_id: str, document: Dict[str, Any]) -> bool:
         """更新单个文档
@@ -106,15 +418,10 @@ class FullTextSearcher:
             是否更新成功
         """
         try:
-            writer = self.index.writer()
-            writer.update_document(
-                id=doc_id,
-                content=document.get('content', ''),
-                file_path=document.get('file_path', ''),
-                start_line=document.get('start_line', 0),
-                end_line=document.get('end_line', 0),
-            )
-            writer.commit()
+            fields = self._document_fields(document, doc_id)
+            fields['id'] = doc_id
+            with self._writer() as writer:
+                writer.update_document(**fields)
             return True
         except Exception as e:
             print(f"Failed to update document: {e}")
@@ -130,9 +437,8 @@ class FullTextSearcher:
             是否删除成功
         """
         try:
-            writer = self.index.writer()
-            writer.delete_by_term('id', doc_id)
-            writer.commit()
+            with self._writer() as writer:
+                writer.delete_by_term('id', doc_id)
             return True
         except Exception:
             return False
@@ -158,31 +464,9 @@ class FullTextSearcher:
         if not query_str:
             return []
         
-        with self.index.searcher() as searcher:
-            if fields is None:
-                fields = ["content"]
-            
-            if len(fields) == 1:
-                parser = QueryParser(fields[0], schema=self.schema)
-            else:
-                parser = MultifieldParser(fields, schema=self.schema)
-            
-            query = parser.parse(query_str)
-            results = searcher.search(query, limit=limit)
-            
-            search_results = []
-            for hit in results:
-                result = {
-                    "id": hit["id"],
-                    "content": hit["content"],
-                    "file_path": hit["file_path"],
-                    "start_line": hit.get("start_line", 0),
-                    "end_line": hit.get("end_line", 0),
-                    "score": hit.score,
-                }
-                search_results.append(result)
-            
-            return search_results
+        query = self._parse(query_str, tuple(fields or ["content"]), boost)
+        results = self._searcher().search(query, limit=limit)
+        return [self._hit_to_result(hit) for hit in results]
     
     def search_by_filter(
         self,
@@ -203,76 +487,101 @@ class FullTextSearcher:
         if not query_str:
             return []
         
-        with self.index.searcher() as searcher:
-            parser = QueryParser("content", schema=self.schema)
-            query = parser.parse(query_str)
-            
-            filter_queries = []
-            for field, value in filters.items():
-                if isinstance(value, str):
-                    filter_queries.append(Term(field, value))
-                elif isinstance(value, (list, tuple)):
-                    or_queries = [Term(field, v) for v in value]
-                    filter_queries.append(Or(or_queries))
-            
-            if filter_queries:
-                query = And([query] + filter_queries)
-            
-            results = searcher.search(query, limit=limit)
-            
-            search_results = []
-            for hit in results:
-                result = {
-                    "id": hit["id"],
-                    "content": hit["content"],
-                    "file_path": hit["file_path"],
-                    "start_line": hit.get("start_line", 0),
-                    "end_line": hit.get("end_line", 0),
-                    "score": hit.score,
-                }
-                search_results.append(result)
-            
-            return search_results
+        query = self._parse(query_str, ("content",))
+        
+        filter_queries = []
+        for field, value in filters.items():
+            if isinstance(value, str):
+                filter_queries.append(Term(field, value))
+            elif isinstance(value, (list, tuple)):
+                or_queries = [Term(field, v) for v in value]
+                filter_queries.append(Or(or_queries))
+        
+        if filter_queries:
+            query = And([query] + filter_queries)
+        
+        results = self._searcher().search(query, limit=limit)
+        return [self._hit_to_result(hit) for hit in results]
     
-    def suggest(self, prefix: str, field: str = "content", limit: int = 5) -> List[str]:
+    def _prefix_index(self, field: str) -> TermPrefixIndex:
+        """字段词典的前缀索引，索引代数变化后重建"""
+        reader = self._searcher().reader()
+        generation = reader.generation()
+        cached = self._prefix_indexes.get(field)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        with self._prefix_lock:
+            cached = self._prefix_indexes.get(field)
+            if cached is None or cached[0] != generation:
+                start = time.time()
+                prefix_index = TermPrefixIndex.from_reader(reader, field)
+                self._prefix_indexes[field] = (generation, prefix_index)
+                print(f"Built prefix index for '{field}' with {len(prefix_index)} terms in {time.time() - start:.2f}s")
+            return self._prefix_indexes[field][1]
+
+    def suggest(
+        self,
+        prefix: str,
+        field: str = "content",
+        limit: int = 5,
+        with_counts: bool = False,
+    ) -> List[Any]:
         """获取搜索建议（自动补全）
+
+        从索引词典中找出以 prefix 开头的词项，按文档频率降序返回。
         
         Args:
             prefix: 输入前缀
-            field: 字段名
+            field: 字段名，需为 TEXT 或 ID 字段
             limit: 返回建议数量
+            with_counts: 为 True 时返回 {"term", "doc_frequency"} 字典
             
         Returns:
             建议列表
         """
         if not prefix:
             return []
+        if field not in self.schema or not isinstance(self.schema[field], (TEXT, ID)):
+            raise ValueError(f"Field '{field}' does not support suggestions")
+        # TEXT 字段的分词器会转为小写
+        if isinstance(self.schema[field], TEXT):
+            prefix = prefix.lower()
         
-        with self.index.searcher() as searcher:
-            reader = searcher.reader()
-            suggestions = []
-            
-            for fields in reader.all_stored_fields():
-                if field in fields:
-                    text = fields[field].lower()
-                    if text.startswith(prefix.lower()):
-                        suggestions.append(fields[field])
-                        if len(suggestions) >= limit:
-                            break
-            
-            return suggestions
+        completions = self._prefix_index(field).complete(prefix, limit)
+        if with_counts:
+            return [{"term": term, "doc_frequency": freq} for term, freq in completions]
+        return [term for term, _ in completions]
     
     def clear_index(self):
         """清空索引"""
+        self.wait_for_merge()
         if os.path.exists(self.index_dir):
             shutil.rmtree(self.index_dir)
         os.makedirs(self.index_dir, exist_ok=True)
         self.index = index.create_in(self.index_dir, self.schema)
+        self._epoch += 1
+        with self._cache_lock:
+            self._queries.clear()
+        self._prefix_indexes = {}
     
     def get_doc_count(self) -> int:
         """获取索引中的文档数量"""
-        with self.index.searcher() as searcher:
-            return searcher.doc_count()
+        return self._searcher().doc_count()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """文档数、段数、索引代数以及累计写入速度"""
+        merging = self._merge_thread is not None and self._merge_thread.is_alive()
+        return {
+            'doc_count': self.get_doc_count(),
+            'segments': self.segment_count(),
+            'generation': self.index.latest_generation(),
+            'merging': merging,
+            'bulk_loading': self._bulk_writer is not None,
+            'procs': self.procs,
+            'limitmb': self.limitmb,
+            'ingest': dict(self.ingest_stats),
+            'cache': dict(self.cache_stats),
+        }
     
     def __repr__(self) -> str:
         return f"FullTextSearcher(index_dir='{self.index_dir}', doc_count={self.get_doc_count()})"
@@ -292,3 +601,32 @@ def create_searcher(
         FullTextSearcher 实例
     """
     return FullTextSearcher(index_dir=index_dir, **kwargs)
+
+
+_searchers: Dict[str, Any] = {}
+_searchers_lock = threading.Lock()
+
+
+def get_fulltext_searcher(index_dir: Optional[str] = None):
+    """进程内共享的全文搜索引擎，searcher、查询缓存和前缀索引在请求之间复用
+
+    settings.fulltext_backend 为 "sqlite" 时返回 SQLiteFullTextSearcher，接口相同。
+
+    Args:
+        index_dir: 索引目录（sqlite 后端为数据库文件），None 时使用配置值
+    """
+    sqlite_backend = settings.fulltext_backend == "sqlite"
+    if sqlite_backend:
+        index_dir = index_dir or settings.fulltext_sqlite_path
+    else:
+        index_dir = index_dir or settings.fulltext_index_dir
+    with _searchers_lock:
+        searcher = _searchers.get(index_dir)
+        if searcher is None:
+            if sqlite_backend:
+                from coderag.rag.sqlite_fts import SQLiteFullTextSearcher
+                searcher = SQLiteFullTextSearcher(db_path=index_dir)
+            else:
+                searcher = FullTextSearcher(index_dir=index_dir)
+            _searchers[index_dir] = searcher
+        return searcher
@@ -0,0 +1,506 @@
+from typing import List, Dict, Any, Optional
+import os
+import json
+import mmap
+import shutil
+import numpy as np
+from coderag.rag.vector_store import stable_chunk_id
+
+
+class ColumnarMetadataStore:
+    """列式、内存映射的分块元数据存储
+
+    目录结构：
+    - manifest.json: 已提交的行数、各文件长度与当前数据代号（generation），读取时只认 manifest 中的部分
+    - 数据文件：第 0 代直接放在目录下，压缩重写后的第 n 代放在 g{n}/ 子目录中
+    - content.bin: 所有分块内容（UTF-8）顺序拼接
+    - content_end.i8: 每行内容在 content.bin 中的结束偏移（int64）
+    - chunk_id.i8: 分块稳定 ID（int64），同一分块的各个版本相同
+    - vector_id.i8: 每一行（分块的每个版本）独有的向量 ID（int64，随行号单调递增），即向量索引中的 label
+    - start_line.i4 / end_line.i4 / chunk_size.i4: 行号与分块大小（int32），-1 表示缺失
+    - path_id.i4: 文件路径 ID（int32）
+    - paths.jsonl: 路径表，每行一个 JSON 字符串，行号即路径 ID
+    - tombstones.i8: 已删除（或被新版本替换）的行号
+
+    所有列文件都只追加写入，读取时通过 mmap 惰性访问，启动时不需要把语料文本读入内存。
+    被删除的行只记录墓碑，由 rewrite() 在压缩时真正移除：新一代数据写完后原子替换 manifest 提交，
+    任何时刻崩溃都只会看到旧一代或新一代中的一个。
+    """
+
+    VERSION = 3
+    MANIFEST = "manifest.json"
+    CONTENT = "content.bin"
+    PATHS = "paths.jsonl"
+    TOMBSTONES = "tombstones.i8"
+    COLUMNS = {
+        "content_end": np.int64,
+        "chunk_id": np.int64,
+        "start_line": np.int32,
+        "end_line": np.int32,
+        "chunk_size": np.int32,
+        "path_id": np.int32,
+        "vector_id": np.int64,
+    }
+
+    def __init__(self, directory: str):
+        """打开（或创建）元数据存储
+
+        Args:
+            directory: 存储目录
+        """
+        self.directory = directory
+        self._manifest: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {}
+        self._content: Optional[mmap.mmap] = None
+        self._content_file = None
+        self._paths: List[str] = []
+        self._path_ids: Dict[str, int] = {}
+        # chunk_id -> 最新行号，首次查询时构建，之后随 extend 增量更新
+        self._row_by_id: Optional[Dict[int, int]] = None
+        self._deleted: Optional[np.ndarray] = None
+        self._open()
+
+    def _data_dir(self, generation: Optional[int] = None) -> str:
+        """数据文件所在目录，默认为当前一代"""
+        if generation is None:
+            generation = self._manifest.get("generation", 0)
+        return os.path.join(self.directory, f"g{generation}") if generation else self.directory
+
+    def _path(self, name: str) -> str:
+        if name == self.MANIFEST:
+            return os.path.join(self.directory, name)
+        return os.path.join(self._data_dir(), name)
+
+    def _data_files(self, generation: Optional[int] = None) -> List[str]:
+        """某一代的全部数据文件（不含 manifest）"""
+        directory = self._data_dir(generation)
+        if not os.path.isdir(directory):
+            return []
+        return [
+            os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name != self.MANIFEST and os.path.isfile(os.path.join(directory, name))
+        ]
+
+    def data_files(self) -> List[str]:
+        """当前一代的数据文件路径，用于预热页缓存"""
+        return self._data_files()
+
+    def _empty_manifest(self) -> Dict[str, int]:
+        return {
+            "version": self.VERSION,
+            "count": 0,
+            "content_bytes": 0,
+            "num_paths": 0,
+            "paths_bytes": 0,
+            "num_tombstones": 0,
+            "next_vector_id": 0,
+        }
+
+    def _open(self):
+        """读取 manifest 并建立内存映射"""
+        os.makedirs(self.directory, exist_ok=True)
+        manifest_path = self._path(self.MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self._manifest = json.load(f)
+        else:
+            self._manifest = self._empty_manifest()
+
+        self._paths = []
+        paths_file = self._path(self.PATHS)
+        if self._manifest["num_paths"] and os.path.exists(paths_file):
+            with open(paths_file, "rb") as f:
+                data = f.read(self._manifest["paths_bytes"])
+            self._paths = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+        self._path_ids = {path: i for i, path in enumerate(self._paths)}
+        self._row_by_id = None
+
+        version = self._manifest.get("version", 1)
+        if version < 2:
+            self._upgrade_v1()
+        if version < 3:
+            self._upgrade_v2()
+
+        self._map_files()
+
+    def _upgrade_v1(self):
+        """v1 没有 chunk_id 列和墓碑，按 路径 + 行号 回填稳定 ID"""
+        count = self._manifest["count"]
+        if count:
+            columns = {
+                name: np.fromfile(self._column_file(name), dtype=self.COLUMNS[name], count=count)
+                for name in ("start_line", "end_line", "path_id")
+            }
+            chunk_ids = np.array([
+                stable_chunk_id({
+                    "file_path": self._paths[int(columns["path_id"][i])],
+                    "start_line": self._none_if_missing(columns["start_line"][i]),
+                    "end_line": self._none_if_missing(columns["end_line"][i]),
+                })
+                for i in range(count)
+            ], dtype=np.int64)
+            chunk_ids.tofile(self._column_file("chunk_id"))
+        manifest = dict(self._manifest)
+        manifest["version"] = 2
+        manifest["num_tombstones"] = 0
+        self._write_manifest(manifest)
+        self._manifest = manifest
+
+    def _upgrade_v2(self):
+        """v2 没有 vector_id 列，按行号回填
+
+        v2 的向量索引以 chunk_id 为 label，manifest 中记下 legacy_labels，
+        由向量存储把索引的 label 换成 vector_id 后调用 clear_legacy_labels()。
+        """
+        count = self._manifest["count"]
+        if count:
+            np.arange(count, dtype=np.int64).tofile(self._column_file("vector_id"))
+        manifest = dict(self._manifest)
+        manifest["version"] = self.VERSION
+        manifest["next_vector_id"] = count
+        if count:
+            manifest["legacy_labels"] = True
+        self._write_manifest(manifest)
+        self._manifest = manifest
+
+    @property
+    def legacy_labels(self) -> bool:
+        """向量索引是否仍以 chunk_id 为 label（从 v2 升级而来）"""
+        return bool(self._manifest.get("legacy_labels", False))
+
+    def clear_legacy_labels(self):
+        """向量索引的 label 已换成 vector_id"""
+        if not self.legacy_labels:
+            return
+        manifest = dict(self._manifest)
+        del manifest["legacy_labels"]
+        self._write_manifest(manifest)
+        self._manifest = manifest
+
+    def is_stale(self) -> bool:
+        """磁盘上的 manifest 是否已被其他进程提交的写入改变"""
+        manifest_path = self._path(self.MANIFEST)
+        if not os.path.exists(manifest_path):
+            return self._manifest != self._empty_manifest()
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f) != self._manifest
+
+    def reopen(self):
+        """重新读取 manifest，看到其他进程提交的写入"""
+        self._close_maps()
+        self._open()
+
+    def _map_files(self):
+        """按已提交的行数映射列文件和内容文件"""
+        self._close_maps()
+        count = self._manifest["count"]
+        for name, dtype in self.COLUMNS.items():
+            if count:
+                self._columns[name] = np.memmap(
+                    self._column_file(name),
+                    dtype=dtype,
+                    mode="r",
+                    shape=(count,),
+                )
+            else:
+                self._columns[name] = np.zeros(0, dtype=dtype)
+
+        if self._manifest["content_bytes"]:
+            self._content_file = open(self._path(self.CONTENT), "rb")
+            self._content = mmap.mmap(
+                self._content_file.fileno(),
+                self._manifest["content_bytes"],
+                access=mmap.ACCESS_READ,
+            )
+
+        self._deleted = None
+
+    def _close_maps(self):
+        self._columns = {}
+        if self._content is not None:
+            self._content.close()
+            self._content = None
+        if self._content_file is not None:
+            self._content_file.close()
+            self._content_file = None
+
+    def _column_file(self, name: str) -> str:
+        return self._path(f"{name}.{np.dtype(self.COLUMNS[name]).str[1:]}")
+
+    def _truncate_to_manifest(self):
+        """截掉上次未提交（例如写入中途崩溃）留下的尾部数据"""
+        count = self._manifest["count"]
+        sizes = {
+            self._path(self.CONTENT): self._manifest["content_bytes"],
+            self._path(self.PATHS): self._manifest["paths_bytes"],
+            self._path(self.TOMBSTONES): self._manifest["num_tombstones"] * 8,
+        }
+        for name, dtype in self.COLUMNS.items():
+            sizes[self._column_file(name)] = count * np.dtype(dtype).itemsize
+        for path, size in sizes.items():
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def _write_manifest(self, manifest: Dict[str, int]):
+        """原子替换 manifest，作为本次追加的提交点"""
+        manifest_path = self._path(self.MANIFEST)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, manifest_path)
+
+    @staticmethod
+    def _int_or_missing(value: Any) -> int:
+        return -1 if value is None else int(value)
+
+    @staticmethod
+    def _none_if_missing(value: Any) -> Optional[int]:
+        value = int(value)
+        return None if value < 0 else value
+
+    def extend(self, records: List[Dict[str, Any]], vector_ids: Optional[np.ndarray] = None):
+        """追加元数据行
+
+        Args:
+            records: 元数据列表，需包含 file_path 和 content，可选 chunk_id
+            vector_ids: 指定各行的 vector_id（压缩重写时沿用原值），None 时分配新的
+        """
+        if not records:
+            return
+
+        self._truncate_to_manifest()
+        manifest = dict(self._manifest)
+
+        new_paths = []
+        path_ids = []
+        for record in records:
+            path = record["file_path"]
+            if path not in self._path_ids:
+                self._path_ids[path] = len(self._paths) + len(new_paths)
+                new_paths.append(path)
+            path_ids.append(self._path_ids[path])
+
+        encoded = [(record.get("content") or "").encode("utf-8") for record in records]
+        content_end = manifest["content_bytes"] + np.cumsum([len(b) for b in encoded], dtype=np.int64)
+        if vector_ids is None:
+            vector_ids = np.arange(len(records), dtype=np.int64) + manifest["next_vector_id"]
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+
+        columns = {
+            "content_end": content_end,
+            "chunk_id": np.array([stable_chunk_id(r) for r in records], dtype=np.int64),
+            "start_line": np.array([self._int_or_missing(r.get("start_line")) for r in records], dtype=np.int32),
+            "end_line": np.array([self._int_or_missing(r.get("end_line")) for r in records], dtype=np.int32),
+            "chunk_size": np.array([self._int_or_missing(r.get("chunk_size")) for r in records], dtype=np.int32),
+            "path_id": np.array(path_ids, dtype=np.int32),
+            "vector_id": vector_ids,
+        }
+
+        with open(self._path(self.CONTENT), "ab") as f:
+            f.write(b"".join(encoded))
+        for name, values in columns.items():
+            with open(self._column_file(name), "ab") as f:
+                f.write(values.astype(self.COLUMNS[name]).tobytes())
+        if new_paths:
+            data = "".join(json.dumps(path, ensure_ascii=False) + "\n" for path in new_paths).encode("utf-8")
+            with open(self._path(self.PATHS), "ab") as f:
+                f.write(data)
+            manifest["paths_bytes"] += len(data)
+
+        first_row = manifest["count"]
+        manifest["count"] += len(records)
+        manifest["content_bytes"] = int(content_end[-1])
+        manifest["num_paths"] += len(new_paths)
+        manifest["next_vector_id"] = max(manifest["next_vector_id"], int(vector_ids[-1]) + 1)
+        self._write_manifest(manifest)
+
+        self._manifest = manifest
+        self._paths.extend(new_paths)
+        self._map_files()
+        if self._row_by_id is not None:
+            # 只合入新追加的行，后写入的行覆盖同一 chunk_id 的旧行
+            self._row_by_id.update(zip(columns["chunk_id"].tolist(), range(first_row, manifest["count"])))
+
+    def add_tombstones(self, rows: np.ndarray):
+        """把指定行标记为已删除
+
+        Args:
+            rows: 行号数组
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+
+        self._truncate_to_manifest()
+        with open(self._path(self.TOMBSTONES), "ab") as f:
+            f.write(rows.tobytes())
+
+        manifest = dict(self._manifest)
+        manifest["num_tombstones"] += len(rows)
+        self._write_manifest(manifest)
+        self._manifest = manifest
+        self._deleted = None
+
+    def deleted_mask(self) -> np.ndarray:
+        """每行是否已删除的布尔数组（惰性构建）"""
+        if self._deleted is None:
+            mask = np.zeros(len(self), dtype=bool)
+            num_tombstones = self._manifest["num_tombstones"]
+            if num_tombstones:
+                rows = np.fromfile(self._path(self.TOMBSTONES), dtype=np.int64, count=num_tombstones)
+                mask[rows] = True
+            self._deleted = mask
+        return self._deleted
+
+    @property
+    def num_tombstones(self) -> int:
+        return int(self.deleted_mask().sum())
+
+    @property
+    def num_live(self) -> int:
+        return len(self) - self.num_tombstones
+
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        return self._columns["chunk_id"]
+
+    def latest_rows(self, chunk_ids: np.ndarray) -> np.ndarray:
+        """查找每个 chunk_id 最新的一行，不存在时为 -1
+
+        chunk_id -> 行号的映射在首次查询时构建一次，之后 extend 只合入新行，
+        大批量导入时每批的开销与批大小成正比，而不是与总行数成正比。
+        """
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        if self._row_by_id is None:
+            # 按行号顺序写入，同一 chunk_id 保留最后一行
+            self._row_by_id = dict(zip(np.asarray(self.chunk_ids).tolist(), range(len(self))))
+        row_by_id = self._row_by_id
+        return np.fromiter(
+            (row_by_id.get(chunk_id, -1) for chunk_id in chunk_ids.tolist()),
+            dtype=np.int64,
+            count=len(chunk_ids),
+        )
+
+    @property
+    def vector_ids(self) -> np.ndarray:
+        return self._columns["vector_id"]
+
+    def rows_for_vector_ids(self, vector_ids: np.ndarray) -> np.ndarray:
+        """查找每个 vector_id 所在的行，不存在（例如已被压缩掉）时为 -1
+
+        vector_id 随行号单调递增，压缩重写后仍保持有序，直接二分查找。
+        """
+        vector_ids = np.asarray(vector_ids, dtype=np.int64)
+        column = self.vector_ids
+        if len(column) == 0:
+            return np.full(len(vector_ids), -1, dtype=np.int64)
+        pos = np.searchsorted(column, vector_ids)
+        pos_clipped = np.clip(pos, 0, len(column) - 1)
+        found = column[pos_clipped] == vector_ids
+        return np.where(found, pos_clipped, -1).astype(np.int64)
+
+    def live_rows_for_path(self, file_path: str) -> np.ndarray:
+        """指定文件仍然有效的行号"""
+        path_id = self._path_ids.get(file_path)
+        if path_id is None or len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.nonzero(np.asarray(self._columns["path_id"]) == path_id)[0]
+        return rows[~self.deleted_mask()[rows]].astype(np.int64)
+
+    def path_mask(self, predicate) -> np.ndarray:
+        """文件路径满足谓词的行掩码，谓词对每个不同路径只计算一次"""
+        allowed = np.array([bool(predicate(path)) for path in self._paths], dtype=bool)
+        if len(self) == 0 or len(allowed) == 0:
+            return np.zeros(len(self), dtype=bool)
+        return allowed[np.asarray(self._columns["path_id"])]
+
+    def live_rows(self) -> np.ndarray:
+        """所有未删除的行号"""
+        return np.nonzero(~self.deleted_mask())[0].astype(np.int64)
+
+    def __len__(self) -> int:
+        return self._manifest["count"]
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        """按行号读取元数据，content 从 mmap 惰性解码"""
+        if idx < 0 or idx >= len(self):
+            raise IndexError(idx)
+        end = int(self._columns["content_end"][idx])
+        start = int(self._columns["content_end"][idx - 1]) if idx > 0 else 0
+        return {
+            "chunk_id": int(self._columns["chunk_id"][idx]),
+            "file_path": self._paths[int(self._columns["path_id"][idx])],
+            "start_line": self._none_if_missing(self._columns["start_line"][idx]),
+            "end_line": self._none_if_missing(self._columns["end_line"][idx]),
+            "content": self._content[start:end].decode("utf-8") if end > start else "",
+            "chunk_size": self._none_if_missing(self._columns["chunk_size"][idx]),
+        }
+
+    def _remove_stale_generations(self):
+        """删除不属于当前一代的数据（压缩中途崩溃留下的新一代，或提交后没来得及删除的旧一代）"""
+        current = self._manifest.get("generation", 0)
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) and name[:1] == "g" and name[1:].isdigit() and int(name[1:]) != current:
+                shutil.rmtree(path)
+        if current:
+            for path in self._data_files(0):
+                os.remove(path)
+
+    def rewrite(self, rows: np.ndarray, batch_size: int = 10000):
+        """只保留指定行重写存储（墓碑压缩），行号会重新编号，vector_id 保持不变
+
+        新一代数据写到 g{n}/ 子目录，写完后原子替换 manifest 作为提交点，之后才删除旧一代。
+        提交前崩溃时 manifest 仍指向旧一代，多出的子目录在下次压缩时清理。
+        """
+        self._remove_stale_generations()
+        generation = self._manifest.get("generation", 0) + 1
+        new_dir = self._data_dir(generation)
+
+        compacted = ColumnarMetadataStore(new_dir)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            compacted.extend([self[int(row)] for row in batch], vector_ids=self.vector_ids[batch])
+        compacted.close()
+        # 子目录中的 manifest 只在写入时使用，提交的是顶层 manifest
+        manifest = dict(compacted._manifest)
+        os.remove(os.path.join(new_dir, self.MANIFEST))
+        manifest["generation"] = generation
+        # 被压缩掉的 vector_id 不再复用
+        manifest["next_vector_id"] = self._manifest["next_vector_id"]
+        if self.legacy_labels:
+            manifest["legacy_labels"] = True
+
+        self._close_maps()
+        self._write_manifest(manifest)
+        self._open()
+        self._remove_stale_generations()
+
+    def clear(self):
+        """清空存储"""
+        self._close_maps()
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        self._open()
+
+    def close(self):
+        """释放内存映射"""
+        self._close_maps()
+
+    def disk_bytes(self) -> int:
+        """已提交数据占用的磁盘字节数"""
+        count = self._manifest["count"]
+        column_bytes = sum(count * np.dtype(dtype).itemsize for dtype in self.COLUMNS.values())
+        return (
+            column_bytes
+            + self._manifest["content_bytes"]
+            + self._manifest["paths_bytes"]
+            + self._manifest["num_tombstones"] * 8
+        )
+
+    def __repr__(self) -> str:
+        return f"ColumnarMetadataStore(directory='{self.directory}', count={len(self)})"
@@ -0,0 +1,96 @@
+from typing import List, Dict, Tuple, Iterable
+import bisect
+import numpy as np
+
+
+class TermPrefixIndex:
+    """词项前缀索引，用于自动补全
+
+    词项按字典序存放在数组中，同一前缀的词项构成一段连续区间，用二分查找定位；
+    每个词项附带文档频率，补全结果按频率降序返回。
+
+    短前缀（不超过 precompute_length 个字符）对应的区间很大，其 top-N 在构建时预先算好；
+    更长前缀的区间很小，查询时在区间内直接取 top-N。
+    """
+
+    # 大于任何合法字符，prefix + _MAX_CHAR 是前缀区间的上界
+    _MAX_CHAR = chr(0x10FFFF)
+
+    def __init__(
+        self,
+        terms: List[str],
+        frequencies: Iterable[int],
+        max_results: int = 20,
+        precompute_length: int = 2,
+    ):
+        """
+        Args:
+            terms: 按字典序排列的词项
+            frequencies: 与词项对齐的文档频率
+            max_results: 预计算的每个短前缀保留的补全数量
+            precompute_length: 预计算 top-N 的前缀最大长度
+        """
+        self.terms = terms
+        self.frequencies = np.asarray(frequencies, dtype=np.int64)
+        self.max_results = max_results
+        self.precompute_length = precompute_length
+        self._top: Dict[str, List[Tuple[str, int]]] = {}
+        self._precompute()
+
+    @classmethod
+    def from_reader(cls, reader, fieldname: str, **kwargs) -> "TermPrefixIndex":
+        """从 Whoosh reader 的词典构建，词典本身已按字节序（即 UTF-8 码点序）排列"""
+        terms = []
+        frequencies = []
+        for text, terminfo in reader.iter_field(fieldname):
+            terms.append(text.decode("utf-8", errors="replace") if isinstance(text, bytes) else text)
+            frequencies.append(terminfo.doc_frequency())
+        return cls(terms, frequencies, **kwargs)
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + self._MAX_CHAR, lo=start)
+        return start, end
+
+    def _top_in_range(self, start: int, end: int, limit: int) -> List[Tuple[str, int]]:
+        """区间内频率最高的 limit 个词项，频率相同时按字典序"""
+        freqs = self.frequencies[start:end]
+        if len(freqs) > limit:
+            # 第 limit 大的频率；等于它的词项只取字典序靠前的，保证结果确定
+            kth = np.partition(freqs, len(freqs) - limit)[len(freqs) - limit]
+            above = np.nonzero(freqs > kth)[0]
+            equal = np.nonzero(freqs == kth)[0][:limit - len(above)]
+            candidates = np.concatenate([above, equal])
+        else:
+            candidates = np.arange(len(freqs))
+        # 先按位置（字典序）再按频率稳定排序
+        candidates = np.sort(candidates)
+        order = candidates[np.argsort(-freqs[candidates], kind="stable")]
+        return [(self.terms[start + i], int(freqs[i])) for i in order]
+
+    def _precompute(self):
+        prefixes = set()
+        for term in self.terms:
+            for length in range(1, min(len(term), self.precompute_length) + 1):
+                prefixes.add(term[:length])
+        for prefix in prefixes:
+            start, end = self._range(prefix)
+            self._top[prefix] = self._top_in_range(start, end, self.max_results)
+
+    def complete(self, prefix: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """返回以 prefix 开头、文档频率最高的 limit 个 (词项, 文档频率)"""
+        if not prefix or limit <= 0:
+            return []
+        top = self._top.get(prefix)
+        if top is not None and limit <= self.max_results:
+            return top[:limit]
+        if len(prefix) <= self.precompute_length and top is None:
+            # 预计算覆盖了所有短前缀，没有命中说明不存在这样的词项
+            return []
+        start, end = self._range(prefix)
+        if start == end:
+            return []
+        return self._top_in_range(start, end, limit)
+
+    def __len__(self) -> int:
+        return len(self.terms)
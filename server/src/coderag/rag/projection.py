@@ -0,0 +1,316 @@
+from typing import List, Dict, Any, Optional, Callable
+import os
+import pickle
+import numpy as np
+
+from coderag.rag.vector_store import stable_chunk_id
+
+
+class EmbeddingProjector:
+    """嵌入向量降维投影
+
+    在入库和查询两侧使用同一个投影，把向量从模型原始维度降到 output_dim：
+    - pca: 在语料样本上拟合 PCA，保留前 output_dim 个主成分
+    - matryoshka: 直接截断前 output_dim 维（仅适用于 Matryoshka 训练的模型）
+    - none: 不做投影
+
+    投影后的向量会重新 L2 归一化，索引仍然可以用内积作为余弦相似度。
+    """
+
+    METHODS = ("none", "pca", "matryoshka")
+
+    def __init__(self, method: str = "none", input_dim: int = 384, output_dim: Optional[int] = None):
+        """初始化投影
+
+        Args:
+            method: 投影方式 ('none', 'pca', 'matryoshka')
+            input_dim: 模型原始向量维度
+            output_dim: 投影后的维度，None 或 >= input_dim 时不降维
+        """
+        if method not in self.METHODS:
+            raise ValueError(f"Unsupported projection method: {method}, expected one of {self.METHODS}")
+
+        if not output_dim or output_dim >= input_dim:
+            method = "none"
+            output_dim = input_dim
+
+        self.method = method
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+        self.explained_variance_ratio: float = 1.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.method != "none"
+
+    @property
+    def needs_fit(self) -> bool:
+        """PCA 在拟合前无法使用"""
+        return self.method == "pca" and self.components is None
+
+    def fit(self, vectors: np.ndarray, max_samples: int = 10000) -> "EmbeddingProjector":
+        """在语料样本上拟合 PCA
+
+        Args:
+            vectors: 形如 (n, input_dim) 的样本向量
+            max_samples: 参与拟合的最大样本数，超出时随机抽样
+        """
+        if self.method != "pca":
+            return self
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > max_samples:
+            rng = np.random.default_rng(0)
+            vectors = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+
+        if len(vectors) < self.output_dim:
+            raise ValueError(
+                f"PCA needs at least {self.output_dim} samples to fit, got {len(vectors)}"
+            )
+
+        self.mean = vectors.mean(axis=0)
+        centered = vectors - self.mean
+        _, singular_values, vt = np.linalg.svd(centered, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:self.output_dim].T, dtype=np.float32)
+
+        variance = singular_values ** 2
+        total = float(variance.sum())
+        self.explained_variance_ratio = (
+            float(variance[:self.output_dim].sum()) / total if total > 0 else 1.0
+        )
+        return self
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """投影并归一化向量
+
+        Args:
+            vectors: 形如 (n, input_dim) 的向量
+
+        Returns:
+            形如 (n, output_dim) 的 float32 向量
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+
+        if self.method == "pca":
+            if self.needs_fit:
+                raise RuntimeError("PCA projection has not been fitted")
+            vectors = (vectors - self.mean) @ self.components
+        elif self.method == "matryoshka":
+            vectors = vectors[:, :self.output_dim]
+
+        return np.ascontiguousarray(_normalize(vectors), dtype=np.float32)
+
+    def bytes_per_vector(self) -> int:
+        """投影后每个向量占用的字节数 (float32)"""
+        return self.output_dim * 4
+
+    def memory_saved_bytes(self, num_vectors: int) -> int:
+        """相比原始维度节省的向量内存"""
+        return (self.input_dim - self.output_dim) * 4 * num_vectors
+
+    def save(self, path: str):
+        """持久化投影参数，和索引放在一起"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {
+            "method": np.array(self.method),
+            "input_dim": np.array(self.input_dim),
+            "output_dim": np.array(self.output_dim),
+            "explained_variance_ratio": np.array(self.explained_variance_ratio),
+        }
+        if self.components is not None:
+            arrays["mean"] = self.mean
+            arrays["components"] = self.components
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingProjector":
+        """从文件加载投影参数"""
+        with np.load(path) as data:
+            projector = cls(
+                method=str(data["method"]),
+                input_dim=int(data["input_dim"]),
+                output_dim=int(data["output_dim"]),
+            )
+            projector.explained_variance_ratio = float(data["explained_variance_ratio"])
+            if "components" in data:
+                projector.mean = data["mean"].astype(np.float32)
+                projector.components = data["components"].astype(np.float32)
+        return projector
+
+    def matches(self, method: str, input_dim: int, output_dim: Optional[int]) -> bool:
+        """判断已持久化的投影是否与当前配置一致"""
+        expected = EmbeddingProjector(method, input_dim, output_dim)
+        return (
+            self.method == expected.method
+            and self.input_dim == expected.input_dim
+            and self.output_dim == expected.output_dim
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """投影配置摘要"""
+        return {
+            "method": self.method,
+            "input_dim": self.input_dim,
+            "output_dim": self.output_dim,
+            "fitted": not self.needs_fit,
+            "explained_variance_ratio": self.explained_variance_ratio,
+        }
+
+    def __repr__(self) -> str:
+        return f"EmbeddingProjector(method={self.method}, {self.input_dim} -> {self.output_dim})"
+
+
+class PendingFitBuffer:
+    """PCA 拟合前暂存的向量点
+
+    PCA 至少需要 output_dim 个样本才能拟合，首批数据往往不够，
+    入库的向量点先暂存在这里，样本足够后拟合投影再统一写入索引。
+    拟合前的检索由 search() 在原始维度上对暂存的向量点精确检索，入库的数据立即可查。
+    每批以一个 pickle 帧追加到文件，进程重启后可以恢复；末尾不完整的帧被忽略。
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: 暂存文件路径
+        """
+        self.path = path
+        self._points: List[Dict[str, Any]] = []
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    self._points.extend(pickle.load(f))
+                except (EOFError, pickle.UnpicklingError):
+                    break
+
+    def append(self, points: List[Dict[str, Any]]):
+        """追加一批向量点并落盘"""
+        if not points:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            pickle.dump(points, f)
+            f.flush()
+            os.fsync(f.fileno())
+        self._points.extend(points)
+
+    @property
+    def points(self) -> List[Dict[str, Any]]:
+        return self._points
+
+    def remove_file(self, file_path: str) -> int:
+        """删除某个文件暂存的向量点并重写暂存文件
+
+        Returns:
+            删除的向量点数量
+        """
+        kept = [p for p in self._points if p['file_path'] != file_path]
+        removed = len(self._points) - len(kept)
+        if not removed:
+            return 0
+        if not kept:
+            self.clear()
+            return removed
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, "wb") as f:
+            pickle.dump(kept, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._points = kept
+        return removed
+
+    def search(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int,
+        predicate: Optional[Callable[[str], bool]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """在原始维度上对暂存的向量点做精确检索（归一化后的内积，即余弦相似度）
+
+        同一分块多次暂存时以最后一次为准，与拟合后按 chunk_id 覆盖写入的结果一致。
+
+        Args:
+            query_vectors: 未投影的查询向量
+            top_k: 每个查询返回的结果数量
+            predicate: 文件路径谓词，不满足的向量点被跳过
+
+        Returns:
+            与输入顺序对齐的结果列表，格式与向量存储的检索结果相同
+        """
+        latest = {}
+        for point in self._points:
+            if predicate is None or predicate(point['file_path']):
+                latest[stable_chunk_id(point)] = point
+        if not latest:
+            return [[] for _ in range(len(query_vectors))]
+
+        chunk_ids = list(latest.keys())
+        points = list(latest.values())
+        vectors = _normalize(np.asarray([p['embedding'] for p in points], dtype=np.float32))
+        scores = _normalize(np.asarray(query_vectors, dtype=np.float32)) @ vectors.T
+
+        results = []
+        for row in scores:
+            order = np.argsort(-row, kind='stable')[:top_k]
+            results.append([
+                {
+                    'chunk_id': chunk_ids[j],
+                    'file_path': points[j]['file_path'],
+                    'start_line': points[j].get('start_line'),
+                    'end_line': points[j].get('end_line'),
+                    'content': points[j]['content'],
+                    'score': float(row[j]),
+                    'rank': rank + 1,
+                }
+                for rank, j in enumerate(order)
+            ])
+        return results
+
+    def clear(self):
+        """投影拟合完成、暂存的向量点入库后清空"""
+        self._points = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def load_projector(
+    path: str,
+    method: str,
+    input_dim: int,
+    output_dim: Optional[int] = None,
+) -> EmbeddingProjector:
+    """加载投影，配置变化或文件不存在时返回新的（未拟合的）投影
+
+    Args:
+        path: 投影参数文件路径
+        method: 投影方式
+        input_dim: 模型原始维度
+        output_dim: 目标维度
+    """
+    if os.path.exists(path):
+        try:
+            projector = EmbeddingProjector.load(path)
+            if projector.matches(method, input_dim, output_dim):
+                return projector
+            print(f"Projection config changed, ignoring persisted projection at {path}")
+        except Exception as e:
+            print(f"Error loading projection: {e}")
+    return EmbeddingProjector(method, input_dim, output_dim)
@@ -1,19 +1,172 @@
-from typing import List, Dict, Any
-from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, CollectionDescription
+from typing import List, Dict, Any, Optional
+import asyncio
+import atexit
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    PointStruct,
+    QueryRequest,
+    CollectionDescription,
+    Filter,
+    FieldCondition,
+    MatchValue,
+    MatchAny,
+    FilterSelector,
+    PayloadSchemaType,
+    VectorParams,
+    Distance,
+    HnswConfigDiff,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    QuantizationSearchParams,
+)
+from coderag.rag.vector_store import VectorStore, chunk_key, detect_language, path_prefixes, stable_chunk_id
 from coderag.settings import settings
 
+# 分块 UUID 的命名空间，同一分块（chunk_key 相同）总是得到相同的点 ID
+CHUNK_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "coderag/chunk")
 
-class QdrantStore:
+
+# 进程内共享的客户端，按连接参数缓存，避免每个请求重新建立连接；
+# 引用计数记录仍在使用客户端的存储实例数，最后一个实例 close() 时才真正关闭
+_clients: Dict[tuple, Any] = {}
+_client_refs: Dict[tuple, int] = {}
+_clients_lock = threading.Lock()
+
+
+def is_local_mode() -> bool:
+    """是否使用嵌入式本地模式（数据直接存放在 qdrant_path，不经过网络）"""
+    return settings.vector_store == "qdrant_local"
+
+
+def _connection_kwargs() -> Dict[str, Any]:
+    if is_local_mode():
+        return {'path': settings.qdrant_path}
+    return {
+        'host': settings.qdrant_host,
+        'port': settings.qdrant_port,
+        'grpc_port': settings.qdrant_grpc_port,
+        'prefer_grpc': settings.qdrant_prefer_grpc,
+    }
+
+
+def _get_client(client_cls) -> Any:
+    """取得共享客户端并增加引用计数，用完后调用 release_client()"""
+    kwargs = _connection_kwargs()
+    key = (client_cls,) + tuple(sorted(kwargs.items()))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = client_cls(**kwargs)
+            _clients[key] = client
+        _client_refs[key] = _client_refs.get(key, 0) + 1
+        return client
+
+
+def release_client(client: Any):
+    """释放一次共享客户端的引用，没有其他使用者时从缓存移除并关闭
+
+    异步客户端的 close() 需要在事件循环中等待，这里只从缓存移除。
+    """
+    with _clients_lock:
+        for key, cached in list(_clients.items()):
+            if cached is not client:
+                continue
+            _client_refs[key] -= 1
+            if _client_refs[key] > 0:
+                return
+            del _clients[key]
+            del _client_refs[key]
+            if isinstance(client, QdrantClient):
+                client.close()
+            return
+
+
+@atexit.register
+def _close_clients():
+    """进程退出前关闭同步客户端，本地模式需要借此落盘并释放文件锁"""
+    with _clients_lock:
+        for key, client in list(_clients.items()):
+            if isinstance(client, QdrantClient):
+                client.close()
+            del _clients[key]
+            _client_refs.pop(key, None)
+
+
+def get_qdrant_client() -> QdrantClient:
+    """获取共享的同步客户端（增加一次引用）"""
+    return _get_client(QdrantClient)
+
+
+def get_async_qdrant_client() -> AsyncQdrantClient:
+    """获取共享的异步客户端（增加一次引用），供 async 接口使用，不阻塞事件循环
+
+    本地模式下数据目录只能被一个客户端打开，不提供异步客户端。
+    """
+    if is_local_mode():
+        raise RuntimeError("Async client is not available in qdrant_local mode")
+    return _get_client(AsyncQdrantClient)
+
+
+def chunk_point_id(point: Dict[str, Any]) -> str:
+    """由 chunk_key（显式 ID 或 文件路径 + 行范围）生成确定性的点 ID，重复入库会覆盖而不是新增"""
+    return str(uuid.uuid5(CHUNK_NAMESPACE, chunk_key(point)))
+
+
+# 建立 payload 索引的字段，过滤条件只会落在这些字段上。
+# keyword 索引只支持精确匹配，路径前缀过滤通过对 path_prefixes（全部上级目录）的精确匹配实现
+PAYLOAD_INDEX_FIELDS = ['file_path', 'path_prefixes', 'language', 'dataset', 'structure_type']
+
+
+def build_filter(filter: Optional[Dict[str, Any]]) -> Optional[Filter]:
+    """把过滤字典转换为 Qdrant Filter
+
+    支持的键：path_prefix, file_path, language, dataset, structure_type；
+    值为列表时匹配其中任意一个。已经是 Filter 的参数原样返回。
+    """
+    if not filter:
+        return None
+    if isinstance(filter, Filter):
+        return filter
+
+    conditions = []
+    for key, value in filter.items():
+        if value is None:
+            continue
+        field = key
+        if key == 'path_prefix':
+            field = 'path_prefixes'
+            if isinstance(value, (list, tuple)):
+                value = [v.replace('\\', '/').strip('/') for v in value]
+            else:
+                value = value.replace('\\', '/').strip('/')
+        if isinstance(value, (list, tuple)):
+            match = MatchAny(any=list(value))
+        else:
+            match = MatchValue(value=value)
+        conditions.append(FieldCondition(key=field, match=match))
+    return Filter(must=conditions) if conditions else None
+
+
+class QdrantStore(VectorStore):
     """Qdrant向量存储"""
 
     def __init__(self):
-        self.client = QdrantClient(
-            host=settings.qdrant_host,
-            port=settings.qdrant_port
-        )
+        self.local = is_local_mode()
+        self.client = get_qdrant_client()
+        self._async_client: Optional[AsyncQdrantClient] = None
         self.collection_name = settings.qdrant_collection
         self.embedding_dim = settings.embedding_dim
+        self.upsert_batch_size = settings.qdrant_upsert_batch_size
+        # 本地模式的客户端不是线程安全的，只能串行写入
+        self.upsert_parallel = 1 if self.local else settings.qdrant_upsert_parallel
+        self._collection_ready = False
+        self.upload_stats: Dict[str, Any] = {}
 
     def create_collection(self):
         """创建集合"""
@@ -29,107 +182,393 @@ class QdrantStore:
                 # 创建集合
                 self.client.create_collection(
                     collection_name=self.collection_name,
-                    vectors_config={
-                        "size": self.embedding_dim,
-                        "distance": "Cosine",
-                    },
+                    vectors_config=VectorParams(
+                        size=self.embedding_dim,
+                        distance=Distance.COSINE,
+                        on_disk=settings.qdrant_vectors_on_disk,
+                    ),
+                    hnsw_config=HnswConfigDiff(
+                        m=settings.qdrant_hnsw_m,
+                        ef_construct=settings.qdrant_hnsw_ef_construct,
+                    ),
+                    quantization_config=self._quantization_config(),
+                    on_disk_payload=settings.qdrant_on_disk_payload,
                 )
                 print(f"Collection {self.collection_name} created successfully")
             else:
                 print(f"Collection {self.collection_name} already exists")
+
+            # 本地模式不支持 payload 索引，过滤时全量扫描
+            if not self.local:
+                self.create_payload_indexes()
+            self._collection_ready = True
         except Exception as e:
             print(f"Error creating collection: {e}")
 
-    def add_points(self, points: List[Dict[str, Any]]):
-        """添加向量点"""
-        try:
-            point_structs = []
-            for i, point in enumerate(points):
-                point_id = i
-                vector = point['embedding']
-                payload = {
-                    'file_path': point['file_path'],
-                    'start_line': point.get('start_line'),
-                    'end_line': point.get('end_line'),
-                    'content': point['content'],
-                    'chunk_size': point.get('chunk_size'),
-                    'structure_type': point.get('structure_type'),
-                    'structure_name': point.get('structure_name'),
-                }
-                point_struct = PointStruct(
-                    id=point_id,
-                    vector=vector,
-                    payload=payload,
-                )
-                point_structs.append(point_struct)
+    @staticmethod
+    def _quantization_config() -> Optional[ScalarQuantization]:
+        """int8 标量量化：向量内存降为 1/4，量化向量常驻内存，原始向量可放磁盘用于重排"""
+        if settings.qdrant_quantization != "int8":
+            return None
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8,
+                quantile=0.99,
+                always_ram=settings.qdrant_quantization_always_ram,
+            )
+        )
 
-            # 批量添加
-            self.client.upsert(
+    @staticmethod
+    def _search_params() -> Optional[SearchParams]:
+        """检索参数：HNSW ef 以及量化检索的重排与过采样"""
+        quantization = None
+        if settings.qdrant_quantization == "int8":
+            quantization = QuantizationSearchParams(
+                rescore=settings.qdrant_rescore,
+                oversampling=settings.qdrant_oversampling,
+            )
+        if quantization is None and not settings.qdrant_hnsw_ef:
+            return None
+        return SearchParams(
+            hnsw_ef=settings.qdrant_hnsw_ef or None,
+            quantization=quantization,
+        )
+
+    def ensure_collection(self):
+        """首次写入前确保集合存在"""
+        if not self._collection_ready:
+            self.create_collection()
+
+    def create_payload_indexes(self):
+        """为过滤字段建立 keyword payload 索引（已存在时 Qdrant 直接忽略）"""
+        for field in PAYLOAD_INDEX_FIELDS:
+            self.client.create_payload_index(
                 collection_name=self.collection_name,
-                points=point_structs,
+                field_name=field,
+                field_schema=PayloadSchemaType.KEYWORD,
             )
-            print(f"Added {len(point_structs)} points to collection")
-        except Exception as e:
-            print(f"Error adding points: {e}")
 
-    def search(self, query_vector: List[float], top_k: int = 5):
-        """搜索相似向量"""
-        try:
-            # 尝试使用 search 方法
-            try:
-                results = self.client.search(
+    def upsert(self, points: List[Dict[str, Any]], wait: bool = False):
+        """添加向量点
+
+        点 ID 由 chunk_key（显式 ID 或 文件路径 + 行范围）确定，同一分块重复写入会覆盖。
+        按 qdrant_upsert_batch_size 拆成子批，最多 qdrant_upsert_parallel 个请求同时在途。
+        除最后一个子批外都不等待服务端应用；其余子批都被接收后，最后一个子批以 wait=True 发送，
+        服务端按接收顺序应用写入，因此返回时本次写入的所有点都已可检索。
+
+        Args:
+            points: 向量点列表
+            wait: 是否每个子批都等待服务端应用完再返回
+        写入失败时抛出异常（与其他后端一致），调用方据此知道这一批没有入库。
+        """
+        self.ensure_collection()
+        point_structs = []
+        for point in points:
+            vector = point['embedding']
+            payload = {
+                'chunk_id': stable_chunk_id(point),
+                'file_path': point['file_path'],
+                'path_prefixes': path_prefixes(point['file_path']),
+                'language': point.get('language') or detect_language(point['file_path']),
+                'dataset': point.get('dataset') or point.get('dataset_id'),
+                'start_line': point.get('start_line'),
+                'end_line': point.get('end_line'),
+                'content': point['content'],
+                'chunk_size': point.get('chunk_size'),
+                'structure_type': point.get('structure_type'),
+                'structure_name': point.get('structure_name'),
+            }
+            point_struct = PointStruct(
+                id=chunk_point_id(point),
+                vector=list(vector),
+                payload=payload,
+            )
+            point_structs.append(point_struct)
+
+        batches = [
+            point_structs[start:start + self.upsert_batch_size]
+            for start in range(0, len(point_structs), self.upsert_batch_size)
+        ]
+
+        # 分批并行添加，最后一个子批在其余子批被接收后同步等待
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.upsert_parallel) as executor:
+            futures = [
+                executor.submit(
+                    self.client.upsert,
                     collection_name=self.collection_name,
-                    query_vector=query_vector,
-                    limit=top_k,
-                    with_payload=True,
-                    with_vectors=False,
+                    points=batch,
+                    wait=wait,
                 )
-            except AttributeError:
-                # 如果 search 方法不存在，尝试使用查询 API
-                from qdrant_client.models import SearchRequest
-                results = self.client.query(
+                for batch in batches[:-1]
+            ]
+            for future in futures:
+                future.result()
+        if batches:
+            self.client.upsert(
+                collection_name=self.collection_name,
+                points=batches[-1],
+                wait=True,
+            )
+        elapsed = time.time() - start_time
+
+        self.upload_stats = {
+            'points': len(point_structs),
+            'batches': len(batches),
+            'seconds': elapsed,
+            'points_per_second': len(point_structs) / elapsed if elapsed > 0 else 0.0,
+        }
+        print(
+            f"Added {len(point_structs)} points to collection in {len(batches)} batches, "
+            f"{elapsed:.2f}s ({self.upload_stats['points_per_second']:.0f} points/s)"
+        )
+
+    def delete_by_file(self, file_path: str) -> int:
+        """删除某个文件的全部分块
+
+        Returns:
+            删除的分块数量
+        """
+        try:
+            file_filter = Filter(must=[
+                FieldCondition(key='file_path', match=MatchValue(value=file_path)),
+            ])
+            count = self.client.count(
+                collection_name=self.collection_name,
+                count_filter=file_filter,
+                exact=True,
+            ).count
+            if count:
+                self.client.delete(
                     collection_name=self.collection_name,
-                    search_request=SearchRequest(
-                        vector=query_vector,
-                        limit=top_k,
-                        with_payload=True,
-                        with_vectors=False,
-                    )
+                    points_selector=FilterSelector(filter=file_filter),
                 )
+            print(f"Deleted {count} points of {file_path} from collection")
+            return count
+        except Exception as e:
+            print(f"Error deleting points: {e}")
+            return 0
+
+    def search(self, query_vector: List[float], top_k: int = 5, filter: Optional[Dict[str, Any]] = None):
+        """搜索相似向量
+
+        Args:
+            query_vector: 查询向量
+            top_k: 返回结果数量
+            filter: 过滤条件，见 build_filter，随查询下推到 Qdrant
+        """
+        try:
+            response = self.client.query_points(
+                collection_name=self.collection_name,
+                query=[float(x) for x in query_vector],
+                query_filter=build_filter(filter),
+                search_params=self._search_params(),
+                limit=top_k,
+                with_payload=True,
+                with_vectors=False,
+            )
+            return self._format_results(response.points)
+        except Exception as e:
+            print(f"Error searching: {e}")
+            return []
+
+    @property
+    def async_client(self) -> AsyncQdrantClient:
+        if self._async_client is None:
+            self._async_client = get_async_qdrant_client()
+        return self._async_client
 
-            search_results = []
-            for i, result in enumerate(results):
-                # 处理不同版本的响应格式
-                if hasattr(result, 'payload'):
-                    # 新版本格式
-                    search_results.append({
-                        'file_path': result.payload.get('file_path'),
-                        'start_line': result.payload.get('start_line'),
-                        'end_line': result.payload.get('end_line'),
-                        'content': result.payload.get('content'),
-                        'score': result.score,
-                        'rank': i + 1,
-                    })
-                else:
-                    # 旧版本格式
-                    search_results.append({
-                        'file_path': result.get('payload', {}).get('file_path'),
-                        'start_line': result.get('payload', {}).get('start_line'),
-                        'end_line': result.get('payload', {}).get('end_line'),
-                        'content': result.get('payload', {}).get('content'),
-                        'score': result.get('score'),
-                        'rank': i + 1,
-                    })
-
-            return search_results
+    async def asearch(self, query_vector: List[float], top_k: int = 5, filter: Optional[Dict[str, Any]] = None):
+        """异步搜索相似向量，参数同 search"""
+        if self.local:
+            return await asyncio.to_thread(self.search, query_vector, top_k, filter)
+        try:
+            response = await self.async_client.query_points(
+                collection_name=self.collection_name,
+                query=[float(x) for x in query_vector],
+                query_filter=build_filter(filter),
+                search_params=self._search_params(),
+                limit=top_k,
+                with_payload=True,
+                with_vectors=False,
+            )
+            return self._format_results(response.points)
         except Exception as e:
             print(f"Error searching: {e}")
             return []
 
+    @staticmethod
+    def _format_results(results) -> List[Dict[str, Any]]:
+        """把 Qdrant 返回的点转换为统一的检索结果格式"""
+        search_results = []
+        for i, result in enumerate(results):
+            # 处理不同版本的响应格式
+            if hasattr(result, 'payload'):
+                # 新版本格式
+                search_results.append({
+                    # 旧版本写入的点 payload 中没有 chunk_id，由路径和行范围算出
+                    'chunk_id': stable_chunk_id(result.payload),
+                    'file_path': result.payload.get('file_path'),
+                    'language': result.payload.get('language'),
+                    'structure_type': result.payload.get('structure_type'),
+                    'start_line': result.payload.get('start_line'),
+                    'end_line': result.payload.get('end_line'),
+                    'content': result.payload.get('content'),
+                    'score': result.score,
+                    'rank': i + 1,
+                })
+            else:
+                # 旧版本格式
+                search_results.append({
+                    'file_path': result.get('payload', {}).get('file_path'),
+                    'start_line': result.get('payload', {}).get('start_line'),
+                    'end_line': result.get('payload', {}).get('end_line'),
+                    'content': result.get('payload', {}).get('content'),
+                    'score': result.get('score'),
+                    'rank': i + 1,
+                })
+
+        return search_results
+
+    def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """批量搜索，一次请求完成多个查询
+
+        Args:
+            query_vectors: 查询向量列表
+            top_k: 每个查询返回的结果数量
+            filter: 所有查询共用的过滤条件
+
+        Returns:
+            与输入顺序对齐的结果列表
+        """
+        if len(query_vectors) == 0:
+            return []
+        if self.local:
+            # 本地模式没有网络往返可以摊薄，query_batch_points 同样逐条检索，还多一层请求模型的转换
+            return [self.search(vector, top_k, filter) for vector in query_vectors]
+        try:
+            responses = self.client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=self._batch_requests(query_vectors, top_k, filter),
+            )
+            return [self._format_results(response.points) for response in responses]
+        except Exception as e:
+            print(f"Error batch searching: {e}")
+            return [[] for _ in query_vectors]
+
+    async def asearch_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """异步批量搜索，参数同 search_batch"""
+        if len(query_vectors) == 0:
+            return []
+        if self.local:
+            return await asyncio.to_thread(self.search_batch, query_vectors, top_k, filter)
+        try:
+            responses = await self.async_client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=self._batch_requests(query_vectors, top_k, filter),
+            )
+            return [self._format_results(response.points) for response in responses]
+        except Exception as e:
+            print(f"Error batch searching: {e}")
+            return [[] for _ in query_vectors]
+
+    @staticmethod
+    def _batch_requests(
+        query_vectors: List[List[float]],
+        top_k: int,
+        filter: Optional[Dict[str, Any]],
+    ) -> List[QueryRequest]:
+        query_filter = build_filter(filter)
+        search_params = QdrantStore._search_params()
+        return [
+            QueryRequest(
+                query=[float(x) for x in vector],
+                filter=query_filter,
+                params=search_params,
+                limit=top_k,
+                with_payload=True,
+                with_vector=False,
+            )
+            for vector in query_vectors
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取集合统计信息，以及按当前配置估算的向量内存占用"""
+        try:
+            collections = self.client.get_collections().collections
+            if not any(col.name == self.collection_name for col in collections):
+                # 集合在首次写入时才创建
+                return {
+                    'backend': 'qdrant_local' if self.local else 'qdrant',
+                    'num_vectors': 0,
+                    'dimension': self.embedding_dim,
+                }
+            info = self.client.get_collection(collection_name=self.collection_name)
+            num_vectors = info.points_count or 0
+            # 集合参数以创建时为准，从集合配置读取而不是当前 settings
+            quantized = info.config.quantization_config is not None
+            vectors_on_disk = bool(getattr(info.config.params.vectors, 'on_disk', False))
+            return {
+                'backend': 'qdrant_local' if self.local else 'qdrant',
+                'num_vectors': num_vectors,
+                'indexed_vectors': info.indexed_vectors_count,
+                'segments': info.segments_count,
+                'dimension': self.embedding_dim,
+                'quantization': 'int8' if quantized else 'none',
+                'on_disk_payload': bool(info.config.params.on_disk_payload),
+                'hnsw_m': info.config.hnsw_config.m,
+                'hnsw_ef_construct': info.config.hnsw_config.ef_construct,
+                # 常驻内存的向量：量化后为 int8，原始 float32 向量放磁盘时不计
+                'vector_ram_bytes': (
+                    (num_vectors * self.embedding_dim if quantized else 0)
+                    + (0 if vectors_on_disk else num_vectors * self.embedding_dim * 4)
+                ),
+                'last_upload': self.upload_stats,
+            }
+        except Exception as e:
+            print(f"Error getting collection stats: {e}")
+            return {}
+
+    def flush(self):
+        """写入直接提交到 Qdrant 服务端（或本地模式的存储目录），无需额外持久化
+
+        upsert() 返回前已等待最后一个子批应用完成，没有在途的写入需要等待。
+        """
+        pass
+
+    def clear_index(self):
+        """清空向量：删除集合，下次写入时按当前配置重新创建"""
+        self.delete_collection()
+
     def delete_collection(self):
         """删除集合"""
         try:
             self.client.delete_collection(collection_name=self.collection_name)
+            self._collection_ready = False
             print(f"Collection {self.collection_name} deleted successfully")
         except Exception as e:
-            print(f"Error deleting collection: {e}")
\ No newline at end of file
+            print(f"Error deleting collection: {e}")
+
+    def close(self):
+        """释放本实例对共享客户端的引用
+
+        其他实例仍在使用时客户端保持打开；最后一个实例关闭时才真正关闭，
+        本地模式下此时释放数据目录的文件锁。重复调用无效果。
+        """
+        if self.client is None:
+            return
+        release_client(self.client)
+        self.client = None
+        if self._async_client is not None:
+            release_client(self._async_client)
+            self._async_client = None
\ No newline at end of file
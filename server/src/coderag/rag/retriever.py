@@ -1,8 +1,12 @@
 from typing import List, Dict, Any, Optional
+import contextlib
 from coderag.rag.qdrant_store import QdrantStore
 from coderag.rag.faiss_store import FaissStore
+from coderag.rag.sharded_faiss_store import get_sharded_store, has_shard_layout
+from coderag.rag.async_pgvector_store import get_pgvector_store
+from coderag.rag.vector_store import VectorStore
 from coderag.rag.bm25_rerank import HybridRetriever
-from coderag.rag.fulltext_search import FullTextSearcher
+from coderag.rag.fulltext_search import FullTextSearcher, get_fulltext_searcher
 from coderag.rag.hybrid_search import HybridSearcher
 from coderag.settings import settings
 
@@ -14,7 +18,7 @@ class Retriever:
     """检索器，支持多种检索模式和重排序
     
     功能特性：
-    - 向量检索 (Qdrant / Faiss)
+    - 向量检索 (Qdrant / Faiss / pgvector)
     - 全文检索 (Whoosh)
     - 混合检索 (向量 + 全文)
     - BM25 重排序
@@ -42,8 +46,13 @@ class Retriever:
                 enable_llm_rerank = False
                 print("Warning: LLM reranking not available, skipping")
         
-        if settings.vector_store == "faiss":
+        self.store: VectorStore
+        if settings.vector_store == "faiss" and (settings.faiss_num_shards > 1 or has_shard_layout()):
+            self.store = get_sharded_store()
+        elif settings.vector_store == "faiss":
             self.store = FaissStore()
+        elif settings.vector_store == "pgvector" or settings.pgvector_enabled:
+            self.store = get_pgvector_store()
         else:
             self.store = QdrantStore()
         
@@ -59,7 +68,7 @@ class Retriever:
         
         self.fulltext_searcher: Optional[FullTextSearcher] = None
         if enable_fulltext:
-            self.fulltext_searcher = FullTextSearcher()
+            self.fulltext_searcher = get_fulltext_searcher()
         
         self.hybrid_searcher: Optional[HybridSearcher] = None
         if enable_fulltext:
@@ -74,15 +83,58 @@ class Retriever:
         """向量检索的包装函数，用于混合搜索"""
         return self.store.search(query_vector=embedding, top_k=top_k)
 
-    def retrieve(self, query: str, embedding: List[float], top_k: int = None) -> List[Dict[str, Any]]:
-        """基础向量检索"""
+    def retrieve(
+        self,
+        query: str,
+        embedding: List[float],
+        top_k: int = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """基础向量检索
+
+        Args:
+            filter: 过滤条件，如 {"path_prefix": "src/", "language": "python"}
+        """
         top_k = top_k or self.top_k
         results = self.store.search(
             query_vector=embedding,
             top_k=top_k,
+            filter=filter,
         )
         return results
 
+    async def aretrieve(
+        self,
+        query: str,
+        embedding: List[float],
+        top_k: int = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """异步向量检索，参数同 retrieve"""
+        top_k = top_k or self.top_k
+        return await self.store.asearch(query_vector=embedding, top_k=top_k, filter=filter)
+
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        embeddings: List[List[float]],
+        top_k: int = None,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """批量向量检索，多个查询合并为一次存储调用
+
+        Args:
+            queries: 查询文本列表
+            embeddings: 与查询对齐的查询向量
+            top_k: 每个查询返回的结果数量
+            filter: 所有查询共用的过滤条件
+
+        Returns:
+            与输入顺序对齐的结果列表
+        """
+        top_k = top_k or self.top_k
+        return self.store.search_batch(embeddings, top_k=top_k, filter=filter)
+
     def fulltext_search(self, query: str, top_k: int = None) -> List[Dict[str, Any]]:
         """全文检索
         
@@ -193,10 +245,7 @@ class Retriever:
         Args:
             points: 向量点列表
         """
-        if hasattr(self.store, 'add_points'):
-            self.store.add_points(points)
-        else:
-            print("Error: Store does not have add_points method")
+        self.store.upsert(points)
         
         if self.fulltext_searcher and self.enable_fulltext:
             ft_documents = []
@@ -212,6 +261,29 @@ class Retriever:
             if ft_documents:
                 self.fulltext_searcher.add_documents(ft_documents)
 
+    def fulltext_bulk_load(self):
+        """全文索引的批量导入上下文，期间的 add_points 共用一个写入器；未启用全文检索时不做任何事"""
+        if self.fulltext_searcher and self.enable_fulltext:
+            return self.fulltext_searcher.bulk_load()
+        return contextlib.nullcontext()
+
+    def flush(self):
+        """将向量存储中尚未持久化的增量写入磁盘"""
+        self.store.flush()
+
+    def delete_by_file(self, file_path: str) -> int:
+        """删除某个文件在向量索引和全文索引中的全部分块
+
+        Returns:
+            向量索引中删除的分块数量
+        """
+        deleted = self.store.delete_by_file(file_path)
+
+        if self.fulltext_searcher and self.enable_fulltext:
+            self.fulltext_searcher.delete_document(file_path)
+
+        return deleted
+
     def add_documents_to_fulltext(self, documents: List[Dict[str, Any]]) -> int:
         """添加文档到全文索引
         
@@ -228,12 +300,7 @@ class Retriever:
 
     def clear_index(self):
         """清空向量索引"""
-        if hasattr(self.store, 'clear_index'):
-            self.store.clear_index()
-        elif hasattr(self.store, 'delete_collection'):
-            self.store.delete_collection()
-        else:
-            print("Error: Store does not have clear method")
+        self.store.clear_index()
 
     def clear_fulltext_index(self):
         """清空全文索引"""
@@ -245,6 +312,10 @@ class Retriever:
         self.clear_index()
         self.clear_fulltext_index()
 
+    def get_index_stats(self) -> Dict[str, Any]:
+        """获取向量索引统计信息（向量数、维度、内存等）"""
+        return self.store.get_stats()
+
     def warmup(self):
         """预热 LLM 重排序模型"""
         if self.llm_reranker:
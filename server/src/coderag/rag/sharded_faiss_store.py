@@ -0,0 +1,513 @@
+from typing import List, Dict, Any, Optional
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import numpy as np
+from coderag.rag.faiss_store import FaissStore
+from coderag.rag.projection import PendingFitBuffer, load_projector
+from coderag.rag.vector_store import VectorStore, path_predicate, stable_chunk_id
+from coderag.settings import settings
+
+
+def _shard_worker(conn, overrides: Dict[str, Any]):
+    """分片工作进程：持有一个 FaissStore，按请求执行方法并返回结果"""
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    store = FaissStore()
+    while True:
+        try:
+            method, args, kwargs = conn.recv()
+        except EOFError:
+            break
+        if method == 'close':
+            store.flush()
+            conn.send(('ok', None))
+            break
+        try:
+            conn.send(('ok', getattr(store, method)(*args, **kwargs)))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class LocalShard:
+    """在当前进程内运行的分片（未分片的旧存储在重平衡时作为数据源）"""
+
+    def __init__(self, store: FaissStore):
+        self.store = store
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, method: str, *args, **kwargs):
+        self._result = getattr(self.store, method)(*args, **kwargs)
+
+    def recv(self):
+        return self._result
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.store.flush()
+
+
+class ProcessShard:
+    """在独立工作进程中运行的分片，通过管道收发请求
+
+    工作进程按顺序处理一条管道上的请求，一次 send 与对应的 recv 必须在持有 lock 时配对完成。
+    """
+
+    def __init__(self, overrides: Dict[str, Any]):
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_shard_worker, args=(child_conn, overrides), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, method: str, *args, **kwargs):
+        if self.closed:
+            raise RuntimeError("FAISS shard is closed")
+        self.conn.send((method, args, kwargs))
+
+    def recv(self):
+        status, result = self.conn.recv()
+        if status == 'error':
+            raise RuntimeError(result)
+        return result
+
+    def close(self):
+        # 等待进行中的请求完成，之后的请求直接报错
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if not self.process.is_alive():
+                return
+            try:
+                self.conn.send(('close', (), {}))
+                self.recv()
+            except (EOFError, BrokenPipeError, OSError):
+                pass
+        self.process.join(timeout=30)
+
+
+class ShardedFaissStore(VectorStore):
+    """多进程分片的 FAISS 向量存储
+
+    - 向量按 chunk_id 取模路由到 N 个分片，每个分片是运行在本地工作进程中的 FaissStore
+    - 检索时并行下发到所有分片，再按分数合并各分片的 top-k
+    - 归一化与降维投影在协调进程中完成，各分片存储同一空间中的向量，分数可以直接比较
+    - 分片布局记录在 {faiss_index_path}.shards.json，重平衡生成新一代分片后原子切换
+
+    每个分片的管道有自己的锁，并发查询在各分片上交错执行；
+    _lock 只用于串行化写入和分片布局的变更（重平衡、关闭）。
+    """
+
+    def __init__(self, num_shards: Optional[int] = None):
+        """初始化分片存储
+
+        Args:
+            num_shards: 分片数，None 时使用配置值；已有分片布局且非空时以布局文件为准
+        """
+        self.base_path = settings.faiss_index_path
+        self.metadata_base = settings.faiss_metadata_path
+        if self.metadata_base.endswith('.pkl'):
+            self.metadata_base = self.metadata_base[:-len('.pkl')]
+        self.layout_path = self.base_path + '.shards.json'
+        self.embedding_dim = settings.embedding_dim
+        self.projection_path = settings.projection_path
+        self.projector = load_projector(
+            self.projection_path,
+            settings.projection_method,
+            self.embedding_dim,
+            settings.projection_dim,
+        )
+        # PCA 拟合前入库的向量点
+        self.pending_fit = PendingFitBuffer(self.projection_path + '.pending')
+        self._lock = threading.Lock()
+
+        layout = self._read_layout()
+        requested = num_shards or settings.faiss_num_shards
+        if layout is None:
+            layout = {'num_shards': requested, 'generation': 0}
+            self._write_layout(layout)
+        self.layout = layout
+        self.shards = self._start_shards(layout)
+
+        if self._has_legacy_store():
+            # 首次启用分片，迁移未分片的存储
+            self.rebalance(requested)
+        elif layout['num_shards'] != requested and self.get_index_size() == 0:
+            # 空存储直接采用新的分片数
+            self.rebalance(requested)
+        elif layout['num_shards'] != requested:
+            print(
+                f"FAISS store has {layout['num_shards']} shards but {requested} requested, "
+                f"run 'coderag rebalance-shards --shards {requested}' to reshard"
+            )
+        print(f"Sharded FAISS store ready with {self.num_shards} shards")
+
+    @property
+    def num_shards(self) -> int:
+        return self.layout['num_shards']
+
+    def _read_layout(self) -> Optional[Dict[str, int]]:
+        if not os.path.exists(self.layout_path):
+            return None
+        with open(self.layout_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_layout(self, layout: Dict[str, int]):
+        os.makedirs(os.path.dirname(self.layout_path) or ".", exist_ok=True)
+        tmp_path = self.layout_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(layout, f)
+        os.replace(tmp_path, self.layout_path)
+
+    def _has_legacy_store(self) -> bool:
+        """是否存在未分片的 FaissStore 数据"""
+        return os.path.exists(self.base_path) or os.path.exists(self.base_path + '.wal')
+
+    def _shard_paths(self, generation: int, shard: int) -> Dict[str, str]:
+        suffix = f".g{generation}.shard{shard}"
+        return {
+            'faiss_index_path': self.base_path + suffix,
+            'faiss_metadata_path': self.metadata_base + suffix,
+        }
+
+    def _shard_overrides(self, generation: int, shard: int) -> Dict[str, Any]:
+        """分片进程的配置
+
+        工作进程以 spawn 启动，只会从环境变量重新读取配置，因此传入协调进程中生效的全部配置
+        （包括代码中修改过的索引类型、二值预筛选、增量层与合并阈值等），再换成分片独立的文件路径；
+        向量已在协调进程中投影，分片内不再降维。
+        """
+        overrides = settings.model_dump()
+        paths = self._shard_paths(generation, shard)
+        overrides.update(paths)
+        overrides.update({
+            'embedding_dim': self.projector.output_dim,
+            'projection_method': 'none',
+            'projection_dim': 0,
+            'projection_path': paths['faiss_index_path'] + '.projection.npz',
+        })
+        return overrides
+
+    def _start_shards(self, layout: Dict[str, int]) -> List[ProcessShard]:
+        return [
+            ProcessShard(self._shard_overrides(layout['generation'], shard))
+            for shard in range(layout['num_shards'])
+        ]
+
+    @staticmethod
+    def _scatter(shards: List[Any], requests: List[tuple]) -> List[Any]:
+        """向各分片并行下发 (method, args, kwargs) 请求，按分片顺序返回结果
+
+        按分片顺序依次加锁并发送，收到某个分片的结果后立即释放它的锁，
+        并发的查询因此可以在不同分片上流水执行，而不是整体串行。
+        已发出的请求即使出错也会收回响应，保证管道上的请求与响应不会错位。
+        """
+        sent = []
+        error = None
+        for shard, (method, args, kwargs) in zip(shards, requests):
+            shard.lock.acquire()
+            try:
+                shard.send(method, *args, **kwargs)
+            except Exception as e:
+                shard.lock.release()
+                error = e
+                break
+            sent.append(shard)
+        results = []
+        for shard in sent:
+            try:
+                results.append(shard.recv())
+            except Exception as e:
+                error = error or e
+            finally:
+                shard.lock.release()
+        if error is not None:
+            raise error
+        return results
+
+    def _fan_out(self, shards: List[Any], method: str, *args, **kwargs) -> List[Any]:
+        """并行下发同一请求到所有分片，按分片顺序返回结果"""
+        return self._scatter(shards, [(method, args, kwargs)] * len(shards))
+
+    def _prepare_vectors(self, vectors: List[List[float]]) -> np.ndarray:
+        """归一化并投影向量，与 FaissStore 一致"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.projector.enabled:
+            return self.projector.transform(vectors)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+    def _route(self, points: List[Dict[str, Any]], vectors: np.ndarray, num_shards: int) -> List[List[Dict[str, Any]]]:
+        """按 chunk_id 取模把向量点分配到各分片"""
+        batches: List[List[Dict[str, Any]]] = [[] for _ in range(num_shards)]
+        for point, vector in zip(points, vectors):
+            chunk_id = stable_chunk_id(point)
+            batches[chunk_id % num_shards].append(dict(point, chunk_id=chunk_id, embedding=vector))
+        return batches
+
+    def _fit_projection(self):
+        """用暂存的向量点拟合 PCA 投影"""
+        self.projector.fit(
+            np.asarray([p['embedding'] for p in self.pending_fit.points], dtype=np.float32),
+            max_samples=settings.projection_fit_samples,
+        )
+        self.projector.save(self.projection_path)
+
+    def upsert(self, points: List[Dict[str, Any]]):
+        """按 chunk_id 路由并写入各分片
+
+        PCA 投影尚未拟合时，向量点先暂存，累计到 projection_fit_samples 个后拟合并一起写入；
+        暂存期间的检索在原始维度上对暂存的向量点精确检索，flush() 时样本数够 output_dim 即提前拟合。
+        分片写入失败时抛出异常。
+        """
+        if not points:
+            return
+        if self.projector.needs_fit:
+            self.pending_fit.append(points)
+            needed = max(settings.projection_fit_samples, self.projector.output_dim)
+            if len(self.pending_fit) < needed:
+                print(f"Buffered {len(points)} points for PCA fitting ({len(self.pending_fit)}/{needed})")
+                return
+            self._fit_projection()
+            points = []
+        self._upsert_projected(points)
+
+    def _upsert_projected(self, points: List[Dict[str, Any]]):
+        """投影后写入各分片；暂存的向量点（包括上次写入中途退出留下的）一起写入后清空"""
+        if len(self.pending_fit):
+            points = self.pending_fit.points + list(points)
+        if not points:
+            return
+        vectors = self._prepare_vectors([p['embedding'] for p in points])
+        batches = self._route(points, vectors, self.num_shards)
+        with self._lock:
+            self._scatter(self.shards, [('upsert', (batch,), {}) for batch in batches])
+        if len(self.pending_fit):
+            self.pending_fit.clear()
+        print(f"Upserted {len(points)} points to {self.num_shards} FAISS shards")
+
+    def delete_by_file(self, file_path: str) -> int:
+        """删除某个文件在所有分片中的分块"""
+        try:
+            with self._lock:
+                # 还在等待 PCA 拟合的向量点一并删除，否则拟合后会重新入库
+                removed = self.pending_fit.remove_file(file_path)
+                return removed + sum(self._fan_out(self.shards, 'delete_by_file', file_path))
+        except Exception as e:
+            print(f"Error deleting points from sharded FAISS store: {e}")
+            return 0
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ):
+        """搜索相似向量"""
+        results = self.search_batch([query_vector], top_k=top_k, filter=filter, **kwargs)
+        return results[0] if results else []
+
+    def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ) -> List[List[Dict[str, Any]]]:
+        """批量搜索：并行下发到所有分片（过滤条件由各分片执行），再合并各分片的 top-k"""
+        if len(query_vectors) == 0:
+            return []
+        # 先在协调进程中校验过滤键，不支持时直接报错
+        predicate = path_predicate(filter)
+        try:
+            if self.projector.needs_fit:
+                # PCA 拟合前入库的向量点都暂存在协调进程中，在原始维度上精确检索
+                return self.pending_fit.search(query_vectors, top_k, predicate)
+            queries = self._prepare_vectors(query_vectors)
+            # 查询只持有各分片管道的锁；重平衡在查询途中关闭了旧分片时，换用新分片重试一次
+            shards = self.shards
+            try:
+                shard_results = self._fan_out(
+                    shards, 'search_batch', queries, top_k=top_k, filter=filter, **kwargs
+                )
+            except RuntimeError:
+                if shards is self.shards or not any(shard.closed for shard in shards):
+                    raise
+                shard_results = self._fan_out(
+                    self.shards, 'search_batch', queries, top_k=top_k, filter=filter, **kwargs
+                )
+            merged = []
+            for i in range(len(queries)):
+                candidates = [doc for results in shard_results for doc in results[i]]
+                candidates.sort(key=lambda doc: doc['score'], reverse=True)
+                top = candidates[:top_k]
+                for rank, doc in enumerate(top):
+                    doc['rank'] = rank + 1
+                merged.append(top)
+            return merged
+        except Exception as e:
+            print(f"Error searching sharded FAISS store: {e}")
+            return [[] for _ in range(len(query_vectors))]
+
+    def flush(self):
+        """所有分片写检查点；暂存的向量点只要样本数够拟合 PCA 就立即拟合并入库"""
+        if self.projector.needs_fit and len(self.pending_fit):
+            if len(self.pending_fit) >= self.projector.output_dim:
+                self._fit_projection()
+                self._upsert_projected([])
+            else:
+                print(
+                    f"{len(self.pending_fit)} points are waiting for the PCA projection, "
+                    f"which needs at least {self.projector.output_dim} samples"
+                )
+        elif len(self.pending_fit):
+            self._upsert_projected([])
+        with self._lock:
+            self._fan_out(self.shards, 'flush')
+
+    def compact(self):
+        """所有分片压缩墓碑"""
+        with self._lock:
+            self._fan_out(self.shards, 'compact')
+
+    def rebalance(self, num_shards: int, batch_size: int = 10000):
+        """把数据重新分布到 num_shards 个分片
+
+        新一代分片与旧分片并存，数据全部写入并落盘后才切换布局文件，中途失败不影响旧数据。
+        首次分片时，未分片的 FaissStore 作为数据源。
+
+        Args:
+            num_shards: 新的分片数
+            batch_size: 每批从旧分片导出的分块数
+        """
+        with self._lock:
+            generation = self.layout['generation'] + 1
+            sources = self.shards
+            legacy = None
+            if self._has_legacy_store():
+                # 未分片的旧存储
+                legacy = LocalShard(FaissStore())
+                sources = sources + [legacy]
+
+            targets = [
+                ProcessShard(self._shard_overrides(generation, shard))
+                for shard in range(num_shards)
+            ]
+            moved = 0
+            for source in sources:
+                start = 0
+                while start is not None:
+                    exported = self._fan_out([source], 'export_live', start, batch_size)[0]
+                    batches = self._route(exported['records'], exported['vectors'], num_shards)
+                    self._scatter(targets, [('upsert', (batch,), {}) for batch in batches])
+                    moved += len(exported['records'])
+                    start = exported['next']
+            self._fan_out(targets, 'flush')
+
+            old_layout = self.layout
+            self.layout = {'num_shards': num_shards, 'generation': generation}
+            self._write_layout(self.layout)
+            for shard in self.shards:
+                shard.close()
+            self.shards = targets
+            self._remove_generation(old_layout)
+            if legacy is not None:
+                self._remove_legacy(legacy.store)
+            print(f"Rebalanced {moved} chunks into {num_shards} FAISS shards")
+
+    def _remove_generation(self, layout: Dict[str, int]):
+        """删除旧一代分片的文件"""
+        for shard in range(layout['num_shards']):
+            paths = self._shard_paths(layout['generation'], shard)
+            self._remove_store_files(paths['faiss_index_path'], paths['faiss_metadata_path'])
+
+    def _remove_legacy(self, store: FaissStore):
+        """删除已迁移到分片中的未分片存储"""
+        store.metadata.close()
+        self._remove_store_files(store.index_path, store.metadata_path)
+
+    @staticmethod
+    def _remove_store_files(index_path: str, metadata_path: str):
+        for suffix in ('', '.wal', '.delta', '.bin', '.lock', '.projection.npz'):
+            if os.path.exists(index_path + suffix):
+                os.remove(index_path + suffix)
+        if os.path.isdir(metadata_path):
+            shutil.rmtree(metadata_path)
+
+    def clear_index(self):
+        """清空所有分片"""
+        with self._lock:
+            self._fan_out(self.shards, 'clear_index')
+        self.pending_fit.clear()
+        if self.projector.method == "pca":
+            if os.path.exists(self.projection_path):
+                os.remove(self.projection_path)
+            self.projector = load_projector(
+                self.projection_path,
+                self.projector.method,
+                self.embedding_dim,
+                self.projector.output_dim,
+            )
+
+    def get_index_size(self) -> int:
+        with self._lock:
+            return sum(self._fan_out(self.shards, 'get_index_size'))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """汇总各分片的统计信息"""
+        with self._lock:
+            shard_stats = self._fan_out(self.shards, 'get_stats')
+        summed = ('num_vectors', 'vector_bytes', 'live_chunks', 'num_tombstones',
+                  'metadata_bytes', 'pending_rows', 'wal_bytes', 'delta_vectors')
+        stats = {key: sum(s.get(key, 0) for s in shard_stats) for key in summed}
+        stats.update({
+            'backend': 'faiss-sharded',
+            'num_shards': self.num_shards,
+            'index_factory': shard_stats[0]['index_factory'] if shard_stats else None,
+            'embedding_dim': self.embedding_dim,
+            'index_dim': self.projector.output_dim,
+            'projection': self.projector.get_stats(),
+            'pending_fit_points': len(self.pending_fit),
+            'memory_saved_bytes': self.projector.memory_saved_bytes(stats['num_vectors']),
+            'shards': shard_stats,
+        })
+        return stats
+
+    def close(self):
+        """关闭所有分片进程（关闭前写检查点）"""
+        with self._lock:
+            for shard in self.shards:
+                shard.close()
+            self.shards = []
+
+
+def has_shard_layout() -> bool:
+    """当前配置的索引路径下是否已有分片布局"""
+    return os.path.exists(settings.faiss_index_path + '.shards.json')
+
+
+_shared_store: Optional[ShardedFaissStore] = None
+_shared_store_lock = threading.Lock()
+
+
+def get_sharded_store() -> ShardedFaissStore:
+    """获取进程内共享的分片存储，避免每个检索器实例重复启动分片进程
+
+    并发请求同时初始化时只会启动一组分片进程。
+    """
+    global _shared_store
+    if _shared_store is None:
+        with _shared_store_lock:
+            if _shared_store is None:
+                _shared_store = ShardedFaissStore()
+    return _shared_store
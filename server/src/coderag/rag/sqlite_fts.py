@@ -0,0 +1,587 @@
+from typing import List, Dict, Any, Optional, Tuple
+from contextlib import contextmanager
+import os
+import re
+import sqlite3
+import threading
+import time
+from coderag.rag.prefix_index import TermPrefixIndex
+from coderag.rag.vector_store import LANGUAGE_BY_EXTENSION
+from coderag.settings import settings
+
+
+# unicode61 默认把下划线当作分隔符，代码里的 snake_case 标识符需要保持完整
+CODE_TOKENIZER = "unicode61 remove_diacritics 2 tokenchars '_'"
+
+# FTS5 列，顺序与 bm25() 权重参数一致
+FTS_COLUMNS = ("content", "subwords", "file_path")
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# 数字单独成段（getUser2 -> get User 2），避免数字粘在子词上导致 "user" 查不到
+_CAMEL_PART = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+_QUERY_TOKEN = re.compile(r'"([^"]*)"|(\S+)')
+_WORD = re.compile(r"\w+")
+_OPERATORS = ("AND", "OR", "NOT")
+
+
+def code_subwords(text: str) -> str:
+    """把复合标识符（snake_case / camelCase）拆成小写子词，如 getUserName -> get user name
+
+    子词写入单独的 subwords 列，查询 "user" 时也能命中 get_user_name 和 getUserName；
+    只由一个词组成的标识符已经在 content 列中，不重复收录；数字部分（如 name_12、getUser2 中的数字）不收录。
+    """
+    parts = []
+    for identifier in dict.fromkeys(_IDENTIFIER.findall(text)):
+        pieces = [
+            p.lower() for chunk in identifier.split("_") for p in _CAMEL_PART.findall(chunk)
+            if not p.isdigit()
+        ]
+        if len(pieces) > 1:
+            parts.extend(pieces)
+    return " ".join(parts)
+
+
+def to_fts_query(query_str: str) -> str:
+    """把用户查询转换为安全的 FTS5 表达式
+
+    - 普通词按 AND 连接，每个词加引号，避免被当作 FTS5 语法
+    - "..." 为短语，词尾 * 为前缀匹配
+    - AND / OR / NOT 原样保留，位置不合法的运算符被丢弃
+    - 含 . 等分隔符的词（如 os.path）转为短语
+    """
+    items: List[str] = []
+    for phrase, word in _QUERY_TOKEN.findall(query_str):
+        if phrase:
+            words = _WORD.findall(phrase)
+            if words:
+                items.append('"' + " ".join(words) + '"')
+        elif word in _OPERATORS:
+            items.append(word)
+        else:
+            words = _WORD.findall(word)
+            if words:
+                items.append('"' + " ".join(words) + '"' + ("*" if word.endswith("*") else ""))
+
+    # 运算符两侧都必须是词项
+    cleaned: List[str] = []
+    for i, item in enumerate(items):
+        if item in _OPERATORS:
+            if not cleaned or cleaned[-1] in _OPERATORS:
+                continue
+            if i + 1 >= len(items) or items[i + 1] in _OPERATORS:
+                continue
+        cleaned.append(item)
+    return " ".join(cleaned)
+
+
+SCHEMA_SQL = f"""
+CREATE TABLE IF NOT EXISTS documents (
+    pk INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    file_path TEXT NOT NULL DEFAULT '',
+    start_line INTEGER,
+    end_line INTEGER,
+    content TEXT NOT NULL DEFAULT '',
+    subwords TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_documents_id ON documents(id);
+CREATE INDEX IF NOT EXISTS idx_documents_path ON documents(file_path);
+CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(
+    {", ".join(FTS_COLUMNS)},
+    content='documents',
+    content_rowid='pk',
+    tokenize="{CODE_TOKENIZER}",
+    prefix='2 3'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS fts_vocab USING fts5vocab(fts, 'col');
+"""
+
+TRIGGERS_SQL = f"""
+CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+    INSERT INTO fts(rowid, {", ".join(FTS_COLUMNS)})
+    VALUES (new.pk, {", ".join("new." + c for c in FTS_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+    INSERT INTO fts(fts, rowid, {", ".join(FTS_COLUMNS)})
+    VALUES ('delete', old.pk, {", ".join("old." + c for c in FTS_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN
+    INSERT INTO fts(fts, rowid, {", ".join(FTS_COLUMNS)})
+    VALUES ('delete', old.pk, {", ".join("old." + c for c in FTS_COLUMNS)});
+    INSERT INTO fts(rowid, {", ".join(FTS_COLUMNS)})
+    VALUES (new.pk, {", ".join("new." + c for c in FTS_COLUMNS)});
+END;
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS documents_ai;
+DROP TRIGGER IF EXISTS documents_ad;
+DROP TRIGGER IF EXISTS documents_au;
+"""
+
+
+def _split_sql(script: str) -> List[str]:
+    """按完整语句拆分脚本（触发器体内含分号）"""
+    statements, current = [], ""
+    for line in script.strip().splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    return statements
+
+
+class SQLiteFullTextSearcher:
+    """基于 SQLite FTS5 的全文搜索引擎，接口与 FullTextSearcher 一致（settings.fulltext_backend = "sqlite"）
+
+    - documents 表保存 id、路径、行号和内容，fts 为其外部内容 FTS5 索引，由触发器同步
+    - 分词保留下划线，另有 subwords 列收录复合标识符拆出的子词
+    - 按 bm25 排序，可通过 boost 调整 content / file_path 列的权重
+    - 过滤条件走 documents 表上的 B-tree 索引：id、file_path、path_prefix、language、line
+
+    每个线程一个连接，WAL 模式下读不阻塞写；写入串行执行。
+    """
+
+    def __init__(
+        self,
+        db_path: str = "data/fulltext.sqlite",
+        commit_batch_size: Optional[int] = None,
+    ):
+        """初始化全文搜索引擎
+
+        Args:
+            db_path: SQLite 数据库文件
+            commit_batch_size: bulk_load 期间每多少文档提交一次，None 时使用配置值
+        """
+        self.db_path = db_path
+        self.commit_batch_size = commit_batch_size or settings.fulltext_commit_batch
+        self.lock_timeout = settings.fulltext_lock_timeout
+        self.refresh_interval = settings.fulltext_refresh_interval
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._bulk_thread: Optional[int] = None
+        self._bulk_pending = 0
+        self._merge_thread: Optional[threading.Thread] = None
+        # 本实例每次提交后递增；其他连接的提交通过 PRAGMA data_version 发现
+        self._write_version = 0
+        self._external_version = 0
+        self._prefix_indexes: Dict[str, Tuple[Tuple[int, int], TermPrefixIndex]] = {}
+        self._prefix_lock = threading.Lock()
+        self.ingest_stats: Dict[str, Any] = {}
+        self._init_db()
+
+    def _init_db(self):
+        """创建表、FTS5 索引和同步触发器"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(SCHEMA_SQL + TRIGGERS_SQL)
+
+    def _conn(self) -> sqlite3.Connection:
+        """当前线程的连接（autocommit，事务显式开启）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=self.lock_timeout)
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+            self._local.data_version = None
+            self._local.checked_at = 0.0
+        return conn
+
+    @staticmethod
+    def _document_row(doc: Dict[str, Any], default_id: str) -> Tuple[Any, ...]:
+        content = doc.get('content', '')
+        return (
+            doc.get('id', doc.get('file_path', default_id)),
+            doc.get('file_path', ''),
+            doc.get('start_line', 0),
+            doc.get('end_line', 0),
+            content,
+            code_subwords(content),
+        )
+
+    @contextmanager
+    def _transaction(self):
+        """写事务；bulk_load 期间在批量导入线程上直接复用已开启的事务"""
+        with self._write_lock:
+            conn = self._conn()
+            if self._bulk_thread == threading.get_ident():
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self._write_version += 1
+
+    _INSERT_SQL = (
+        "INSERT INTO documents (id, file_path, start_line, end_line, content, subwords) "
+        "VALUES (?, ?, ?, ?, ?, ?)"
+    )
+
+    def add_documents(self, documents: List[Dict[str, Any]]) -> int:
+        """批量添加文档到索引
+
+        Args:
+            documents: 文档列表，每项需包含 'id' 和 'content' 字段
+
+        Returns:
+            添加的文档数量
+        """
+        if not documents:
+            return 0
+
+        start = time.time()
+        rows = [self._document_row(doc, f"doc_{i}") for i, doc in enumerate(documents)]
+        with self._transaction() as conn:
+            conn.executemany(self._INSERT_SQL, rows)
+            if self._bulk_thread == threading.get_ident():
+                self._bulk_pending += len(rows)
+                if self._bulk_pending >= self.commit_batch_size:
+                    conn.execute("COMMIT")
+                    conn.execute("BEGIN IMMEDIATE")
+                    self._write_version += 1
+                    self._bulk_pending = 0
+                    self.ingest_stats['commits'] = self.ingest_stats.get('commits', 0) + 1
+            else:
+                self.ingest_stats['commits'] = self.ingest_stats.get('commits', 0) + 1
+
+        stats = self.ingest_stats
+        stats['documents'] = stats.get('documents', 0) + len(rows)
+        stats['seconds'] = stats.get('seconds', 0.0) + time.time() - start
+        stats['docs_per_second'] = stats['documents'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        return len(rows)
+
+    def update_document(self, doc_id: str, document: Dict[str, Any]) -> bool:
+        """更新单个文档（替换同 id 的全部文档）"""
+        try:
+            row = self._document_row(document, doc_id)
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM documents WHERE id = ?", [doc_id])
+                conn.execute(self._INSERT_SQL, (doc_id,) + row[1:])
+            return True
+        except Exception as e:
+            print(f"Failed to update document: {e}")
+            return False
+
+    def delete_document(self, doc_id: str) -> bool:
+        """删除文档"""
+        try:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM documents WHERE id = ?", [doc_id])
+            return True
+        except Exception:
+            return False
+
+    @contextmanager
+    def bulk_load(self, optimize: bool = True):
+        """批量导入模式
+
+        当前线程的写入共用一个事务，每 commit_batch_size 个文档提交一次；
+        退出时提交剩余文档，optimize=True 时在后台合并 FTS5 段。
+        发生异常时最后一批未提交的文档被回滚。
+        """
+        if self._bulk_thread is not None:
+            yield self
+            return
+
+        self.wait_for_merge()
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            self._bulk_thread = threading.get_ident()
+            self._bulk_pending = 0
+        start = time.time()
+        documents_before = self.ingest_stats.get('documents', 0)
+        try:
+            yield self
+        except Exception:
+            with self._write_lock:
+                conn.execute("ROLLBACK")
+                self._bulk_thread = None
+            raise
+
+        with self._write_lock:
+            conn.execute("COMMIT")
+            self._bulk_thread = None
+            self._write_version += 1
+        self.ingest_stats['commits'] = self.ingest_stats.get('commits', 0) + 1
+        print(
+            f"Bulk loaded {self.ingest_stats.get('documents', 0) - documents_before} documents "
+            f"into SQLite FTS5 index in {time.time() - start:.2f}s"
+        )
+        if optimize:
+            self.optimize(background=True)
+
+    def merge(self, background: bool = False):
+        """增量合并 FTS5 段"""
+        self._start_merge("INSERT INTO fts(fts, rank) VALUES('merge', 500)", background)
+
+    def optimize(self, background: bool = False):
+        """把 FTS5 索引的所有段合并为一个"""
+        self._start_merge("INSERT INTO fts(fts) VALUES('optimize')", background)
+
+    def _start_merge(self, statement: str, background: bool):
+        if not background:
+            self._merge(statement)
+            return
+        with self._write_lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            self._merge_thread = threading.Thread(
+                target=self._merge,
+                args=(statement,),
+                name="fts5-merge",
+                daemon=True,
+            )
+            self._merge_thread.start()
+
+    def _merge(self, statement: str):
+        try:
+            start = time.time()
+            with self._transaction() as conn:
+                conn.execute(statement)
+            # 合并后的段写在 WAL 中，回写到主库并截断 WAL
+            self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            print(f"Merged SQLite FTS5 segments in {time.time() - start:.2f}s")
+        except Exception as e:
+            print(f"Error merging SQLite FTS5 segments: {e}")
+
+    def wait_for_merge(self):
+        """等待后台合并完成"""
+        thread = self._merge_thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join()
+
+    def _match_expression(self, query_str: str, fields: Optional[List[str]]) -> str:
+        expr = to_fts_query(query_str)
+        if not expr:
+            return ""
+        columns = []
+        for field in fields or ["content"]:
+            if field == "content":
+                columns.extend(["content", "subwords"])
+            elif field == "file_path":
+                columns.append("file_path")
+            else:
+                raise ValueError(f"Field '{field}' is not searchable in the SQLite FTS5 index")
+        return "{" + " ".join(columns) + "} : (" + expr + ")"
+
+    @staticmethod
+    def _bm25_weights(boost: Optional[Dict[str, float]]) -> List[float]:
+        """bm25() 各列权重；子词列的权重为 content 的一半，完整标识符命中排在前面"""
+        boost = boost or {}
+        content = float(boost.get("content", 1.0))
+        return [content, content * 0.5, float(boost.get("file_path", 1.0))]
+
+    @staticmethod
+    def _filter_sql(filters: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        """过滤条件转换为 documents 表上的 WHERE 子句，值为列表时匹配其中任意一个"""
+        clauses: List[str] = []
+        params: List[Any] = []
+        for key, value in (filters or {}).items():
+            if value is None:
+                continue
+            values = list(value) if isinstance(value, (list, tuple)) else [value]
+            if key in ("id", "file_path"):
+                clauses.append(f"d.{key} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            elif key == "path_prefix":
+                # 范围条件可以走 file_path 索引；'0' 是 '/' 的下一个字符
+                ranges = []
+                for prefix in values:
+                    prefix = prefix.replace("\\", "/").strip("/")
+                    ranges.append("(d.file_path >= ? AND d.file_path < ?)")
+                    params.extend([prefix + "/", prefix + "0"])
+                clauses.append("(" + " OR ".join(ranges) + ")")
+            elif key == "language":
+                extensions = [ext for ext, lang in LANGUAGE_BY_EXTENSION.items() if lang in values]
+                if not extensions:
+                    clauses.append("0")
+                    continue
+                clauses.append("(" + " OR ".join("d.file_path LIKE ?" for _ in extensions) + ")")
+                params.extend(f"%{ext}" for ext in extensions)
+            elif key == "line":
+                clauses.append("(" + " OR ".join("(d.start_line <= ? AND d.end_line >= ?)" for _ in values) + ")")
+                for line in values:
+                    params.extend([int(line), int(line)])
+            else:
+                raise ValueError(f"Filter on '{key}' is not supported by the SQLite FTS5 index")
+        return "".join(" AND " + clause for clause in clauses), params
+
+    def _query(
+        self,
+        query_str: str,
+        limit: int,
+        fields: Optional[List[str]] = None,
+        boost: Optional[Dict[str, float]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        if not query_str:
+            return []
+        match = self._match_expression(query_str, fields)
+        if not match:
+            return []
+        where, filter_params = self._filter_sql(filters)
+        weights = self._bm25_weights(boost)
+        sql = f"""
+            SELECT d.id, d.content, d.file_path, d.start_line, d.end_line,
+                   bm25(fts, ?, ?, ?) AS rank
+            FROM fts JOIN documents d ON d.pk = fts.rowid
+            WHERE fts MATCH ?{where}
+            ORDER BY rank
+            LIMIT ?
+        """
+        try:
+            rows = self._conn().execute(sql, weights + [match] + filter_params + [limit]).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"Error searching SQLite FTS5 index: {e}")
+            return []
+        return [
+            {
+                "id": row[0],
+                "content": row[1],
+                "file_path": row[2],
+                "start_line": row[3] or 0,
+                "end_line": row[4] or 0,
+                # bm25() 越小越相关，取负数与 Whoosh 分数方向一致
+                "score": -row[5],
+            }
+            for row in rows
+        ]
+
+    def search(
+        self,
+        query_str: str,
+        limit: int = 10,
+        fields: Optional[List[str]] = None,
+        boost: Optional[Dict[str, float]] = None
+    ) -> List[Dict[str, Any]]:
+        """搜索文档
+
+        Args:
+            query_str: 查询字符串
+            limit: 返回结果数量
+            fields: 搜索字段列表（content / file_path），None 时默认搜索 content
+            boost: 字段权重配置
+
+        Returns:
+            搜索结果列表
+        """
+        return self._query(query_str, limit, fields=fields, boost=boost)
+
+    def search_by_filter(
+        self,
+        query_str: str,
+        filters: Dict[str, Any],
+        limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """带过滤条件的搜索
+
+        Args:
+            query_str: 查询字符串
+            filters: 过滤条件，支持 id、file_path、path_prefix、language、line
+            limit: 返回结果数量
+
+        Returns:
+            搜索结果列表
+        """
+        return self._query(query_str, limit, filters=filters)
+
+    def _index_version(self) -> Tuple[int, int]:
+        """(本实例写入版本, 外部写入版本)；其他连接的提交最多 refresh_interval 秒后被发现"""
+        conn = self._conn()
+        now = time.monotonic()
+        if now - self._local.checked_at >= self.refresh_interval:
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._local.data_version is not None and data_version != self._local.data_version:
+                self._external_version += 1
+            self._local.data_version = data_version
+            self._local.checked_at = now
+        return self._write_version, self._external_version
+
+    def suggest(
+        self,
+        prefix: str,
+        field: str = "content",
+        limit: int = 5,
+        with_counts: bool = False,
+    ) -> List[Any]:
+        """获取搜索建议（自动补全），从 FTS5 词典中按文档频率取以 prefix 开头的词项"""
+        if not prefix:
+            return []
+        if field not in ("content", "file_path"):
+            raise ValueError(f"Field '{field}' does not support suggestions")
+
+        version = self._index_version()
+        cached = self._prefix_indexes.get(field)
+        if cached is None or cached[0] != version:
+            with self._prefix_lock:
+                cached = self._prefix_indexes.get(field)
+                if cached is None or cached[0] != version:
+                    rows = self._conn().execute(
+                        "SELECT term, doc FROM fts_vocab WHERE col = ? ORDER BY term", [field]
+                    ).fetchall()
+                    prefix_index = TermPrefixIndex([r[0] for r in rows], [r[1] for r in rows])
+                    cached = (version, prefix_index)
+                    self._prefix_indexes[field] = cached
+
+        completions = cached[1].complete(prefix.lower(), limit)
+        if with_counts:
+            return [{"term": term, "doc_frequency": freq} for term, freq in completions]
+        return [term for term, _ in completions]
+
+    def clear_index(self):
+        """清空索引"""
+        self.wait_for_merge()
+        with self._transaction() as conn:
+            # 逐行删除会让触发器逐条回写 FTS5，直接清空两张表更快；
+            # executescript 会先提交当前事务，这里逐条执行
+            for statement in _split_sql(DROP_TRIGGERS_SQL):
+                conn.execute(statement)
+            conn.execute("DELETE FROM documents")
+            conn.execute("INSERT INTO fts(fts) VALUES('delete-all')")
+            for statement in _split_sql(TRIGGERS_SQL):
+                conn.execute(statement)
+        self._prefix_indexes = {}
+
+    def get_doc_count(self) -> int:
+        """获取索引中的文档数量"""
+        return self._conn().execute("SELECT count(*) FROM documents").fetchone()[0]
+
+    def disk_bytes(self) -> int:
+        """数据库文件及 WAL 的大小"""
+        return sum(
+            os.path.getsize(path)
+            for path in (self.db_path, self.db_path + "-wal")
+            if os.path.exists(path)
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """文档数、磁盘占用以及累计写入速度"""
+        merging = self._merge_thread is not None and self._merge_thread.is_alive()
+        return {
+            'backend': 'sqlite_fts5',
+            'doc_count': self.get_doc_count(),
+            'disk_bytes': self.disk_bytes(),
+            'tokenizer': CODE_TOKENIZER,
+            'merging': merging,
+            'bulk_loading': self._bulk_thread is not None,
+            'ingest': dict(self.ingest_stats),
+        }
+
+    def close(self):
+        """关闭当前线程的连接并等待后台合并结束"""
+        self.wait_for_merge()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __repr__(self) -> str:
+        return f"SQLiteFullTextSearcher(db_path='{self.db_path}', doc_count={self.get_doc_count()})"
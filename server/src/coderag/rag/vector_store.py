@@ -0,0 +1,201 @@
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Optional, Callable
+import asyncio
+import hashlib
+import os
+
+
+# 扩展名到语言的映射，写入 payload 的 language 字段用于过滤
+LANGUAGE_BY_EXTENSION = {
+    '.py': 'python',
+    '.js': 'javascript',
+    '.jsx': 'javascript',
+    '.ts': 'typescript',
+    '.tsx': 'typescript',
+    '.java': 'java',
+    '.go': 'go',
+    '.rs': 'rust',
+    '.c': 'c',
+    '.h': 'c',
+    '.cpp': 'cpp',
+    '.hpp': 'cpp',
+    '.cs': 'csharp',
+    '.rb': 'ruby',
+    '.php': 'php',
+    '.sh': 'shell',
+    '.md': 'markdown',
+    '.json': 'json',
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.toml': 'toml',
+    '.sql': 'sql',
+    '.html': 'html',
+    '.css': 'css',
+}
+
+# 所有后端共用的过滤键
+FILTER_KEYS = ('file_path', 'path_prefix', 'language', 'dataset', 'structure_type')
+
+
+def chunk_key(record: Dict[str, Any]) -> str:
+    """分块的身份字符串：显式的 chunk_id / id 优先，否则为 文件路径:起始行:结束行
+
+    Qdrant 的点 ID 和 pgvector 的主键由它派生，同一分块重复写入时覆盖。
+    """
+    if record.get("chunk_id") is not None:
+        return f"chunk_id:{int(record['chunk_id'])}"
+    if record.get("id") is not None:
+        return f"id:{record['id']}"
+    return f"{record.get('file_path')}:{record.get('start_line')}:{record.get('end_line')}"
+
+
+def stable_chunk_id(record: Dict[str, Any]) -> int:
+    """计算分块的稳定 ID（非负 int64），即所有后端检索结果中的 chunk_id
+
+    优先使用显式的 chunk_id / id，否则由 文件路径 + 行号范围 决定，
+    同一位置的分块重新入库时得到相同的 ID，从而可以原地替换。
+    """
+    if record.get("chunk_id") is not None:
+        return int(record["chunk_id"])
+    if record.get("id") is not None:
+        key = str(record["id"])
+    else:
+        key = chunk_key(record)
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & 0x7FFFFFFFFFFFFFFF
+
+
+def detect_language(file_path: str) -> Optional[str]:
+    """根据扩展名推断代码语言"""
+    return LANGUAGE_BY_EXTENSION.get(os.path.splitext(file_path)[1].lower())
+
+
+def path_prefixes(file_path: str) -> List[str]:
+    """列出文件的全部上级目录，如 a/b/c.py -> [a, a/b]"""
+    parts = file_path.replace('\\', '/').strip('/').split('/')[:-1]
+    return ['/'.join(parts[:i + 1]) for i in range(len(parts))]
+
+
+def path_predicate(filter: Optional[Dict[str, Any]]) -> Optional[Callable[[str], bool]]:
+    """把只依赖文件路径的过滤条件（file_path / path_prefix / language）转换为路径谓词
+
+    供只保存路径和行号、没有其他 payload 的后端（FAISS）做后过滤。
+    值为列表时匹配其中任意一个；包含其他键时抛出 ValueError。
+    """
+    if not filter:
+        return None
+
+    conditions = {}
+    for key, value in filter.items():
+        if value is None:
+            continue
+        if key not in ('file_path', 'path_prefix', 'language'):
+            raise ValueError(f"Filter on '{key}' is not supported by this vector store")
+        values = list(value) if isinstance(value, (list, tuple)) else [value]
+        if key == 'path_prefix':
+            values = [v.replace('\\', '/').strip('/') for v in values]
+        conditions[key] = set(values)
+    if not conditions:
+        return None
+
+    def predicate(file_path: str) -> bool:
+        if 'file_path' in conditions and file_path not in conditions['file_path']:
+            return False
+        if 'path_prefix' in conditions and conditions['path_prefix'].isdisjoint(path_prefixes(file_path)):
+            return False
+        if 'language' in conditions and detect_language(file_path) not in conditions['language']:
+            return False
+        return True
+
+    return predicate
+
+
+class VectorStore(ABC):
+    """向量存储接口，Faiss / Qdrant / pgvector 后端统一实现
+
+    向量点格式为分块字典（embedding、file_path、start_line、end_line、content，可选 chunk_id / id 等），
+    检索结果为按分数降序的字典列表（chunk_id、file_path、start_line、end_line、content、score、rank）。
+    分块的身份由 stable_chunk_id() 决定，检索结果中的 chunk_id 在所有后端都是这个 int，
+    同一分块在各后端得到相同的值；后端内部的主键（FAISS 的 vector_id、Qdrant 的 UUID、
+    pgvector 的字符串主键）由 chunk_key() / stable_chunk_id() 派生，不对外暴露。
+    过滤条件为字典，键见 FILTER_KEYS，值为列表时匹配其中任意一个。
+
+    async 接口默认放到线程池中执行同步实现，有原生异步客户端的后端覆盖它们。
+    """
+
+    @abstractmethod
+    def upsert(self, points: List[Dict[str, Any]]) -> None:
+        """批量写入向量点，同一分块（stable_chunk_id 相同）重复写入会覆盖；写入失败时抛出异常"""
+        pass
+
+    def add_points(self, points: List[Dict[str, Any]]) -> None:
+        """等同于 upsert"""
+        self.upsert(points)
+
+    @abstractmethod
+    def delete_by_file(self, file_path: str) -> int:
+        """删除某个文件的全部分块，返回删除数量"""
+        pass
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """检索单个查询"""
+        results = self.search_batch([query_vector], top_k=top_k, filter=filter)
+        return results[0] if results else []
+
+    @abstractmethod
+    def search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """批量检索，返回与输入顺序对齐的结果列表"""
+        pass
+
+    @abstractmethod
+    def get_stats(self) -> Dict[str, Any]:
+        """统计信息，至少包含 backend 和 num_vectors"""
+        pass
+
+    def flush(self) -> None:
+        """持久化尚未落盘的写入；写入即持久的后端无需实现"""
+        pass
+
+    @abstractmethod
+    def clear_index(self) -> None:
+        """清空全部向量"""
+        pass
+
+    def close(self) -> None:
+        """释放连接等资源"""
+        pass
+
+    async def aupsert(self, points: List[Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self.upsert, points)
+
+    async def adelete_by_file(self, file_path: str) -> int:
+        return await asyncio.to_thread(self.delete_by_file, file_path)
+
+    async def asearch(
+        self,
+        query_vector: List[float],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.search, query_vector, top_k, filter)
+
+    async def asearch_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        return await asyncio.to_thread(self.search_batch, query_vectors, top_k, filter)
+
+    async def aflush(self) -> None:
+        await asyncio.to_thread(self.flush)
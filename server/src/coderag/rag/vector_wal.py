@@ -0,0 +1,135 @@
+from typing import Iterator, Tuple
+import os
+import struct
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，写入锁退化为只在进程内生效
+    fcntl = None
+
+
+class WriterLock:
+    """跨进程的写入锁（flock），同一时刻只有一个进程写预写日志、元数据和检查点
+
+    读取方不加锁。持有写入锁时没有其他进程处在“已写日志、未提交元数据”之间，
+    日志中未提交的尾部只可能是崩溃留下的，可以安全截掉。
+    进程退出（包括崩溃）时锁由操作系统释放。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        """阻塞直到拿到锁"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def release(self):
+        """释放锁（关闭文件即释放 flock）"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class VectorWriteAheadLog:
+    """向量预写日志（只追加）
+
+    每条记录由定长头部和负载组成：
+    - op: b'A' 追加向量，负载为 count x dim 的 float32 向量
+          b'D' 删除行，负载为 count 个 int64 行号
+    - start_row: 追加向量对应的起始行号（与元数据行号一致）
+    - count / dim: 数量与维度
+
+    回放时按日志顺序执行：追加记录按起始行号在元数据中取出各行的 vector_id（每个版本独有）
+    写入索引；删除记录按行号取出 vector_id 从索引移除（不支持删除的索引靠墓碑过滤）。
+    覆盖写入在日志中表现为旧版本行的删除记录加上新版本行的追加记录。
+    只回放元数据 manifest 已提交的记录，行号与 vector_id 由元数据确定，
+    因此同一份检查点加日志回放得到相同的结果。
+    """
+
+    HEADER = struct.Struct("<cQII")
+    OP_ADD = b"A"
+    OP_DELETE = b"D"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, header: bytes, payload: bytes, fsync: bool):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(header)
+            f.write(payload)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def append(self, start_row: int, vectors: np.ndarray, fsync: bool = True):
+        """追加一批向量
+
+        Args:
+            start_row: 起始行号
+            vectors: 形如 (n, d) 的 float32 向量
+            fsync: 是否立即落盘
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        header = self.HEADER.pack(self.OP_ADD, start_row, vectors.shape[0], vectors.shape[1])
+        self._write(header, vectors.tobytes(), fsync)
+
+    def append_delete(self, rows: np.ndarray, fsync: bool = True):
+        """记录一批被删除的行
+
+        Args:
+            rows: 行号数组
+            fsync: 是否立即落盘
+        """
+        rows = np.ascontiguousarray(rows, dtype=np.int64)
+        header = self.HEADER.pack(self.OP_DELETE, 0, len(rows), 0)
+        self._write(header, rows.tobytes(), fsync)
+
+    def records(self) -> Iterator[Tuple[bytes, int, int, np.ndarray]]:
+        """按顺序读取完整记录，遇到残缺记录时停止
+
+        Yields:
+            (op, start_row, end_offset, data)，end_offset 为该记录结束的文件偏移；
+            追加记录的 data 为向量，删除记录的 data 为行号
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            while True:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    return
+                op, start_row, count, dim = self.HEADER.unpack(header)
+                if op == self.OP_ADD:
+                    payload = f.read(count * dim * 4)
+                    if len(payload) < count * dim * 4:
+                        return
+                    data = np.frombuffer(payload, dtype=np.float32).reshape(count, dim)
+                elif op == self.OP_DELETE:
+                    payload = f.read(count * 8)
+                    if len(payload) < count * 8:
+                        return
+                    data = np.frombuffer(payload, dtype=np.int64)
+                else:
+                    return
+                yield op, start_row, f.tell(), data
+
+    def truncate(self, offset: int):
+        """截断到指定偏移，丢弃未提交的尾部记录；只能在持有写入锁时调用"""
+        if os.path.exists(self.path) and os.path.getsize(self.path) > offset:
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+
+    def reset(self):
+        """清空日志（检查点完成后调用）"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
@@ -0,0 +1,123 @@
+from typing import List, Dict, Any
+import os
+import uuid
+import numpy as np
+import pytest
+from coderag.settings import settings
+
+DIM = 16
+
+# pgvector 测试需要一个可写的 PostgreSQL（带 vector 扩展），未设置时跳过
+PGVECTOR_DSN = os.environ.get("CODERAG_TEST_PGVECTOR_DSN")
+requires_pgvector = pytest.mark.skipif(
+    not PGVECTOR_DSN, reason="set CODERAG_TEST_PGVECTOR_DSN to run the pgvector tests"
+)
+
+# 所有实现 VectorStore 的后端；pgvector 只在提供了数据库时运行
+BACKENDS = [
+    "faiss",
+    "faiss_sharded",
+    "qdrant_local",
+    pytest.param("pgvector", marks=requires_pgvector),
+]
+
+# 覆盖 .py / .js / .md 三种语言和两个顶层目录，过滤用例依赖这个分布
+FILES = [
+    "src/app/main.py",
+    "src/app/util.py",
+    "src/web/index.js",
+    "docs/readme.md",
+]
+
+
+def vector_for(i: int, version: int = 0) -> List[float]:
+    """第 i 个分块第 version 个版本的向量，按种子确定，测试中可以重新算出"""
+    return np.random.default_rng(i * 100 + version).normal(size=DIM).tolist()
+
+
+def content_for(i: int, version: int = 0) -> str:
+    return f"chunk {i} version {version}"
+
+
+def make_points(indices, version: int = 0) -> List[Dict[str, Any]]:
+    """生成分块向量点；同一 i 的文件路径和行范围固定，重复写入应覆盖"""
+    return [
+        {
+            "embedding": vector_for(i, version),
+            "file_path": FILES[i % len(FILES)],
+            "start_line": i * 10 + 1,
+            "end_line": i * 10 + 10,
+            "content": content_for(i, version),
+        }
+        for i in indices
+    ]
+
+
+@pytest.fixture
+def store_settings(tmp_path, monkeypatch):
+    """把所有向量存储的数据路径指向临时目录，并使用小维度向量"""
+    overrides = {
+        "embedding_dim": DIM,
+        "faiss_index_path": str(tmp_path / "faiss_index"),
+        "faiss_metadata_path": str(tmp_path / "faiss_metadata"),
+        "faiss_index_factory": "Flat",
+        "faiss_binary_prefilter": False,
+        "faiss_mmap": False,
+        "faiss_prewarm": False,
+        "projection_method": "none",
+        "projection_dim": 0,
+        "projection_path": str(tmp_path / "faiss_projection.npz"),
+        "qdrant_path": str(tmp_path / "qdrant"),
+        "qdrant_collection": "coderag_test",
+    }
+    for key, value in overrides.items():
+        monkeypatch.setattr(settings, key, value)
+    return settings
+
+
+def drop_pg_table(table: str):
+    import psycopg
+
+    with psycopg.connect(PGVECTOR_DSN, autocommit=True) as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+@pytest.fixture
+def pg_table():
+    """每个测试独立的 pgvector 表，结束后删除"""
+    pytest.importorskip("psycopg")
+    table = f"coderag_test_{uuid.uuid4().hex[:8]}"
+    yield table
+    drop_pg_table(table)
+
+
+@pytest.fixture(params=BACKENDS)
+def store(request, store_settings, monkeypatch):
+    """空的向量存储，参数化覆盖所有后端"""
+    if request.param == "faiss":
+        from coderag.rag.faiss_store import FaissStore
+
+        store = FaissStore()
+        yield store
+        store.wait_for_merge()
+        store.metadata.close()
+    elif request.param == "faiss_sharded":
+        from coderag.rag.sharded_faiss_store import ShardedFaissStore
+
+        store = ShardedFaissStore(num_shards=2)
+        yield store
+        store.close()
+    elif request.param == "qdrant_local":
+        monkeypatch.setattr(store_settings, "vector_store", "qdrant_local")
+        from coderag.rag.qdrant_store import QdrantStore
+
+        store = QdrantStore()
+        yield store
+        store.close()
+    else:
+        table = request.getfixturevalue("pg_table")
+        from coderag.rag.async_pgvector_store import AsyncPgVectorStore
+
+        store = AsyncPgVectorStore(connection_string=PGVECTOR_DSN, collection_name=table, dimension=DIM)
+        yield store
+        store.close()
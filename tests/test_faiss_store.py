@@ -0,0 +1,235 @@
+"""FaissStore 训练、覆盖写入与 PCA 拟合的回归测试"""
+import os
+import threading
+import numpy as np
+import pytest
+from conftest import DIM, FILES, content_for, make_points, vector_for
+from coderag.rag.faiss_store import FaissStore
+from coderag.rag.metadata_store import ColumnarMetadataStore
+
+
+@pytest.fixture
+def faiss_settings(store_settings, monkeypatch):
+    def configure(**overrides):
+        for key, value in overrides.items():
+            monkeypatch.setattr(store_settings, key, value)
+        return store_settings
+    return configure
+
+
+def assert_found(store, indices, version=0):
+    for i in indices:
+        results = store.search(vector_for(i, version), top_k=1)
+        assert results and results[0]["content"] == content_for(i, version)
+
+
+def test_untrained_ivf_keeps_small_batches_searchable(faiss_settings):
+    # IVF16 至少需要 16 * 39 = 624 个训练样本
+    faiss_settings(faiss_index_factory="IVF16,Flat", faiss_train_samples=100, faiss_delta_max_rows=0)
+    store = FaissStore()
+    store.upsert(make_points(range(10)))
+    assert not store.index.is_trained
+    assert_found(store, range(10))
+
+    for start in range(10, 700, 100):
+        store.upsert(make_points(range(start, min(start + 100, 700))))
+    store.flush()
+    assert store.index.is_trained
+    assert store.get_stats()["num_vectors"] == 700
+    assert_found(store, (0, 9, 350, 699))
+
+    reopened = FaissStore()
+    assert reopened.index.is_trained
+    assert_found(reopened, (0, 9, 350, 699))
+
+
+def test_untrained_ivf_survives_restart_before_training(faiss_settings):
+    faiss_settings(faiss_index_factory="IVF16,Flat", faiss_train_samples=100, faiss_delta_max_rows=0)
+    store = FaissStore()
+    store.upsert(make_points(range(50)))
+    store.flush()
+
+    reopened = FaissStore()
+    assert not reopened.index.is_trained
+    assert reopened.get_stats()["live_chunks"] == 50
+    assert_found(reopened, (0, 25, 49))
+
+
+@pytest.mark.parametrize("delta_max_rows", [0, 50])
+def test_hnsw_reupsert_does_not_return_stale_vectors(faiss_settings, delta_max_rows):
+    faiss_settings(faiss_index_factory="HNSW16", faiss_delta_max_rows=delta_max_rows)
+    store = FaissStore()
+    store.upsert(make_points(range(200)))
+    store.flush()
+    store.upsert(make_points(range(20), version=1))
+    store.flush()
+
+    def check(s):
+        assert_found(s, range(20), version=1)
+        for i in range(20):
+            results = s.search(vector_for(i, 0), top_k=20)
+            contents = [doc["content"] for doc in results]
+            assert content_for(i, 0) not in contents
+            assert contents.count(content_for(i, 1)) <= 1
+            # 旧向量仍在索引中时会以接近 1 的分数命中（并映射到新版本的元数据）
+            assert all(doc["score"] < 0.99 for doc in results)
+
+    check(store)
+    check(FaissStore())
+
+    # 压缩后主索引只剩存活的向量
+    store.compact()
+    assert store.index.ntotal + store.delta_size == 200
+    check(store)
+
+
+def test_main_index_search_does_not_block_writes(faiss_settings, monkeypatch):
+    faiss_settings(faiss_index_factory="HNSW16", faiss_delta_max_rows=10 ** 6)
+    store = FaissStore()
+    store.upsert(make_points(range(100)))
+    store.merge_delta()
+    assert store.index.ntotal == 100
+
+    # 主索引的检索在锁外进行，停在检索中途时写入和删除照常完成
+    searching, resume = threading.Event(), threading.Event()
+    search = store.index.search
+
+    def paused_search(*args, **kwargs):
+        searching.set()
+        resume.wait(10)
+        return search(*args, **kwargs)
+
+    monkeypatch.setattr(store.index, "search", paused_search)
+    results = []
+    reader = threading.Thread(target=lambda: results.append(store.search(vector_for(0), top_k=1)))
+    reader.start()
+    assert searching.wait(10)
+
+    def write():
+        store.upsert(make_points([101]))
+        store.delete_by_file(FILES[0])
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join(10)
+    assert not writer.is_alive()
+    resume.set()
+    reader.join()
+
+    # 检索期间被删除的分块不会出现在结果中
+    assert results[0] and results[0][0]["content"] != content_for(0)
+    assert_found(store, [101])
+
+
+def test_pca_buffers_points_until_it_can_be_fitted(faiss_settings):
+    faiss_settings(projection_method="pca", projection_dim=8, projection_fit_samples=50)
+    store = FaissStore()
+    store.upsert(make_points(range(10)))
+    assert store.projector.needs_fit
+    assert store.get_stats()["pending_fit_points"] == 10
+    # 拟合前在暂存的向量点上精确检索
+    assert_found(store, range(10))
+    filtered = store.search(vector_for(0), top_k=10, filter={"file_path": FILES[1]})
+    assert {doc["file_path"] for doc in filtered} == {FILES[1]}
+
+    # 暂存的向量点在重启后仍然保留，删除文件时一并删除
+    store = FaissStore()
+    assert store.get_stats()["pending_fit_points"] == 10
+    assert store.delete_by_file(FILES[0]) == 3
+    assert all(doc["file_path"] != FILES[0] for doc in store.search(vector_for(0), top_k=10))
+    store.upsert(make_points(range(0, 10, 4)))
+
+    store.upsert(make_points(range(10, 55)))
+    assert not store.projector.needs_fit
+    assert store.get_stats()["pending_fit_points"] == 0
+    assert store.get_stats()["live_chunks"] == 55
+    assert_found(store, (0, 9, 10, 54))
+
+
+def test_metadata_rewrite_keeps_vector_ids(tmp_path):
+    metadata = ColumnarMetadataStore(str(tmp_path / "meta"))
+    metadata.extend([
+        {"chunk_id": i, "file_path": "a.py", "content": f"c{i}"}
+        for i in range(6)
+    ])
+    metadata.extend([{"chunk_id": 2, "file_path": "a.py", "content": "c2 new"}])
+    metadata.add_tombstones(np.array([1, 2]))
+    assert metadata.latest_rows(np.array([2, 9])).tolist() == [6, -1]
+
+    metadata.rewrite(metadata.live_rows())
+    assert metadata.vector_ids[:].tolist() == [0, 3, 4, 5, 6]
+    assert metadata.rows_for_vector_ids(np.array([6, 1, 0])).tolist() == [4, -1, 0]
+    assert metadata.latest_rows(np.array([2])).tolist() == [4]
+
+    # 压缩掉的 vector_id 不会被复用
+    metadata.extend([{"chunk_id": 7, "file_path": "b.py", "content": "c7"}])
+    assert int(metadata.vector_ids[-1]) == 7
+
+
+def test_reader_does_not_truncate_an_in_flight_write(faiss_settings, monkeypatch):
+    faiss_settings(faiss_checkpoint_rows=10 ** 6)
+    writer = FaissStore()
+    writer.upsert(make_points(range(10)))
+    writer.flush()
+
+    # 写入方已写完预写日志、还没提交元数据时打开一个读取方
+    logged, resume = threading.Event(), threading.Event()
+    extend = writer.metadata.extend
+
+    def paused_extend(*args, **kwargs):
+        logged.set()
+        resume.wait(10)
+        return extend(*args, **kwargs)
+
+    monkeypatch.setattr(writer.metadata, "extend", paused_extend)
+    thread = threading.Thread(target=writer.upsert, args=(make_points(range(10, 15)),))
+    thread.start()
+    assert logged.wait(10)
+    wal_bytes = writer.wal.size_bytes()
+    reader = FaissStore()
+    assert reader.get_stats()["live_chunks"] == 10
+    assert writer.wal.size_bytes() == wal_bytes
+    resume.set()
+    thread.join()
+
+    assert_found(FaissStore(), range(15))
+
+
+def test_writer_truncates_crashed_tail_and_sees_other_writers(faiss_settings):
+    faiss_settings(faiss_checkpoint_rows=10 ** 6)
+    first = FaissStore()
+    first.upsert(make_points(range(10)))
+    # 崩溃留下的未提交记录
+    first.wal.append(len(first.metadata), np.ones((3, DIM), dtype=np.float32))
+
+    second = FaissStore()
+    second.upsert(make_points(range(10, 20)))
+    # first 加载之后 second 提交过写入，first 写入前重新加载而不是覆盖
+    first.upsert(make_points(range(20, 30)))
+
+    reopened = FaissStore()
+    assert reopened.get_stats()["live_chunks"] == 30
+    assert_found(reopened, (0, 15, 29))
+
+
+def test_metadata_rewrite_crash_keeps_previous_generation(tmp_path, monkeypatch):
+    directory = str(tmp_path / "meta")
+    metadata = ColumnarMetadataStore(directory)
+    metadata.extend([{"chunk_id": i, "file_path": "a.py", "content": f"c{i}"} for i in range(4)])
+    metadata.add_tombstones(np.array([0]))
+
+    # 新一代写完、提交 manifest 之前崩溃
+    def crash(manifest):
+        raise OSError("crash")
+
+    monkeypatch.setattr(metadata, "_write_manifest", crash)
+    with pytest.raises(OSError):
+        metadata.rewrite(metadata.live_rows())
+    reopened = ColumnarMetadataStore(directory)
+    assert len(reopened) == 4 and reopened.num_tombstones == 1
+    assert reopened[3]["content"] == "c3"
+
+    reopened.rewrite(reopened.live_rows())
+    assert sorted(os.listdir(directory)) == ["g1", "manifest.json"]
+    reopened = ColumnarMetadataStore(directory)
+    assert [reopened[i]["content"] for i in range(len(reopened))] == ["c1", "c2", "c3"]
@@ -0,0 +1,109 @@
+"""PgVectorStore（psycopg3 同步实现）的回归测试，需要 CODERAG_TEST_PGVECTOR_DSN"""
+import pytest
+from conftest import DIM, PGVECTOR_DSN, content_for, requires_pgvector, vector_for
+
+pytestmark = requires_pgvector
+
+NUM_TEXTS = 60
+
+
+@pytest.fixture(params=[False, True], ids=["float", "binary"])
+def pg_store(request, pg_table):
+    pytest.importorskip("psycopg_pool")
+    from coderag.rag.pgvector_store import PgVectorStore
+
+    store = PgVectorStore(
+        connection_string=PGVECTOR_DSN,
+        collection_name=pg_table,
+        dimension=DIM,
+        binary_index=request.param,
+    )
+    store.add_texts(
+        texts=[content_for(i) for i in range(NUM_TEXTS)],
+        embeddings=[vector_for(i) for i in range(NUM_TEXTS)],
+        metadatas=[{"document_id": f"doc{i % 3}.py", "language": "python"} for i in range(NUM_TEXTS)],
+        ids=[f"chunk-{i}" for i in range(NUM_TEXTS)],
+    )
+    yield store
+    store.close()
+
+
+def test_similarity_search_finds_each_text(pg_store):
+    for i in (0, 17, NUM_TEXTS - 1):
+        assert pg_store.similarity_search(vector_for(i), k=1)[0]["id"] == f"chunk-{i}"
+
+
+def test_search_batch_matches_similarity_search(pg_store):
+    indices = [2, 9, 33]
+    batch = pg_store.search_batch([vector_for(i) for i in indices], k=5)
+    for i, results in zip(indices, batch):
+        single = pg_store.similarity_search(vector_for(i), k=5)
+        assert [r["id"] for r in results] == [r["id"] for r in single]
+
+
+def test_filters_agree_between_single_and_batch(pg_store):
+    filter = {"document_id": "doc1.py"}
+    single = pg_store.similarity_search(vector_for(4), k=10, filter=filter)
+    batch = pg_store.search_batch([vector_for(4)], k=10, filter=filter)[0]
+    assert single and all(r["document_id"] == "doc1.py" for r in single)
+    assert [r["id"] for r in batch] == [r["id"] for r in single]
+
+
+def test_search_returns_more_results_than_default_ef_search(pg_store):
+    k = NUM_TEXTS - 5
+    assert len(pg_store.similarity_search(vector_for(3), k=k)) == k
+    assert [len(results) for results in pg_store.search_batch([vector_for(3), vector_for(8)], k=k)] == [k, k]
+
+
+def test_hybrid_search_uses_the_text_query(pg_store):
+    results = pg_store.hybrid_search(content_for(7), vector_for(7), k=3)
+    assert results[0]["id"] == "chunk-7"
+
+
+def test_hybrid_search_returns_more_candidates_than_default_ef_search(pg_store):
+    # 默认 hnsw.ef_search 为 40，候选数超过它时需要按候选数调高
+    results = pg_store.hybrid_search(content_for(7), vector_for(7), k=NUM_TEXTS)
+    assert len(results) == NUM_TEXTS
+
+
+@pytest.mark.parametrize("driver", ["sync", "async"])
+def test_legacy_search_vector_column_is_migrated(driver, pg_table, store_settings):
+    pytest.importorskip("psycopg_pool")
+    import psycopg
+
+    with psycopg.connect(PGVECTOR_DSN, autocommit=True) as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        # 旧版本的表：search_vector 是普通列
+        conn.execute(
+            f"""
+            CREATE TABLE {pg_table} (
+                id SERIAL PRIMARY KEY,
+                chunk_id VARCHAR(255) UNIQUE NOT NULL,
+                document_id VARCHAR(255) NOT NULL,
+                content TEXT NOT NULL,
+                embedding vector({DIM}),
+                search_vector tsvector,
+                metadata JSONB,
+                create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+
+    if driver == "sync":
+        from coderag.rag.pgvector_store import PgVectorStore
+
+        store = PgVectorStore(connection_string=PGVECTOR_DSN, collection_name=pg_table, dimension=DIM)
+        store.connect()
+    else:
+        from coderag.rag.async_pgvector_store import AsyncPgVectorStore
+
+        store = AsyncPgVectorStore(connection_string=PGVECTOR_DSN, collection_name=pg_table, dimension=DIM)
+        store.search(vector_for(0), top_k=1)
+    store.close()
+
+    with psycopg.connect(PGVECTOR_DSN) as conn:
+        row = conn.execute(
+            "SELECT attgenerated FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'search_vector'",
+            [pg_table]
+        ).fetchone()
+    assert row == ("s",)
@@ -0,0 +1,56 @@
+"""ShardedFaissStore 分片进程配置、重平衡与 PCA 暂存的回归测试"""
+from conftest import FILES, content_for, make_points, vector_for
+from coderag.rag.sharded_faiss_store import ShardedFaissStore
+
+
+def test_shards_use_settings_changed_in_code(store_settings, monkeypatch):
+    # 分片进程只会从环境变量读配置，代码中改过的配置需要由协调进程传入
+    monkeypatch.setattr(store_settings, "faiss_index_factory", "HNSW16")
+    monkeypatch.setattr(store_settings, "faiss_binary_prefilter", True)
+    monkeypatch.setattr(store_settings, "faiss_delta_max_rows", 7)
+    store = ShardedFaissStore(num_shards=2)
+    try:
+        for shard_stats in store.get_stats()["shards"]:
+            assert shard_stats["index_factory"] == "HNSW16"
+            assert shard_stats["binary_prefilter"]
+    finally:
+        store.close()
+
+
+def test_rebalance_keeps_every_chunk(store_settings):
+    store = ShardedFaissStore(num_shards=2)
+    try:
+        store.upsert(make_points(range(30)))
+        store.rebalance(3)
+        stats = store.get_stats()
+        assert stats["num_shards"] == 3
+        assert stats["live_chunks"] == 30
+    finally:
+        store.close()
+
+    reopened = ShardedFaissStore(num_shards=3)
+    try:
+        assert reopened.num_shards == 3
+        assert reopened.get_stats()["live_chunks"] == 30
+    finally:
+        reopened.close()
+
+
+def test_pca_pending_points_are_searchable(store_settings, monkeypatch):
+    monkeypatch.setattr(store_settings, "projection_method", "pca")
+    monkeypatch.setattr(store_settings, "projection_dim", 8)
+    monkeypatch.setattr(store_settings, "projection_fit_samples", 50)
+    store = ShardedFaissStore(num_shards=2)
+    try:
+        store.upsert(make_points(range(10)))
+        assert store.projector.needs_fit
+        assert store.search(vector_for(3), top_k=1)[0]["content"] == content_for(3)
+
+        store.delete_by_file(FILES[3])
+        assert all(doc["file_path"] != FILES[3] for doc in store.search(vector_for(3), top_k=10))
+
+        store.upsert(make_points(range(10, 60)))
+        assert not store.projector.needs_fit
+        assert store.get_stats()["live_chunks"] == 58
+    finally:
+        store.close()
@@ -0,0 +1,137 @@
+"""VectorStore 接口一致性测试：同一组用例跑在所有后端上（pgvector 需要 CODERAG_TEST_PGVECTOR_DSN）"""
+import asyncio
+import pytest
+from conftest import FILES, content_for, make_points, vector_for
+from coderag.rag.vector_store import detect_language, stable_chunk_id
+
+NUM_POINTS = 40
+
+
+@pytest.fixture
+def loaded(store):
+    store.upsert(make_points(range(NUM_POINTS)))
+    store.flush()
+    return store
+
+
+def top_contents(store, vector, top_k=5, **kwargs):
+    return [doc["content"] for doc in store.search(vector, top_k=top_k, **kwargs)]
+
+
+def test_upsert_then_search_finds_each_point(loaded):
+    for i in (0, 7, 21, NUM_POINTS - 1):
+        results = loaded.search(vector_for(i), top_k=3)
+        assert results[0]["content"] == content_for(i)
+        assert results[0]["file_path"] == FILES[i % len(FILES)]
+        assert results[0]["start_line"] == i * 10 + 1
+        assert [doc["rank"] for doc in results] == list(range(1, len(results) + 1))
+        assert results[0]["score"] >= results[-1]["score"]
+
+
+def test_chunk_id_is_stable_chunk_id(loaded):
+    results = loaded.search(vector_for(5), top_k=1)
+    assert results[0]["chunk_id"] == stable_chunk_id(make_points([5])[0])
+
+
+def test_explicit_chunk_id_identifies_the_chunk(store):
+    # 显式 chunk_id 不同的两个点即使路径和行范围相同也是两个分块
+    first, second = make_points([1, 2])
+    second.update(file_path=first["file_path"], start_line=first["start_line"], end_line=first["end_line"])
+    first["chunk_id"], second["chunk_id"] = 101, 102
+    store.upsert([first, second])
+    store.flush()
+    assert store.get_stats()["num_vectors"] == 2
+    assert store.search(vector_for(2), top_k=1)[0]["chunk_id"] == 102
+
+
+def test_failed_upsert_raises(store):
+    point = make_points([0])[0]
+    point["embedding"] = point["embedding"][:3]
+    with pytest.raises(Exception):
+        store.upsert([point])
+        store.flush()
+
+
+def test_reupsert_is_idempotent(loaded):
+    loaded.upsert(make_points(range(NUM_POINTS)))
+    loaded.flush()
+    assert loaded.get_stats()["num_vectors"] == NUM_POINTS
+    assert top_contents(loaded, vector_for(3), top_k=NUM_POINTS).count(content_for(3)) == 1
+
+
+def test_reupsert_replaces_previous_version(loaded):
+    loaded.upsert(make_points(range(10), version=1))
+    loaded.flush()
+    assert loaded.get_stats()["num_vectors"] == NUM_POINTS
+    for i in range(10):
+        assert top_contents(loaded, vector_for(i, 1), top_k=1) == [content_for(i, 1)]
+        # 旧版本的向量不应再被检索到
+        assert content_for(i, 0) not in top_contents(loaded, vector_for(i, 0), top_k=NUM_POINTS)
+
+
+def test_delete_by_file(loaded):
+    target = FILES[1]
+    expected = sum(1 for i in range(NUM_POINTS) if FILES[i % len(FILES)] == target)
+    assert loaded.delete_by_file(target) == expected
+    loaded.flush()
+    assert loaded.get_stats()["num_vectors"] == NUM_POINTS - expected
+    for i in range(1, NUM_POINTS, len(FILES)):
+        assert all(doc["file_path"] != target for doc in loaded.search(vector_for(i), top_k=10))
+    assert loaded.delete_by_file(target) == 0
+
+
+@pytest.mark.parametrize("filter, accept", [
+    ({"file_path": FILES[0]}, lambda path: path == FILES[0]),
+    ({"file_path": [FILES[0], FILES[2]]}, lambda path: path in (FILES[0], FILES[2])),
+    ({"path_prefix": "src/app"}, lambda path: path.startswith("src/app/")),
+    ({"path_prefix": "src"}, lambda path: path.startswith("src/")),
+    ({"language": "javascript"}, lambda path: detect_language(path) == "javascript"),
+    ({"language": ["python", "markdown"]}, lambda path: detect_language(path) in ("python", "markdown")),
+])
+def test_filters(loaded, filter, accept):
+    expected = sum(1 for i in range(NUM_POINTS) if accept(FILES[i % len(FILES)]))
+    for i in (0, 2, 3):
+        results = loaded.search(vector_for(i), top_k=NUM_POINTS, filter=filter)
+        assert results
+        assert all(accept(doc["file_path"]) for doc in results)
+    assert len(results) == expected
+
+
+def test_search_batch_matches_search(loaded):
+    indices = [1, 5, 9, 30]
+    batch = loaded.search_batch([vector_for(i) for i in indices], top_k=4)
+    assert len(batch) == len(indices)
+    for i, results in zip(indices, batch):
+        assert results[0]["content"] == content_for(i)
+        single = loaded.search(vector_for(i), top_k=4)
+        assert [doc["content"] for doc in results] == [doc["content"] for doc in single]
+
+
+def test_search_batch_with_filter_and_empty_input(loaded):
+    assert loaded.search_batch([], top_k=3) == []
+    batch = loaded.search_batch([vector_for(0), vector_for(2)], top_k=3, filter={"language": "python"})
+    assert all(detect_language(doc["file_path"]) == "python" for results in batch for doc in results)
+
+
+def test_stats(store):
+    stats = store.get_stats()
+    assert isinstance(stats["backend"], str)
+    assert stats["num_vectors"] == 0
+    store.upsert(make_points(range(12)))
+    store.flush()
+    assert store.get_stats()["num_vectors"] == 12
+
+
+def test_async_interface(store):
+    async def run():
+        await store.aupsert(make_points(range(8)))
+        await store.aflush()
+        single = await store.asearch(vector_for(3), top_k=1)
+        batch = await store.asearch_batch([vector_for(1), vector_for(6)], top_k=1)
+        deleted = await store.adelete_by_file(FILES[1])
+        return single, batch, deleted
+
+    single, batch, deleted = asyncio.run(run())
+    assert single[0]["content"] == content_for(3)
+    assert [results[0]["content"] for results in batch] == [content_for(1), content_for(6)]
+    assert deleted == 2
@@ -0,0 +1,100 @@
+"""VectorStore 性能回归测试：检索延迟、批量检索收益与召回率
+
+延迟预算按本地开发机设定并留有余量，较慢的 CI 机器可以用 CODERAG_TEST_LATENCY_SCALE 放宽。
+只跑性能测试：pytest -m performance；跳过：pytest -m "not performance"。
+"""
+import os
+import time
+import numpy as np
+import pytest
+from conftest import make_points, vector_for
+from coderag.eval.bench_utils import exact_top_k, latency_summary, normalize, sample_queries
+
+pytestmark = pytest.mark.performance
+
+NUM_POINTS = 2000
+NUM_QUERIES = 100
+TOP_K = 10
+LATENCY_SCALE = float(os.environ.get("CODERAG_TEST_LATENCY_SCALE", "1"))
+
+# 单次检索 P95 延迟预算（毫秒）
+P95_BUDGET_MS = {
+    "faiss": 10,
+    "faiss_sharded": 50,
+    "qdrant_local": 100,
+    "pgvector": 50,
+}
+
+
+@pytest.fixture
+def corpus(store):
+    """写入 NUM_POINTS 个点，返回 (存储, 归一化后的语料向量, 查询向量)"""
+    points = make_points(range(NUM_POINTS))
+    for start in range(0, NUM_POINTS, 500):
+        store.upsert(points[start:start + 500])
+    store.flush()
+    vectors = normalize([p["embedding"] for p in points])
+    return store, vectors, sample_queries(vectors, NUM_QUERIES)
+
+
+def backend_of(request) -> str:
+    return request.node.callspec.params["store"]
+
+
+def point_index(result) -> int:
+    # content 为 "chunk {i} version {v}"
+    return int(result["content"].split()[1])
+
+
+def test_search_latency_within_budget(request, corpus):
+    store, _, queries = corpus
+    store.search(queries[0].tolist(), top_k=TOP_K)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.search(query.tolist(), top_k=TOP_K)
+        latencies.append((time.perf_counter() - start) * 1000)
+    summary = latency_summary(latencies)
+    budget = P95_BUDGET_MS[backend_of(request)] * LATENCY_SCALE
+    assert summary["p95_latency_ms"] <= budget, summary
+
+
+def test_search_batch_is_not_slower_than_single_searches(corpus):
+    store, _, queries = corpus
+    query_list = [query.tolist() for query in queries]
+    store.search_batch(query_list[:2], top_k=TOP_K)
+
+    # 各取三轮中最快的一轮，减少调度抖动的影响
+    single_seconds = batch_seconds = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for query in query_list:
+            store.search(query, top_k=TOP_K)
+        single_seconds = min(single_seconds, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        batch = store.search_batch(query_list, top_k=TOP_K)
+        batch_seconds = min(batch_seconds, time.perf_counter() - start)
+
+    assert len(batch) == NUM_QUERIES
+    # 批量检索应当摊薄每次调用的固定开销，至少不能比逐条检索更慢（留 50% 余量吸收抖动）
+    assert batch_seconds <= single_seconds * 1.5, (batch_seconds, single_seconds)
+
+
+def test_recall_against_exact_search(corpus):
+    store, vectors, queries = corpus
+    expected = exact_top_k(vectors, queries, TOP_K)
+    batch = store.search_batch([query.tolist() for query in queries], top_k=TOP_K)
+    hits = sum(
+        len({point_index(r) for r in results} & set(truth.tolist()))
+        for results, truth in zip(batch, expected)
+    )
+    assert hits / (NUM_QUERIES * TOP_K) >= 0.95
+
+
+def test_scores_are_cosine_similarities(corpus):
+    store, vectors, _ = corpus
+    query = np.asarray(vector_for(NUM_POINTS + 1), dtype=np.float32)
+    results = store.search(query.tolist(), top_k=3)
+    expected = vectors[[point_index(r) for r in results]] @ normalize(query[None])[0]
+    np.testing.assert_allclose([r["score"] for r in results], expected, atol=1e-3)